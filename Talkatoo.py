@@ -8,108 +8,86 @@ This Python script takes the broad approach:
     Check kingdom/moons/story moons periodically
 """
 
+from audio import AudioPassthrough, PyAudioBackend
+from border_tracker import BorderTracker
+from capture import DeviceCapture, open_capture
+import ctypes
 import cv2  # pip install opencv-python
-import easyocr  # pip install easyocr
+from detection import *
 import eel  # pip install eel
+from engine import DetectionEngine
+from event_log import INFO, LOG_LEVEL, LOG_PATH, LEVEL_NAMES, event_log
 from json import dumps
-from PIL import Image, ImageGrab  # pip install pillow
+import multiprocessing
 import platform
 import pyaudio
 from pygrabber.dshow_graph import FilterGraph  # pip install pygrabber
+from frame_buffer import FrameRing
+from preview import PreviewStream, build_overlay, PREVIEW_BOUNDARY
+from run_state import RunState, project_moon
 import threading
 import time
-import torch  # pip install torch
-import torchvision.transforms as transforms
 from util_functions import *
 from window_capture import *
 import warnings
 warnings.filterwarnings('ignore')
 
 
-# Each language performs best under different thresholds and values
-ASIAN_MOON_BOUNDS = (300, 525, 950, 575)
-DEFAULT_MOON_BOUNDS = (250, 535, 1100, 585)
-JAPANESE_MOON_BOUNDS = (375, 535, 900, 590)
-
-ASIAN_TALKATOO_BOUNDS = (350, 565, 1000, 615)  # Line 1 of 1
-DEFAULT_TALKATOO_BOUNDS_2 = (350, 590, 1000, 640)  # Line 2 of 2
-DEFAULT_TALKATOO_BOUNDS_3 = (350, 610, 1000, 660)  # Line 3 of 3
-TALKATOO_BOUNDS_FR = (300, 565, 900, 615)  # Line 1 of 1
-TALKATOO_BOUNDS_NL = (350, 560, 1000, 620)  # Line 2 of 3
-TALKATOO_BOUNDS_ES = (350, 565, 1000, 615)  # Line 1 of 1
-
-LANGUAGES = {
-             "english": {"Language": "en", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 12, "Score": 0,
-                         "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_2},
-             "chinese_traditional": {"Language": "ch_tra", "Text_Lower": 0.15, "Text_Upper": 0.75, "Text_Height": 20,
-                                     "Score": -2, "Moon_Bounds": ASIAN_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
-             "chinese_simplified": {"Language": "ch_sim", "Text_Lower": 0.15, "Text_Upper": 0.75, "Text_Height": 20,
-                                    "Score": -2, "Moon_Bounds": ASIAN_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
-             "japanese": {"Language": "ja", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 20, "Score": 2,
-                          "Moon_Bounds": JAPANESE_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
-             "korean": {"Language": "ko", "Text_Lower": 0.1, "Text_Upper": 0.55, "Text_Height": 20, "Score": 0,
-                        "Moon_Bounds": ASIAN_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
-             "dutch": {"Language": "nl", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
-                       "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_NL},
-             "french_canada": {"Language": "fr", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
-                               "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_FR},
-             "french_france": {"Language": "fr", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
-                               "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_FR},
-             "german": {"Language": "de", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12,
-                        "Score": 2, "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_3},
-             "italian": {"Language": "it", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 12, "Score": 0,
-                         "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_2},
-             "spanish_spain": {"Language": "es", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
-                               "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_ES},
-             "spanish_latin_america": {"Language": "es", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
-                                       "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_3},
-             "russian": {"Language": "ru", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 12, "Score": 0,
-                         "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_2}
-             }
-
-DEFAULT_GAME_LANGUAGE = "chinese_traditional"
-DEFAULT_GUI_LANGUAGE = "english"
 DEFAULT_AUDIO_INDEX = 0
 DEFAULT_VIDEO_INDEX = 0
+AUDIO_BUFFER_FRAMES = 256  # Frames per audio callback, lower is less latency but more likely to crackle on busy machines
+VIDEO_SOURCE = None  # Video file or directory of PNG frames to read instead of the video device, to test with recorded footage
 FULLSCREEN = True  # Fullscreen on Windows
-GUI_SIZE = ImageGrab.grab().size if FULLSCREEN else (1280, 720)  # Take screenshot to check screen size
-IM_WIDTH = 1280  # This number should not change
-IM_HEIGHT = 720  # This number should not change
-IMG_PATH = "gui/assets/border_reset_img.png"  # used for GUI checking
+SM_CXSCREEN, SM_CYSCREEN = 0, 1  # GetSystemMetrics indices of the primary screen's width and height
 SETTINGS_PATH = "settings.json"  # used for persisting settings
 PENDING_MOONS_PATH = "pending-moons.txt" # can be used to display pending moons in OBS
 
-# Borders for critical areas, given constant screen size
-KINGDOM_BORDERS = (161, 27, 211, 77)
-RED_BORDERS = (0, 0, 128, 50)
-STORY_BORDERS = (210, 240, 260, 368)
-MULTI_BORDERS = (870, 170, 950, 250)
-STORY_TEXT_BORDERS = (300, 550, 950, 610)
-
-KINGDOM_TIMER = 3
-MOON_TIMER = 0.5
-STORY_MOON_TIMER = 0.5
-
-KINGDOM_CERTAINTY = 0.85  # Classifier certainty to prevent uncertain kingdom switches (must occur 2 times in a row)
-POSS_MOON_CERTAINTY = 0.1  # Show moon percentage if it's at least 10% possible
-VERBOSE = True
-
-MAX_STORY = {"Cap": 0, "Cascade": 2, "Sand": 4, "Lake": 1, "Wooded": 4, "Cloud": 0, "Lost": 0, "Metro": 7,
-             "Snow": 5, "Seaside": 5, "Luncheon": 5, "Ruined": 1, "Bowsers": 4, "Moon": 0, "Mushroom": 38,
-             "Dark": 1, "Darker": 1}
-MAX_MAINGAME = {"Cap": 0, "Cascade": 25, "Sand": 69, "Lake": 33, "Wooded": 54, "Cloud": 0, "Lost": 25, "Metro": 66,
-                "Snow": 37, "Seaside": 52, "Luncheon": 56, "Ruined": 5, "Bowsers": 45, "Moon": 27, "Mushroom": 0,
-                "Dark": 0, "Darker": 0}
+FRAME_WAIT = 0.01  # Longest the main loop blocks waiting for a frame before letting the GUI run
+FRAME_RING_SIZE = 4
+ASYNC_OCR = True  # Read text on a worker thread so the loop keeps sampling frames during OCR
+MULTIPROCESS_ENGINE = False  # Run detection in separate processes fed through shared memory instead
+STARTUP_POLL = 0.05  # How often the GUI gets startup progress while the models load
+LOG_STATS_INTERVAL = 10  # Seconds between records of check timings, cache hits and audio latency in the event log
+BORDER_TRACKING = True  # Follow the game image when the capture shifts mid-run, see border_tracker.py
+PREVIEW_PATH = "/preview.jpg"  # Newest capture preview with the checked boxes, served from memory, see preview.py
+PREVIEW_STREAM_PATH = "/preview.mjpg"  # Same as a stream, ?fps= lowers the frame rate
+LEGACY_PREVIEW_PATH = "/assets/border_reset_img.png"  # Where GUI builds from before the preview stream look for it
 
 
 ########################################################################################################################
 # Functions that can be called by the JS GUI via eel
 ########################################################################################################################
 
-# Expose the kingdom moons dictionary to the gui
+# Languages the GUI asked for, all of them if it didn't
+# The shipped GUI build never asks and looks names up by the languages picked in its settings, so it needs every one
+def gui_languages(languages):
+    return list(dict.fromkeys(language for language in languages or LANGUAGES if language in LANGUAGES))
+
+# Expose the kingdom moons dictionary to the gui, with the names of the given languages (all if None)
+@eel.expose
+def get_moons_by_kingdom(languages=None):
+    languages = gui_languages(languages)
+    return {kingdom: [project_moon(moon, languages) for moon in moons] for kingdom, moons in moons_by_kingdom.items()}
+
+# Expose the whole run state, the GUI keeps it up to date with the deltas sent by send_to_gui
 @eel.expose
-def get_moons_by_kingdom():
-    return moons_by_kingdom
+def get_run_state(languages=None):
+    return run_state.snapshot(gui_languages(languages))
+
+# Allow the gui to change the run state, returns the delta with the change (None if nothing changed)
+@eel.expose
+def run_action(action, args):
+    if action == "mention":
+        run_state.mention(args[0], detected=False)
+    elif action == "collect":
+        run_state.collect(args[0], detected=False)
+    elif action == "uncollect":
+        run_state.uncollect(args[0])
+    elif action == "choose_option":
+        run_state.choose_option(*args)
+    elif action == "delete":
+        run_state.delete(*args)
+    return run_state.flush()
 
 # Allow the gui to request the list of currently open windows
 @eel.expose
@@ -131,6 +109,11 @@ def is_video_playing():
 def is_audio_playing():
     return output_audio
 
+# Allow the gui to check the audio latency and how often it glitched
+@eel.expose
+def get_audio_stats():
+    return audio.stats()
+
 # Allow the gui to see possible audio devices
 @eel.expose
 def get_audio_devices():
@@ -156,53 +139,87 @@ def get_video_devices():
 # Allow the gui to set the current kingdom
 @eel.expose
 def set_current_kingdom(kingdom_name):
-    global current_kingdom
-
-    if kingdom_name in kingdom_list:
-        current_kingdom = kingdom_name
-        eel.set_current_kingdom(current_kingdom)
+    if detector.set_current_kingdom(kingdom_name):
+        run_state.set_kingdom(kingdom_name)
+        eel.set_current_kingdom(kingdom_name)
         if VERBOSE:
-            print("Kingdom changed to: ", kingdom_name)
+            event_log.info("kingdom", kingdom=kingdom_name)
 
 
-# Allow the gui to reset the borders of the capture card feed
+# Allow the gui to change how much goes into the event log while running, returns the level or False if it is unknown
 @eel.expose
+def set_log_level(level):
+    try:
+        level = event_log.set_level(level)
+    except (KeyError, ValueError):
+        return False
+    if MULTIPROCESS_ENGINE:
+        detector.set_log_level(level)
+    return level
+
+
+# Allow the gui to reset the borders of the capture card feed, once the capture is open
+@eel.expose("reset_borders")
+def gui_reset_borders(window_hwnd=None):
+    if not capture_ready.is_set():
+        return None
+    return reset_borders(window_hwnd)
+
+
+# Reset the borders of the capture card feed, the GUI shows the result through the preview
 def reset_borders(window_hwnd=None):
     global window_stream
 
     if window_hwnd is not None:
         window_stream = WindowCapture(window_hwnd, window_capture_cropping)
 
-    new_borders, img_arr = reset_capture_borders()
-    if not new_borders:
+    if not reset_capture_borders()[0]:
         return None
-    # Save image so it can be displayed in the GUI
-    path = internal_resource_path(IMG_PATH)
-
-    # Draw lines around story text
-    preview_img = np.array(Image.fromarray(img_arr[borders[1]:borders[3], borders[0]:borders[2]]).resize((IM_WIDTH, IM_HEIGHT)))
-    rotated_img = np.array(Image.fromarray(preview_img).rotate(-3.5))
-    mask = np.zeros((STORY_TEXT_BORDERS[3] - STORY_TEXT_BORDERS[1], STORY_TEXT_BORDERS[2] - STORY_TEXT_BORDERS[0]), dtype=bool)
-    mask[0] = mask[:, 0] = mask[-1] = mask[:, -1] = True
-    rotated_img[STORY_TEXT_BORDERS[1]:STORY_TEXT_BORDERS[3], STORY_TEXT_BORDERS[0]:STORY_TEXT_BORDERS[2]][mask] = np.array([0, 255, 0])  # Green
-    rotated_img = np.array(Image.fromarray(rotated_img).rotate(3.5))
-    preview_img[50:-50, 50:-50] = rotated_img[50:-50, 50:-50]
-
-    # Draw lines around purple coin counter, moon text, and talkatoo text
-    colors = [np.array([255, 165, 0]), np.array([255, 0, 0]), np.array([255, 165, 0])]
-    for i, curr_borders in enumerate([KINGDOM_BORDERS, language_settings["Moon_Bounds"], language_settings["Talkatoo_Bounds"]]):
-        mask = np.zeros((curr_borders[3]-curr_borders[1], curr_borders[2]-curr_borders[0]), dtype=bool)
-        mask[0] = mask[:, 0] = mask[-1] = mask[:, -1] = True
-        preview_img[curr_borders[1]:curr_borders[3], curr_borders[0]:curr_borders[2]][mask] = colors[i]
-    Image.fromarray(preview_img).save(path)
-    return path
+    return PREVIEW_PATH
+
+
+########################################################################################################################
+# Capture preview served to the GUI from memory
+########################################################################################################################
+
+# Newest frame, its borders and the language settings for the preview, None until the capture is open
+def preview_source():
+    if frame_ring is None or borders is None:
+        return None
+    latest = frame_ring.latest()
+    return (latest[2], borders, detector.language_settings) if latest else None
+
+
+# Boxes the detector checks with the given language settings, drawn once per language
+def preview_overlay(language_settings):
+    return build_overlay(language_settings, KINGDOM_BORDERS, STORY_TEXT_BORDERS, STORY_TEXT_ANGLE, (IM_WIDTH, IM_HEIGHT))
+
+
+# Single preview image, waits for one taken after the request so it shows the current borders
+@eel.btl.route(PREVIEW_PATH)
+@eel.btl.route(LEGACY_PREVIEW_PATH)
+def serve_preview():
+    jpeg = preview_stream.fresh(eel.sleep)
+    if jpeg is None:
+        return eel.btl.HTTPResponse(status=503)
+    eel.btl.response.content_type = "image/jpeg"
+    eel.btl.response.set_header("Cache-Control", "no-store")
+    return jpeg
+
+
+# Preview as an MJPEG stream, runs as long as the GUI shows it
+@eel.btl.route(PREVIEW_STREAM_PATH)
+def serve_preview_stream():
+    fps = eel.btl.request.query.get("fps", type=float)
+    eel.btl.response.content_type = "multipart/x-mixed-replace; boundary=" + PREVIEW_BOUNDARY
+    eel.btl.response.set_header("Cache-Control", "no-store")
+    return preview_stream.mjpeg(eel.sleep, fps)
 
 # Allow the gui to reset the run, in this case clearing the mentioned and collected moons
 @eel.expose
 def reset_run(skip_reset_confirmation):
-    global mentioned_moons, collected_moons
-    mentioned_moons = []
-    collected_moons = []
+    detector.reset_run()
+    run_state.reset()
     if VERBOSE:
         print("[STATUS] -> reset moon lists")
     if skip_reset_confirmation:
@@ -238,23 +255,27 @@ def stop_output_video():
 @eel.expose
 def start_output_audio():
     global output_audio
-    output_audio = True
-    print("[STATUS] -> started audio output")
-    return True
+    output_audio = audio.start(audio_index)
+    if output_audio:
+        print("[STATUS] -> started audio output")
+    return output_audio
 
 # Allow GUI to stop audio
 @eel.expose
 def stop_output_audio():
     global output_audio
     output_audio = False
+    audio.stop()
     print("[STATUS] -> stopped audio output")
     return True
 
 # Allow the gui to save the current settings to a file
 @eel.expose
 def write_settings_to_file(updated_settings):
-    global settings, is_postgame, translate_from, translate_to, include_extra_kingdoms, manually_switch_kingdoms, use_window_capture, window_capture_cropping, output_video, output_audio, audio_index
+    global settings, include_extra_kingdoms, use_window_capture, window_capture_cropping, output_video, output_audio, audio_index
 
+    if not capture_ready.is_set():  # Capture is still being opened in the background
+        return False
     if updated_settings["useWindowCapture"]:
         if not set_window_capture(updated_settings["windowCaptureName"]):
             return False
@@ -264,17 +285,20 @@ def write_settings_to_file(updated_settings):
 
     if updated_settings["audioDevice"] is not None:
         audio_index = updated_settings["audioDevice"]["index"]
+        audio.set_device(audio_index)
 
     if not set_use_window_capture(updated_settings["useWindowCapture"]):
         return False
     if not set_window_capture_cropping(updated_settings["windowCaptureCropping"]):
         return False
 
-    is_postgame = updated_settings["includePostGame"]
+    detector.is_postgame = updated_settings["includePostGame"]
     include_extra_kingdoms = updated_settings["includeWithoutTalkatoo"]
-    set_translate_from(updated_settings["inputLanguage"])
-    set_translate_to(updated_settings["outputLanguage"])
-    manually_switch_kingdoms = updated_settings.get("manuallySwitchKingdoms", False)
+    detector.set_translate_from(updated_settings["inputLanguage"])
+    detector.set_translate_to(updated_settings["outputLanguage"])
+    detector.manually_switch_kingdoms = updated_settings.get("manuallySwitchKingdoms", False)
+    if "logLevel" in updated_settings:
+        set_log_level(updated_settings["logLevel"])
 
     with open(SETTINGS_PATH, "w+") as settings_file:
         settings_file.write(dumps(updated_settings))
@@ -293,43 +317,102 @@ def log_pending_moons(pending_moons):
 ########################################################################################################################
 # Define Python-only functions
 ########################################################################################################################
-# Checks recognized text against moons fromm the current kingdom
-def check_matches(poss_moon, score_threshold, moons_to_check):
-    max_corr = score_threshold  # so low it will never matter
-    max_low = score_threshold + 4  # Used for shortcutting when scores are blown up
-    ans = []  # best matches
-    poss_matches = {}  # Loose matches
-    for i, m in enumerate(moons_to_check):  # Loop through moons in the current kingdom
-        corr = score_func(m[translate_from], poss_moon, max_corr if max_corr < max_low else max_low)  # Determine score for moon being compared
-        if corr >= score_threshold:
-            poss_matches[m[translate_to]] = corr
-            if corr > max_corr:  # Best match so far
-                max_corr = corr
-                ans = [m]
-            elif corr == max_corr:  # Equally good as best match
-                ans.append(m)
-        elif corr >= score_threshold - 1 and VERBOSE:
-            print("\t-->", m[translate_to], "had score", corr)
-    poss_matches = score_to_pct(poss_matches)
-    return max_corr, ans, poss_matches
-
-
-# Checks recognized text against story moons from current kingdom
-def check_matches_story_multi(poss_moon, score_threshold, moons_to_check):
-    max_corr = -100  # so low it will never matter
-    ans = []  # best matches
-    poss_matches = {}  # Loose matches
-    for i, m in enumerate(moons_to_check, start=1):  # Loop through moons in the current kingdom
-        corr = score_func(m[translate_from], poss_moon, score_threshold, can_fail_out=False)
-        if corr > max_corr:
-            max_corr = corr
-            ans = [m]
-        elif corr == max_corr:
-            ans.append(m)
-        if corr >= score_threshold - 6:
-            poss_matches[m[translate_to]] = corr
-    poss_matches = score_to_pct(poss_matches, force_match=True)
-    return max_corr if max_corr > score_threshold else score_threshold, ans, poss_matches
+# Size of the GUI window, the size of the primary screen when fullscreen on Windows
+def get_gui_size():
+    if FULLSCREEN:
+        try:
+            return ctypes.windll.user32.GetSystemMetrics(SM_CXSCREEN), ctypes.windll.user32.GetSystemMetrics(SM_CYSCREEN)
+        except AttributeError:  # No windll outside of Windows
+            pass
+    return (1280, 720)
+
+
+# Remember startup progress for the main loop to show in the GUI, eel must only be called from the main loop
+def report_startup(text, fraction):
+    global startup_progress
+    startup_progress = (text, fraction)
+    if VERBOSE:
+        print("[STATUS] -> {} ({:.0%})".format(text, fraction))
+
+
+# Show startup progress in the GUI, GUI builds from before it existed don't expose the function
+def show_startup_progress(text, fraction):
+    if hasattr(eel, "set_startup_progress"):
+        eel.set_startup_progress(text, fraction)
+
+
+# Open the capture and load the models in the background, so the GUI comes up right away
+def start_up():
+    global stream, window_stream, frame_ring, borders, border_tracker
+    try:
+        report_startup("Opening capture", 0.05)
+        stream = open_capture(video_index if VIDEO_SOURCE is None else VIDEO_SOURCE, loop=True)  # Set up capture card
+        window_stream = None
+        set_window_capture(window_capture_name, True)  # Set up window capture
+        frame_ring = detector.ring if MULTIPROCESS_ENGINE else FrameRing(FRAME_RING_SIZE)  # Frames handed from the capture thread to detection
+        borders = reset_capture_borders()[0]  # Find borders to crop every iteration
+        if BORDER_TRACKING:
+            border_tracker = BorderTracker(latest_frame, borders, apply_border_drift).start()
+        capture_ready.set()
+        video_stream.start()
+        play_audio()
+
+        detector.warm_up(lambda text, fraction: report_startup(text, 0.2 + 0.75 * fraction))
+        models_ready.set()
+    except Exception as error:
+        report_startup("Startup failed: {}".format(error), 0)
+        raise
+    if VERBOSE:
+        print("Setup complete! You may now approach the bird.\n")
+
+
+# Newest captured frame for the border tracker, None with window capture since its borders are the whole window
+def latest_frame():
+    if use_window_capture or frame_ring is None:
+        return None
+    latest = frame_ring.latest()
+    return latest[2] if latest else None
+
+
+# Called by the border tracker, the main loop picks up the new borders with its next frame
+def apply_border_drift(event):
+    global borders
+    borders = event["new"]
+    if VERBOSE:
+        print("[STATUS] -> Capture moved by {}, borders set to {}".format(event["shift"], borders))
+
+
+# Tell the GUI the capture borders moved, GUI builds from before it existed don't expose the function
+def show_border_drift(events):
+    for event in events:
+        if hasattr(eel, "border_drift"):
+            eel.border_drift(list(event["old"]), list(event["new"]))
+
+
+# Apply detection events to the run state and send the GUI what changed, one delta per frame
+# GUI builds from before the run state get the events themselves and keep the moon lists on their own,
+# nothing reads the deltas then, so the kingdom and reset operations recorded for them are dropped instead of piling up
+def send_to_gui(events):
+    if not hasattr(eel, "apply_run_delta"):
+        for event, payload in events:
+            if event == "kingdom":
+                eel.set_current_kingdom(payload)
+            elif event == "collected":
+                eel.add_collected_moon(payload and [project_moon(moon, gui_languages(None)) for moon in payload])
+            elif event == "mentioned":
+                eel.add_mentioned_moon(payload and [project_moon(moon, gui_languages(None)) for moon in payload])
+        run_state.flush()
+        return
+    for event, payload in events:
+        if event == "kingdom":
+            run_state.set_kingdom(payload)
+        elif event == "collected":
+            run_state.collect(payload)
+        elif event == "mentioned":
+            run_state.mention(payload)
+    delta = run_state.flush()
+    if delta:
+        eel.apply_run_delta(delta)
 
 
 # Check USB device list and return matching names
@@ -340,112 +423,13 @@ def get_index_for(device_name):
     return DEFAULT_VIDEO_INDEX
 
 
-# Recognize, clean, and check moon text
-def match_moon_text(moon_img, prepend="Unlocked", story=False, multi=False):
-    ocr_text = reader.readtext(moon_img)
-    ocr_text = correct_text("".join([ocr_text[i][1] for i in range(len(ocr_text))]), translate_from)
-    if len(ocr_text) < 2:
-        return None
-    if VERBOSE:
-        print(ocr_text)
-
-    score_thresh = language_settings["Score"]
-    if story:
-        to_check = story_moons_to_check(multi=False)
-        max_corr, ans, possible = check_matches_story_multi(ocr_text, score_thresh, to_check)
-    elif multi:
-        to_check = story_moons_to_check(multi=True)
-        max_corr, ans, possible = check_matches_story_multi(ocr_text, score_thresh, to_check)
-    else:
-        to_check = normal_moons_to_check(prepend == "Unlocked")
-        max_corr, ans, possible = check_matches(ocr_text, score_thresh, to_check)
-
-    if max_corr >= score_thresh:  # If any reasonable matches, guarantee match if story moon
-        best_matches = len(ans)
-        if VERBOSE:
-            if best_matches == 1:
-                print("[{}] {} (score={})  ->  {}".format(prepend, ans[0]["english"].upper(), max_corr, possible))
-            else:
-                print("[{}] {} (score={})  ->  {}".format(prepend, " OR ".join([poss["english"].upper() for poss in ans]), max_corr, possible))
-        return ans
-    if VERBOSE:
-        print("\tNo good matches  ->  ".format(possible))
-    return None
-
-
-# Get normal moons
-def normal_moons_to_check(is_talkatoo):
-    # Note that MAX dicts are 1-indexed as SMO moons are 1-indexed
-    if is_postgame:
-        if current_kingdom == "Mushroom":
-            if is_talkatoo:
-                to_check = moons_by_kingdom["Mushroom"][:32] + moons_by_kingdom["Mushroom"][38:43]
-            else:
-                to_check = moons_by_kingdom["Mushroom"][:32] + moons_by_kingdom["Mushroom"][38:]
-        else:
-            to_check = moons_by_kingdom[current_kingdom][MAX_STORY[current_kingdom]:]
-        if not is_talkatoo: # add cloud, ruined and dark moons for moon get text only
-            to_check.extend(moons_by_kingdom["Cloud"])
-            to_check.extend(moons_by_kingdom["Ruined"])
-            to_check.extend(moons_by_kingdom["Dark"][1:14])  # Exclude multi moon, hint arts already included
-    else:
-        to_check = moons_by_kingdom[current_kingdom][MAX_STORY[current_kingdom]: MAX_MAINGAME[current_kingdom]]
-    to_check.extend(hint_arts[current_kingdom])
-    return to_check
-
-
-# Get story moons
-def story_moons_to_check(multi):
-    start_index = 33 if current_kingdom == "Mushroom" else 1  # Moon indices are 1-indexed
-    if multi:
-        moons_to_check = [moons_by_kingdom[current_kingdom][i] for i in range(start_index-1, MAX_STORY[current_kingdom]) if moons_by_kingdom[current_kingdom][i].get("is_multi")]
-        moons_to_check.append(moons_by_kingdom["Ruined"][0])
-        if is_postgame:
-            moons_to_check.append(moons_by_kingdom["Dark"][0])
-            moons_to_check.append(moons_by_kingdom["Darker"][0])
-    else:
-        moons_to_check = [moons_by_kingdom[current_kingdom][i] for i in range(start_index-1, MAX_STORY[current_kingdom]) if moons_by_kingdom[current_kingdom][i].get("is_story")]
-    return moons_to_check
-
-
-# Translate scores to percent certainty
-def score_to_pct(poss_moon_dict, force_match=False):
-    if not force_match:
-        poss_moon_dict["Uncertain"] = language_settings["Score"]
-    keys = list(poss_moon_dict.keys())
-    percents = torch.softmax(torch.tensor([float(poss_moon_dict[key]) for key in poss_moon_dict]), dim=0)
-    return {keys[i]: round(float(percents[i])*100, 2) for i in range(len(keys)) if percents[i] > POSS_MOON_CERTAINTY}
-
-
-# reset input language
-def set_translate_from(t_from):
-    global translate_from, language_settings, reader, score_func
-    if translate_from != t_from:
-        translate_from = t_from
-        language_settings = LANGUAGES[translate_from]
-        reader = easyocr.Reader([language_settings["Language"]], verbose=False)
-        score_func = score_logogram if translate_from in ["chinese_traditional", "chinese_simplified", "japanese", "korean"] else score_alphabet
-        if VERBOSE:
-            print("[STATUS] -> translate_from set to {}".format(translate_from))
-
-
-# reset output language
-def set_translate_to(t_to):
-    global translate_to
-    if translate_to != t_to:
-        translate_to = t_to
-        if VERBOSE:
-            print("[STATUS] -> translate_to set to {}".format(translate_to))
-
-
 # reset video source
 def set_video_index(new_index):
     global video_index, stream
 
-    if video_index == new_index:
+    if video_index == new_index or not isinstance(stream, DeviceCapture):  # Recorded footage ignores the device
         return True
 
-    stream.release()
     stream.open(new_index)
     reset_success = reset_borders()
     if reset_success:
@@ -456,7 +440,6 @@ def set_video_index(new_index):
     else:
         if VERBOSE:
             print("[STATUS] -> video_index could not be set to {}".format(new_index))
-        stream.release()
         stream.open(video_index)
         return False
 
@@ -530,27 +513,11 @@ def set_window_capture_cropping(updated_cropping):
     return success
 
 
-# Check kingdom via recognition and update it if needed
-def update_kingdom(img_arr):
-    img = Image.fromarray(img_arr)
-    kc_tensor = transform(img).unsqueeze(dim=0).type(torch.float32)
-    probs = torch.softmax(kindom_classifier(kc_tensor), dim=1)
-    result = int(torch.argmax(probs))
-    if result != 13 and probs[0][result] > KINGDOM_CERTAINTY:  # 13 is "Other" in my model
-        return kingdom_list[result]
-    return None  # Was not able to determine kingdom
-
-
 # Reset capture card borders
 def reset_capture_borders():
     global borders
-    if use_window_capture:
-        next_frame = window_stream.get_screenshot()
-        grabbed = next_frame is not None and next_frame.size > 0
-    else:
-        grabbed, next_frame = stream.read()
-
-    if not grabbed:
+    next_frame = current_capture().read()[0]
+    if next_frame is None:
         print("[STATUS] -> Could not reset image borders")
         return None, None
 
@@ -560,59 +527,41 @@ def reset_capture_borders():
     else:
         borders = determine_borders(img_arr)
 
+    if border_tracker:
+        border_tracker.reset(borders)
     if VERBOSE:
         print("[STATUS] -> Reset image borders")
     return borders, img_arr
 
 
+# Start the audio passthrough if the settings ask for it, it runs on PyAudio's callback threads from then on
 def play_audio():
-    global output_audio, p, audio_index
-    chunk_size = 1024
-    width = 2
-    channels = 2
-    sample_rate = 44100
-    curr_audio_index = audio_index
-
-    audio_input = p.open(format=p.get_format_from_width(width),
-                    channels=channels,
-                    rate=sample_rate,
-                    input=True,
-                    output=True,
-                    frames_per_buffer=chunk_size,
-                    input_device_index=curr_audio_index)
+    if output_audio:
+        audio.start(audio_index)
 
-    while running:
-        if output_audio:
-            data = audio_input.read(chunk_size)  # read audio stream
-            audio_input.write(data, chunk_size)  # play back audio stream
-            if curr_audio_index != audio_index:
-                audio_input.stop_stream()
-                audio_input.close()
-                curr_audio_index = audio_index
-                audio_input = p.open(format=p.get_format_from_width(width),
-                                     channels=channels,
-                                     rate=sample_rate,
-                                     input=True,
-                                     output=True,
-                                     frames_per_buffer=chunk_size,
-                                     input_device_index=curr_audio_index)
-        else:
-            time.sleep(1)
-    audio_input.stop_stream()
-    audio_input.close()
+
+# Stop the audio passthrough and release PyAudio when everything shuts down
+def stop_audio():
+    audio.stop()
     p.terminate()
+    if VERBOSE:
+        print("[STATUS] -> Audio stats: {}".format(audio.stats()))
     print("Audio finished!")
 
 
+# Capture source in use, the window or the video device
+def current_capture():
+    return window_stream if use_window_capture else stream
+
+
 def show_video():
-    global frame, stream, window_stream, output_video
+    global output_video
     window_is_open = False
     while running:
-        if use_window_capture:
-            ret, frame = True, window_stream.get_screenshot()
-        else:
-            ret, frame = stream.read()
-        if ret and output_video:
+        frame, timestamp = current_capture().read()
+        if frame is not None:
+            frame_ring.put(frame, timestamp)
+        if frame is not None and output_video:
             window_is_open = True
             try:
                 cv2.imshow('Video Stream', frame)
@@ -623,133 +572,105 @@ def show_video():
             window_is_open = False
         if cv2.waitKey(1) & 0xFF == ord('q'):
             output_video = False
+    frame_ring.close()
+    preview_stream.close()
     cv2.destroyAllWindows()
     print("Finished video!")
 
 
-def mainloop():
-    global current_kingdom, frame
+# Tell the GUI startup is done and how long it took until the first frame was processed
+def report_first_frame():
+    seconds = time.perf_counter() - launch_time
+    show_startup_progress("Ready after {:.1f}s".format(seconds), 1.0)
+    print("[STATUS] -> Time to first frame: {:.2f}s".format(seconds))
 
+
+def mainloop():
     # Set up Eel
     eel.init('gui')  # Initialize the gui package
-    eel.start('index.html', port=8083, size=GUI_SIZE, block=False)  # start the GUI
-    eel.set_current_kingdom(current_kingdom)
+    eel.start('index.html', port=8083, size=get_gui_size(), block=False)  # start the GUI
+    eel.set_current_kingdom(detector.current_kingdom)
+
+    # Show startup progress until the models are loaded
+    shown_progress = None
+    while running and not models_ready.is_set():
+        if startup_progress != shown_progress:
+            shown_progress = startup_progress
+            show_startup_progress(*shown_progress)
+        eel.sleep(STARTUP_POLL)
+    first_frame = True  # Time to first frame is reported once
 
     # Final setup variables
-    change_kingdom = ""  # Confirmation variable for kingdom changes
-    check_kingdom_at = time.time()  # Check right after start
-    check_moon_at = time.time()  # Check right after start
-    check_story_at = time.time()  # Check right after start
-    old_time = time.time()  # start time for loop
-    text_potential = 0  # So we don't read partial text
+    old_time = None  # capture time of the previous frame
+    last_seq = 0  # sequence number of the last processed frame
+    dropped_frames = 0  # frames captured while the loop was busy
+    ocr_depth = 0  # reads waiting for the OCR worker
+    roi_map = None  # where the checked boxes are in the captured frame, redone when borders change
+    stats_time = time.time()  # capture time of the last stats record
+    detector.reset_timers()
+
+    if MULTIPROCESS_ENGINE:  # Frames go straight from capture to the detector processes, only events come back
+        while running:
+            eel.sleep(0)  # Let the GUI run, waiting for events does the actual sleeping
+            detector.set_borders(borders)
+            send_to_gui(detector.poll(timeout=FRAME_WAIT))
+            if border_tracker:
+                show_border_drift(border_tracker.poll_events())
+            if first_frame:  # Detector processes are running
+                first_frame = False
+                report_first_frame()
+        detector.close()
+        return
 
     ########################################################################################################################
     # Begin main loop, where all of the detection happens
     ########################################################################################################################
     while running:
-        new_time = time.time()
-        frame_time = new_time - old_time
+        eel.sleep(0)  # Let the GUI run, waiting for the next frame does the actual sleeping
+        next_frame = frame_ring.get(last_seq, timeout=FRAME_WAIT)
+        if next_frame is None:  # No new frame yet, never process the same one twice
+            continue
+        last_seq, new_time, frame, dropped = next_frame
+        if dropped:
+            dropped_frames += dropped
+            if VERBOSE:
+                event_log.info("frames_skipped", count=dropped, total=dropped_frames)
+        frame_time = new_time - old_time if old_time is not None else 0
         old_time = new_time
-        eel.sleep(0.001)  # sleep of ~0.001 is the minimum allowed, still works
 
-        if frame is None or frame.size == 0:
-            continue
-        image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        # Resizing image needed for distortion correction. NEAREST is ~8x faster than default but riskier so still testing
-        image = Image.fromarray(image[borders[1]:borders[3], borders[0]:borders[2]]).resize((IM_WIDTH, IM_HEIGHT))
-
-        # Check kingdom every 3s
-        if not manually_switch_kingdoms and new_time > check_kingdom_at:
-            check_kingdom_at = new_time + KINGDOM_TIMER  # Reset timer
-            kingdom_check_im = image_to_bw(image.crop(KINGDOM_BORDERS))  # Must be 50x50 to work in model
-            new_kingdom = update_kingdom(kingdom_check_im)
-            if new_kingdom and new_kingdom != current_kingdom:  # strong match for new
-                if change_kingdom == new_kingdom:  # make sure we get two in a row of the same kingdom
-                    current_kingdom = new_kingdom
-                    eel.set_current_kingdom(current_kingdom)
-                    change_kingdom = ""
-                    if VERBOSE:
-                        print("Kingdom changed to: ", new_kingdom)
-                else:
-                    change_kingdom = new_kingdom
-                    check_kingdom_at = new_time + 1  # Perform the second check in 1s to be sure
-                continue  # if purple coin logo visible, not getting a moon or talking to Talkatoo
-            change_kingdom = ""
-
-        # Moon recognition every half second
-        if new_time > check_moon_at:
-            moon_check_im = image_to_bw(image.crop(language_settings["Moon_Bounds"]), white=230)
-            if is_text_naive(moon_check_im, language_settings["Text_Height"], language_settings["Text_Lower"]+0.1, language_settings["Text_Upper"]+0.1, VERBOSE):
-                moon_matches = match_moon_text(moon_check_im, prepend="Collected")
-                if moon_matches:
-                    if not collected_moons or moon_matches != collected_moons[-1]:
-                        collected_moons.append(moon_matches)
-                        eel.add_collected_moon(moon_matches)
-                        check_moon_at = new_time + 6  # 5s tends to be too short so wait 6s
-                        continue
-            check_moon_at = new_time + MOON_TIMER  # Reset timer
-
-        # Story moon recognition every half second
-        if new_time > check_story_at:
-            red_check_im = image.crop(RED_BORDERS)
-            if check_story_multi(red_check_im, expected="RED"):
-                story_check_im = image.crop(STORY_BORDERS)
-                if check_story_multi(story_check_im, expected="STORY"):
-                    if VERBOSE:
-                        print("Got a story moon!", end=" ")
-                    story_text = image.rotate(-3.5).crop(STORY_TEXT_BORDERS)
-                    story_text = image_to_bw(story_text, white=240)
-                    moon_matches = match_moon_text(story_text, prepend="Collected", story=True)
-                    collected_moons.append(moon_matches)
-                    eel.add_collected_moon(moon_matches)
-                    check_story_at = new_time + 10
-                    continue
-
-                multi_check_im = image.crop(MULTI_BORDERS)
-                if check_story_multi(multi_check_im, expected="MULTI"):
-                    if VERBOSE:
-                        print("Got a multi moon!", end=" ")  # Don't bother with OCR since moon border makes it unreliable
-                    multi_text = image.rotate(-3.5).crop(STORY_TEXT_BORDERS)
-                    multi_text = image_to_bw(multi_text, white=240)
-                    moon_matches = match_moon_text(multi_text, prepend="Collected", multi=True)
-                    collected_moons.append(moon_matches)
-                    eel.add_collected_moon(moon_matches)
-                    check_story_at = new_time + 10
-                    continue
-
-            check_story_at = new_time + STORY_MOON_TIMER
-
-        # Talkatoo text recognition, every frame
-        talkatoo_text, poss_text = talkatoo_preprocess_better(image.crop(language_settings["Talkatoo_Bounds"]), current_kingdom)
-        if poss_text:
-            text_potential += 1
-            if text_potential * frame_time > 0.19 and text_potential >= 2 and frame_time <= 0.3:  # Not waiting on a match
-                text_potential = 0
-                if is_text_naive(talkatoo_text, language_settings["Text_Height"], language_settings["Text_Lower"], language_settings["Text_Upper"], VERBOSE):  # Use text classifier to hopefully avoid unnecessary OCR passes
-                    moon_matches = match_moon_text(talkatoo_text, prepend="Unlocked")
-                    if moon_matches:  # Found at least one match
-                        if not mentioned_moons or moon_matches != mentioned_moons[-1]:  # Allow nonconsecutive duplicates
-                            mentioned_moons.append(moon_matches)
-                            eel.add_mentioned_moon(moon_matches)
-        else:
-            text_potential = 0
+        if ROI_FIRST and (roi_map is None or roi_map.borders != tuple(borders)):
+            roi_map = RoiMap(borders)
+        image = prepare_frame(frame, borders, roi_map)
+        send_to_gui(detector.process_frame(image, new_time, frame_time))
+        if border_tracker:
+            show_border_drift(border_tracker.poll_events())
+        if first_frame:
+            first_frame = False
+            report_first_frame()
+        if VERBOSE and detector.ocr_queue_depth() != ocr_depth:
+            ocr_depth = detector.ocr_queue_depth()
+            event_log.info("ocr_queue", depth=ocr_depth)
+        if new_time - stats_time > LOG_STATS_INTERVAL:
+            stats_time = new_time
+            log_stats(dropped_frames)
+    detector.close()
+
+
+# Timings, cache hits, loaded OCR readers and audio latency for the event log, written off the detection thread like every record
+def log_stats(dropped_frames):
+    if event_log.enabled(INFO):
+        event_log.info("stats", scheduler=detector.scheduler.stats(), caches=detector.cache_stats(), ocr_paths=dict(detector.ocr_paths),
+                       readers=detector.reader_pool.stats(),
+                       dropped_frames=dropped_frames, audio=audio.stats(), preview=preview_stream.stats(), log=event_log.stats())
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Detector processes of a frozen build start this script again
+    launch_time = time.perf_counter()  # Heavy imports are deferred, so this is close to process start
     ####################################################################################################################
     # Define variables used for computation
     ####################################################################################################################
     this_OS = platform.system()
-    moons_by_kingdom, hint_arts = generate_moon_dict()
-    kingdom_list = ("Cap", "Cascade", "Sand", "Lake", "Wooded", "Lost", "Metro", "Seaside",
-                    "Snow", "Luncheon", "Bowsers", "Moon", "Mushroom")  # to store class values, strict order
-    current_kingdom = "Cap"  # Start in first kingdom (Does not matter what it's initialized to)
-    mentioned_moons = []  # list of moons mentioned by Talkatoo
-    collected_moons = []  # list of auto-recognized collected moons
-
-    # Load kingdom recognizer
-    kindom_classifier = torch.jit.load("KingdomModel.zip")  # Pretrained kingdom recognizer, output 0-13 inclusive
-    transform = transforms.PILToTensor()  # Needed to transform image
 
     # Language setup
     settings = read_file_to_json(SETTINGS_PATH)
@@ -772,6 +693,7 @@ if __name__ == "__main__":
         output_audio = settings["autoPlayOutputStreams"]
         output_video = settings["autoPlayOutputStreams"]
         manually_switch_kingdoms = settings.get("manuallySwitchKingdoms", False)
+        log_level = settings.get("logLevel", LEVEL_NAMES[LOG_LEVEL])
     else:
         translate_from = DEFAULT_GAME_LANGUAGE
         translate_to = DEFAULT_GUI_LANGUAGE
@@ -785,27 +707,32 @@ if __name__ == "__main__":
         output_audio = False
         output_video = False
         manually_switch_kingdoms = False
-    language_settings = LANGUAGES[translate_from]
-    reader = easyocr.Reader([language_settings["Language"]], verbose=False)
-    score_func = score_logogram if translate_from in ["chinese_traditional", "chinese_simplified", "japanese",
-                                                      "korean"] else score_alphabet
+        log_level = LEVEL_NAMES[LOG_LEVEL]
+    event_log.set_level(log_level)
+    event_log.start(LOG_PATH)  # Records are written on a background thread, the detection loop only queues them
+    moons_by_kingdom, hint_arts = generate_moon_dict((translate_from, translate_to))  # Other languages load when selected
+    run_state = RunState(moons_by_kingdom)
+    if MULTIPROCESS_ENGINE:
+        detector = DetectionEngine(moons_by_kingdom, translate_from, translate_to, is_postgame, manually_switch_kingdoms,
+                                   log_path=LOG_PATH, log_level=log_level)
+    else:
+        detector = Detector(moons_by_kingdom, hint_arts, None, translate_from, translate_to,  # Models load in start_up
+                            is_postgame, manually_switch_kingdoms, async_ocr=ASYNC_OCR)
 
-    # Set up video source
+    # Set up audio now, capture and models are set up by start_up while the GUI starts
     p = pyaudio.PyAudio()
-    stream = cv2.VideoCapture(video_index)  # Set up capture card
-    window_stream = None
-    set_window_capture(window_capture_name, True)  # Set up window capture
-    frame = None
-    borders = reset_capture_borders()[0]  # Find borders to crop every iteration
-
-    if VERBOSE:
-        print("Setup complete! You may now approach the bird.\n")
+    audio = AudioPassthrough(PyAudioBackend(p), AUDIO_BUFFER_FRAMES)
+    stream = window_stream = frame_ring = borders = border_tracker = None
+    startup_progress = ("Starting", 0)
+    capture_ready = threading.Event()
+    models_ready = threading.Event()
 
+    preview_stream = PreviewStream(preview_source, preview_overlay, size=(IM_WIDTH, IM_HEIGHT)).start()  # Encodes only while the GUI shows it
     video_stream = threading.Thread(target=show_video)
-    audio_stream = threading.Thread(target=play_audio)
     running = True  # Ends everything
 
     # creating thread
-    video_stream.start()
-    audio_stream.start()
+    threading.Thread(target=start_up, daemon=True).start()
     mainloop()
+    stop_audio()
+    event_log.close()
@@ -0,0 +1,291 @@
+"""
+Audio passthrough from the capture card to the speakers, running in PyAudio callback mode:
+    The input stream's callback writes blocks into a ring buffer, the output stream's callback reads them back
+    Only the input callback moves the write position and only the output callback moves the read position, so they never wait on each other
+    Output starts once a couple of buffers are queued and primes again after an underrun
+    When more than a few buffers pile up, because the two devices' clocks drift apart, the oldest audio is dropped
+Switching the input device opens the new stream before the old one is closed, the output keeps playing from the ring meanwhile
+    The old stream hands the ring over from its own callback, so only one callback ever writes to it and none takes a lock
+The latency from input to output is measured from the stream times PortAudio hands to the callbacks
+NullAudioBackend stands in for sound hardware, its input plays a test tone and its output records what it played, check_audio.py runs on it
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2  # Bytes per sample, 16 bit
+BUFFER_FRAMES = 256  # Frames per callback, about 6ms at 44.1kHz
+RING_BUFFERS = 16  # Capacity of the ring buffer, in callback buffers
+PREFILL_BUFFERS = 2  # Buffers queued before output starts, and again after an underrun
+MAX_FILL_BUFFERS = 4  # More queued than this is dropped, so latency can't creep up
+LATENCY_SMOOTHING = 0.05  # Weight of the newest measurement in the running latency average
+CONTINUE = 0  # pyaudio.paContinue, so the null backend works without PyAudio
+NULL_TONE = 440  # Hz of the tone the null input plays
+
+
+# Single producer, single consumer ring of raw audio frames
+# write() is only called by the input side and read()/trim() only by the output side, neither takes a lock
+class AudioRing:
+    # constructor
+    def __init__(self, capacity_frames, frame_bytes):
+        self.frame_bytes = frame_bytes
+        self.capacity = capacity_frames * frame_bytes
+        self.buffer = np.zeros(self.capacity, dtype=np.uint8)
+        self.written = 0  # Bytes written so far, only the producer changes it
+        self.consumed = 0  # Bytes read or dropped so far, only the consumer changes it
+        self.overruns = 0  # Blocks the producer dropped because the ring was full
+        self.underruns = 0  # Reads the producer could not keep up with
+        self.dropped = 0  # Frames the consumer dropped to keep the latency down
+
+    # Frames waiting to be read
+    def fill(self):
+        return (self.written - self.consumed) // self.frame_bytes
+
+    # Queue a block, dropped if it doesn't fit, returns whether it was queued
+    def write(self, data):
+        data = np.frombuffer(data, dtype=np.uint8)
+        if self.written - self.consumed + data.size > self.capacity:
+            self.overruns += 1
+            return False
+        start = self.written % self.capacity
+        first = min(data.size, self.capacity - start)
+        self.buffer[start:start + first] = data[:first]
+        self.buffer[:data.size - first] = data[first:]
+        self.written += data.size  # Published after the copy, so the consumer never sees half a block
+        return True
+
+    # Next frames as bytes, padded with silence if there aren't enough
+    def read(self, frames):
+        size = frames * self.frame_bytes
+        take = min(size, self.written - self.consumed)
+        out = np.zeros(size, dtype=np.uint8)
+        start = self.consumed % self.capacity
+        first = min(take, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:take] = self.buffer[:take - first]
+        self.consumed += take
+        if take < size:
+            self.underruns += 1
+        return out.tobytes()
+
+    # Drop the oldest frames until at most max_frames are left
+    def trim(self, max_frames):
+        excess = self.fill() - max_frames
+        if excess > 0:
+            self.consumed += excess * self.frame_bytes
+            self.dropped += excess
+
+
+# Opens streams on real sound devices through PyAudio
+class PyAudioBackend:
+    # constructor, pa is the PyAudio instance to open streams with
+    def __init__(self, pa):
+        self.pa = pa
+
+    def open_input(self, device_index, rate, channels, width, frames, callback):
+        return self.pa.open(format=self.pa.get_format_from_width(width), channels=channels, rate=rate, input=True,
+                            frames_per_buffer=frames, input_device_index=device_index, stream_callback=callback)
+
+    def open_output(self, rate, channels, width, frames, callback):
+        return self.pa.open(format=self.pa.get_format_from_width(width), channels=channels, rate=rate, output=True,
+                            frames_per_buffer=frames, stream_callback=callback)
+
+    def close(self, stream):
+        stream.stop_stream()
+        stream.close()
+
+
+# Stream of the null backend, a thread calling the callback at the stream's rate
+class NullStream:
+    # constructor
+    def __init__(self, tick, frames, rate):
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(tick, frames / rate), daemon=True)
+        self.thread.start()
+
+    def run(self, tick, period):
+        next_at = time.monotonic()
+        while not self.stop.is_set():
+            tick()
+            next_at += period
+            self.stop.wait(max(0.0, next_at - time.monotonic()))
+
+
+# Sound devices that don't exist, so the passthrough can run without sound hardware
+# Inputs play a tone, or blocks from source(device_index, frames) if given, the output keeps what it played if record is set
+class NullAudioBackend:
+    # constructor
+    def __init__(self, source=None, record=False):
+        self.source = source
+        self.record = record
+        self.played = []  # Blocks the output played, when recording
+        self.position = 0  # Frames of the tone generated so far
+
+    # Block of the test tone, the same tone on every channel
+    def tone(self, frames, rate, channels, width):
+        t = (self.position + np.arange(frames)) / rate
+        self.position += frames
+        samples = (np.sin(2 * math.pi * NULL_TONE * t) * (2 ** (8 * width - 1) - 1) * 0.1).astype("<i{}".format(width))
+        return np.repeat(samples, channels).tobytes()
+
+    def open_input(self, device_index, rate, channels, width, frames, callback):
+        def tick():
+            now = time.monotonic()
+            data = self.source(device_index, frames) if self.source else self.tone(frames, rate, channels, width)
+            callback(data, frames, {"input_buffer_adc_time": now - frames / rate, "current_time": now}, 0)
+        return NullStream(tick, frames, rate)
+
+    def open_output(self, rate, channels, width, frames, callback):
+        def tick():
+            now = time.monotonic()
+            data = callback(None, frames, {"output_buffer_dac_time": now + frames / rate, "current_time": now}, 0)[0]
+            if self.record:
+                self.played.append(data)
+        return NullStream(tick, frames, rate)
+
+    def close(self, stream):
+        stream.stop.set()
+        stream.thread.join(1)
+
+
+# Passes audio from an input device to the default output device
+class AudioPassthrough:
+    # constructor
+    def __init__(self, backend, buffer_frames=BUFFER_FRAMES, rate=SAMPLE_RATE, channels=CHANNELS, width=SAMPLE_WIDTH):
+        self.backend = backend
+        self.buffer_frames = buffer_frames
+        self.rate = rate
+        self.channels = channels
+        self.width = width
+        self.ring = AudioRing(buffer_frames * RING_BUFFERS, channels * width)
+        self.device_index = None
+        self.input = None
+        self.output = None
+        self.input_id = 0  # Only the input stream with this id writes to the ring
+        self.next_input_id = 0  # Input stream the ring goes to next, the current one hands it over once its last write is done
+        self.lock = threading.Lock()  # Serializes start, stop and device switches
+        self.primed = False  # Output plays from the ring, False while it fills up
+        self.input_latency = 0  # Seconds from the ADC to the input callback, last measured
+        self.latency = None  # Running average of seconds from input to output
+        self.max_latency = 0
+        self.input_status_flags = 0  # Input callbacks PortAudio flagged with an under- or overflow, only the input side counts them
+        self.output_status_flags = 0  # Same for the output callbacks
+
+    @property
+    def running(self):
+        return self.output is not None
+
+    # Start passing audio from an input device, returns whether the streams opened
+    def start(self, device_index):
+        with self.lock:
+            if self.running:
+                return self.switch_device(device_index)
+            self.device_index = device_index
+            self.ring = AudioRing(self.buffer_frames * RING_BUFFERS, self.channels * self.width)  # Nothing left from before
+            self.primed = False
+            try:
+                self.output = self.backend.open_output(self.rate, self.channels, self.width, self.buffer_frames, self.output_callback)
+                self.input = self.open_input(device_index)
+                self.input_id = self.next_input_id
+            except OSError as error:
+                print("[STATUS] -> Could not start audio from device {}: {}".format(device_index, error))
+                self.close_streams()
+                return False
+            return True
+
+    # Stop both streams
+    def stop(self):
+        with self.lock:
+            self.close_streams()
+
+    # Use another input device, right away if running, returns whether it opened
+    def set_device(self, device_index):
+        with self.lock:
+            if not self.running:
+                self.device_index = device_index
+                return True
+            return self.switch_device(device_index)
+
+    # Open the new input before closing the old one, the output plays what is queued in between
+    def switch_device(self, device_index):
+        if device_index == self.device_index and self.input is not None:
+            return True
+        try:
+            new_input = self.open_input(device_index)
+        except OSError as error:
+            print("[STATUS] -> Could not switch audio to device {}: {}".format(device_index, error))
+            return False
+        old_input, self.input, self.device_index = self.input, new_input, device_index
+        if old_input is not None:
+            self.backend.close(old_input)
+        self.input_id = self.next_input_id  # In case the old stream stopped calling back before it handed the ring over
+        return True
+
+    # Input stream whose callback writes to the ring once it is the current one
+    # The current stream gives the ring to the next one instead of writing, so the two never write at the same time
+    def open_input(self, device_index):
+        stream_id = self.next_input_id + 1
+
+        def callback(in_data, frame_count, time_info, status):
+            if stream_id == self.input_id:
+                if self.next_input_id != stream_id:
+                    self.input_id = self.next_input_id
+                else:
+                    self.input_written(in_data, time_info, status)
+            return None, CONTINUE
+
+        stream = self.backend.open_input(device_index, self.rate, self.channels, self.width, self.buffer_frames, callback)
+        self.next_input_id = stream_id
+        return stream
+
+    def input_written(self, in_data, time_info, status):
+        if status:
+            self.input_status_flags += 1
+        adc_time = time_info.get("input_buffer_adc_time", 0)
+        if adc_time:
+            self.input_latency = max(0.0, time_info["current_time"] - adc_time)
+        self.ring.write(in_data)
+
+    # Output stream callback, plays queued audio or silence while the ring fills up
+    def output_callback(self, in_data, frame_count, time_info, status):
+        if status:
+            self.output_status_flags += 1
+        ring = self.ring
+        fill = ring.fill()
+        if not self.primed:
+            if fill < PREFILL_BUFFERS * self.buffer_frames:
+                return b"\0" * (frame_count * ring.frame_bytes), CONTINUE
+            self.primed = True
+        if fill > MAX_FILL_BUFFERS * self.buffer_frames:
+            ring.trim(PREFILL_BUFFERS * self.buffer_frames)
+            fill = ring.fill()
+        underruns = ring.underruns
+        data = ring.read(frame_count)
+        if ring.underruns != underruns:  # Ran dry, wait for the prefill again instead of crackling
+            self.primed = False
+        dac_time = time_info.get("output_buffer_dac_time", 0)
+        latency = self.input_latency + fill / self.rate + (max(0.0, dac_time - time_info["current_time"]) if dac_time else 0)
+        self.latency = latency if self.latency is None else self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+        self.max_latency = max(self.max_latency, latency)
+        return data, CONTINUE
+
+    def close_streams(self):
+        self.next_input_id += 1
+        self.input_id = self.next_input_id  # Nothing writes to the ring anymore
+        for stream in (self.input, self.output):
+            if stream is not None:
+                self.backend.close(stream)
+        self.input = self.output = None
+
+    # Latency and glitch counts, for logging
+    def stats(self):
+        return {"running": self.running, "device": self.device_index,
+                "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+                "max_latency_ms": round(self.max_latency * 1000, 1), "buffer_ms": round(self.buffer_frames / self.rate * 1000, 1),
+                "underruns": self.ring.underruns, "overruns": self.ring.overruns, "dropped_frames": self.ring.dropped,
+                "input_status_flags": self.input_status_flags, "output_status_flags": self.output_status_flags}
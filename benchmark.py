@@ -0,0 +1,252 @@
+"""
+Per-stage benchmark of the frame processing hot path:
+    Time every stage of a main loop iteration separately on a fixed corpus of 1280x720 frames
+    Language dependent stages (bounds, OCR, matching) are timed for every language in LANGUAGES
+    Report ops/sec and p50/p99 latencies, save them as a JSON baseline and compare against an older one
+Usage: python benchmark.py [--frames dir_with_pngs] [--save baseline.json] [--compare old_baseline.json]
+The fast paths are checked against the reference functions by check_reference.py
+"""
+
+import argparse
+from glob import glob
+from json import dumps
+import os
+import platform
+import time
+
+from border_tracker import BORDER_SAMPLE_STEP
+import detection
+from detection import *
+import matching
+
+FRAME_BUDGET = 1 / 15  # Below ~15fps Talkatoo text starts getting missed
+SYNTHETIC_FRAMES = 8
+SEED = 1234
+RENDERED_MOONS = 20  # Moon names drawn as Talkatoo text when the corpus has no readable text for the OCR path comparison
+
+
+# Load the corpus as BGR frames like the capture card delivers them, synthetic noise frames if no directory is given
+def load_corpus(frames_dir=None, count=SYNTHETIC_FRAMES):
+    if frames_dir:
+        frames = [cv2.imread(path) for path in sorted(glob(os.path.join(frames_dir, "*.png")))]
+        frames = [frame for frame in frames if frame is not None]
+        if not frames:
+            raise IOError("No png frames found in {}".format(frames_dir))
+        return frames
+    rng = np.random.default_rng(SEED)
+    return [rng.integers(0, 256, (IM_HEIGHT, IM_WIDTH, 3), dtype=np.uint8) for _ in range(count)]
+
+
+# Turn a list of durations in seconds into ops/sec and latency percentiles in ms
+def summarize(times):
+    times = np.array(times)
+    return {"ops_per_sec": round(len(times) / times.sum(), 2) if times.sum() else None,
+            "p50_ms": round(float(np.percentile(times, 50)) * 1000, 4),
+            "p99_ms": round(float(np.percentile(times, 99)) * 1000, 4),
+            "calls": len(times)}
+
+
+# Time func on every input, repeat times over
+def time_stage(func, inputs, repeat):
+    times = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            func(item)
+            times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+# Stages that work the same for every language
+def bench_common(frames, detector, repeat):
+    borders = determine_borders(cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB))
+    rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    images = [frame_to_image(frame, borders) for frame in frames]
+    kingdom_ims = [image_to_bw(image.crop(KINGDOM_BORDERS)) for image in images]
+    roi_map = RoiMap(borders)
+    kingdom_mask = np.empty((KINGDOM_BORDERS[3] - KINGDOM_BORDERS[1], KINGDOM_BORDERS[2] - KINGDOM_BORDERS[0]), dtype=np.uint8)
+    boxes = [KINGDOM_BORDERS, RED_BORDERS, detector.language_settings["Moon_Bounds"], detector.language_settings["Talkatoo_Bounds"]]
+    return {
+        "cvtColor": time_stage(lambda frame: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), frames, repeat),
+        "determine_borders": time_stage(determine_borders, rgb_frames, repeat),
+        "determine_borders_sampled": time_stage(lambda rgb: determine_borders(rgb, BORDER_SAMPLE_STEP), rgb_frames, repeat),
+        "crop_resize": time_stage(lambda rgb: Image.fromarray(rgb[borders[1]:borders[3], borders[0]:borders[2]]).resize((IM_WIDTH, IM_HEIGHT)), rgb_frames, repeat),
+        "full_frame_boxes": time_stage(lambda frame: [frame_to_image(frame, borders).crop(box) for box in boxes], frames, repeat),
+        "roi_first_boxes": time_stage(lambda frame: [RoiFrame(frame, roi_map).crop(box) for box in boxes], frames, repeat),
+        "roi_first_story_text": time_stage(lambda frame: crop_story_text(RoiFrame(frame, roi_map)), frames, repeat),
+        "image_to_bw_kingdom": time_stage(lambda image: image_to_bw(image.crop(KINGDOM_BORDERS)), images, repeat),
+        "bw_mask_kingdom": time_stage(lambda image: bw_mask(image.crop(KINGDOM_BORDERS), out=kingdom_mask), images, repeat),
+        "check_story_multi": time_stage(lambda image: check_story_multi(image.crop(RED_BORDERS), expected="RED"), images, repeat),
+        "story_text_rotate": time_stage(lambda image: image_to_bw(image.rotate(-3.5).crop(STORY_TEXT_BORDERS), white=240), images, repeat),
+        "update_kingdom": time_stage(detector.update_kingdom, kingdom_ims, repeat),
+    }
+
+
+# OCR input the matcher would see for a well read moon, a character is dropped to avoid exact hits only
+def sample_ocr_texts(detector, kingdom="Cascade"):
+    texts = []
+    for moon in detector.moons_by_kingdom[kingdom][MAX_STORY[kingdom]:MAX_MAINGAME[kingdom]]:
+        text = correct_text(moon[detector.translate_from], detector.translate_from)
+        texts.append(text[:len(text) // 2] + text[len(text) // 2 + 1:])
+    return texts
+
+
+# OCR input for the moons of a candidate table, a character is dropped like in sample_ocr_texts
+def table_ocr_texts(detector, table, count=None):
+    texts = []
+    for moon in table.moons[:count]:
+        text = correct_text(moon[detector.translate_from], detector.translate_from)
+        texts.append(text[:len(text) // 2] + text[len(text) // 2 + 1:])
+    return [text for text in texts if text]
+
+
+# Run func with batch scoring forced on or off for every table size and script
+def with_batch_scoring(enabled, func):
+    settings = (matching.BATCH_SCORING, matching.BATCH_LOGOGRAMS, matching.BATCH_MIN_CANDIDATES)
+    matching.BATCH_SCORING, matching.BATCH_LOGOGRAMS, matching.BATCH_MIN_CANDIDATES = enabled, enabled, 0
+    try:
+        return func()
+    finally:
+        matching.BATCH_SCORING, matching.BATCH_LOGOGRAMS, matching.BATCH_MIN_CANDIDATES = settings
+
+
+# Time check_matches on the largest candidate table, one moon at a time and all at once
+def bench_scoring(detector, repeat):
+    table = detector.candidate_tables[("Mushroom", True, "collected")]
+    texts = table_ocr_texts(detector, table, 20)
+    threshold = detector.language_settings["Score"]
+    stage = lambda: time_stage(lambda text: detector.check_matches(text, threshold, table), texts, repeat)
+    return {"check_matches_scalar": with_batch_scoring(False, stage), "check_matches_batch": with_batch_scoring(True, stage)}
+
+
+# Single line crops with the text bounds text_bounds finds and the moon they show, None if not known
+# Taken from the corpus, or moon names drawn in the Talkatoo box if no frame has readable text (only for scripts cv2 can draw)
+def ocr_crops(frames, detector):
+    settings = detector.language_settings
+    borders = determine_borders(cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB))
+    crops = []
+    for frame in frames:
+        image = frame_to_image(frame, borders)
+        moon_im = bw_mask(image.crop(settings["Moon_Bounds"]), white=230)
+        crops.append((moon_im, text_bounds(moon_im, settings["Text_Height"], settings["Text_Lower"] + 0.1, settings["Text_Upper"] + 0.1, False), None))
+        talkatoo_im = talkatoo_mask(image.crop(settings["Talkatoo_Bounds"]), detector.current_kingdom)[0]
+        crops.append((talkatoo_im, text_bounds(talkatoo_im, settings["Text_Height"], settings["Text_Lower"], settings["Text_Upper"], False), None))
+    crops = [crop for crop in crops if crop[1]]
+    if crops:
+        return crops
+    bounds = settings["Talkatoo_Bounds"]
+    for moon in detector.candidates("talkatoo").moons[:RENDERED_MOONS]:
+        if not moon[detector.translate_from].isascii():
+            continue
+        crop = np.full((bounds[3] - bounds[1], bounds[2] - bounds[0]), 255, dtype=np.uint8)
+        cv2.putText(crop, moon[detector.translate_from], (10, crop.shape[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+        crops.append((crop, text_bounds(crop, settings["Text_Height"], 0, 1, False), moon))
+    return crops
+
+
+# Time readtext against the recognition only fast path on the same crops and compare what they match
+# Accuracy counts crops whose match contains the drawn moon, agreement counts crops where both paths match the same moons
+def bench_ocr_paths(frames, detector, ocr_repeat):
+    crops = ocr_crops(frames, detector)
+    if not crops:
+        return {}, {"crops": 0}
+    reader = detector.reader
+    detector.ocr_paths = dict.fromkeys(detector.ocr_paths, 0)
+    stages = {"readtext_full": time_stage(lambda crop: reader.readtext(crop[0]), crops, ocr_repeat),
+              "read_line_fast": time_stage(lambda crop: detector.read_line(reader, crop[0], crop[1]), crops, ocr_repeat)}
+    fallbacks = detector.ocr_paths["fallback"] / ocr_repeat
+    correct = {"full": 0, "fast": 0}
+    agree = 0
+    for img_arr, bounds, moon in crops:
+        full = detector.match_ocr_text(reader.readtext(img_arr))
+        fast = detector.match_ocr_text(detector.read_line(reader, img_arr, bounds))
+        agree += full == fast
+        correct["full"] += moon is not None and moon in (full or [])
+        correct["fast"] += moon is not None and moon in (fast or [])
+    labelled = sum(moon is not None for _, _, moon in crops)
+    report = {"crops": len(crops), "fallback_rate": round(fallbacks / len(crops), 3), "agreement": round(agree / len(crops), 3)}
+    if labelled:
+        report.update({"accuracy_full": round(correct["full"] / labelled, 3), "accuracy_fast": round(correct["fast"] / labelled, 3)})
+    return stages, report
+
+
+# Stages that depend on the language settings
+def bench_language(frames, detector, repeat, ocr_repeat):
+    settings = detector.language_settings
+    borders = determine_borders(cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB))
+    images = [frame_to_image(frame, borders) for frame in frames]
+    moon_ims = [bw_mask(image.crop(settings["Moon_Bounds"]), white=230) for image in images]
+    talkatoo_ims = [talkatoo_mask(image.crop(settings["Talkatoo_Bounds"]), detector.current_kingdom)[0] for image in images]
+    texts = sample_ocr_texts(detector)
+    to_check = detector.candidates("talkatoo")
+    return {
+        "image_to_bw_moon": time_stage(lambda image: image_to_bw(image.crop(settings["Moon_Bounds"]), white=230), images, repeat),
+        "bw_mask_moon": time_stage(lambda image: bw_mask(image.crop(settings["Moon_Bounds"]), white=230, out=detector.mask_buffer("moon", settings["Moon_Bounds"])), images, repeat),
+        "talkatoo_preprocess_better": time_stage(lambda image: talkatoo_preprocess_better(image.crop(settings["Talkatoo_Bounds"]), detector.current_kingdom), images, repeat),
+        "talkatoo_mask": time_stage(lambda image: talkatoo_mask(image.crop(settings["Talkatoo_Bounds"]), detector.current_kingdom, out=detector.mask_buffer("talkatoo", settings["Talkatoo_Bounds"])), images, repeat),
+        "is_text_naive": time_stage(lambda im: is_text_naive(im, settings["Text_Height"], settings["Text_Lower"], settings["Text_Upper"], False), talkatoo_ims, repeat),
+        "image_hash": time_stage(image_hash, moon_ims, repeat),
+        "readtext": time_stage(detector.reader.readtext, moon_ims, ocr_repeat),
+        "check_matches": time_stage(lambda text: detector.check_matches(text, settings["Score"], to_check), texts, repeat),
+        "global_shortlist": time_stage(lambda text: detector.global_candidates(text, "talkatoo"), texts, repeat),
+        "global_check_matches": time_stage(lambda text: detector.check_matches(text, settings["Score"], detector.global_candidates(text, "talkatoo")), texts, repeat),
+        **bench_scoring(detector, repeat),
+    }
+
+
+# Print the results as a table, with the share of a 15fps frame and the change against a baseline if given
+def print_report(results, baseline=None):
+    print("{:<24} {:<28} {:>12} {:>10} {:>10} {:>8} {:>9}".format("group", "stage", "ops/sec", "p50 ms", "p99 ms", "budget", "vs base"))
+    for group, stages in results["stages"].items():
+        for stage, stats in stages.items():
+            change = ""
+            if baseline:
+                old = baseline["stages"].get(group, {}).get(stage)
+                if old and old["p50_ms"]:
+                    change = "{:+.1f}%".format((stats["p50_ms"] / old["p50_ms"] - 1) * 100)
+            print("{:<24} {:<28} {:>12} {:>10.3f} {:>10.3f} {:>7.1f}% {:>9}".format(
+                group, stage, stats["ops_per_sec"], stats["p50_ms"], stats["p99_ms"],
+                stats["p50_ms"] / (FRAME_BUDGET * 1000) * 100, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the frame processing hot path")
+    parser.add_argument("--frames", help="directory of png frames to use as corpus, synthetic frames if not given")
+    parser.add_argument("--languages", nargs="+", choices=list(LANGUAGES), default=list(LANGUAGES),
+                        help="languages to benchmark, all by default")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the corpus for cheap stages")
+    parser.add_argument("--ocr-repeat", type=int, default=1, help="passes over the corpus for OCR")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON baseline from an earlier run to compare against")
+    args = parser.parse_args()
+    detection.VERBOSE = False
+
+    frames = load_corpus(args.frames)
+    moons_by_kingdom, hint_arts = generate_moon_dict()
+    kingdom_classifier = load_kingdom_classifier()
+    results = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+                        "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+                        "frames": len(frames), "frame_size": list(frames[0].shape), "corpus": args.frames or "synthetic"},
+               "stages": {}, "ocr_paths": {}}
+
+    for i, language in enumerate(args.languages):
+        detector = Detector(moons_by_kingdom, hint_arts, kingdom_classifier, language, DEFAULT_GUI_LANGUAGE)
+        detector.set_current_kingdom("Cascade")
+        if i == 0:
+            results["stages"]["common"] = bench_common(frames, detector, args.repeat)
+        results["stages"][language] = bench_language(frames, detector, args.repeat, args.ocr_repeat)
+        ocr_stages, results["ocr_paths"][language] = bench_ocr_paths(frames, detector, args.ocr_repeat)
+        results["stages"][language].update(ocr_stages)
+
+    baseline = read_file_to_json(args.compare) if args.compare else None
+    print_report(results, baseline)
+    for language, report in results["ocr_paths"].items():
+        print("[OCR paths] {:<22} {}".format(language, ", ".join("{}={}".format(key, value) for key, value in report.items())))
+    if args.save:
+        with open(args.save, "w", encoding="utf8") as file:
+            file.write(dumps(results, indent=2))
+        print("[STATUS] -> Saved benchmark to {}".format(args.save))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Background tracking of the capture borders:
+    Every few seconds the newest frame is checked with a sampled determine_borders, every 8th row and column
+    A change counts as drift once the same new borders are seen on consecutive checks and keep the aspect ratio
+    Dark frames (loading screens, dark rooms) can't show where the game is and are skipped
+New borders are handed to on_drift and kept as drift events, detection keeps running on the old ones until then
+"""
+
+from collections import deque
+import sys
+import threading
+import time
+
+from util_functions import content_edges
+
+BORDER_CHECK_INTERVAL = 3  # Seconds between checks
+BORDER_SAMPLE_STEP = 8  # Only every n-th row and column is looked at
+BORDER_TOLERANCE = 2  # Pixels an edge may move without counting as drift
+BORDER_CONFIRMATIONS = 2  # Consecutive checks that must agree on new borders
+BORDER_ASPECT_TOLERANCE = 0.02  # Relative aspect ratio change allowed, a dark scene shrinks the edges unevenly
+MAX_DRIFT_EVENTS = 16
+
+
+# Watches the newest frame for the game image moving inside the capture
+class BorderTracker:
+    # constructor, frame_source() returns the newest BGR or RGB frame or None, on_drift(event) applies new borders
+    def __init__(self, frame_source, borders, on_drift=None, interval=BORDER_CHECK_INTERVAL, step=BORDER_SAMPLE_STEP):
+        self.frame_source = frame_source
+        self.on_drift = on_drift
+        self.interval = interval
+        self.step = step
+        self.lock = threading.Lock()  # Guards borders, pending and events
+        self._borders = tuple(borders) if borders else None
+        self.pending = None  # Borders seen on the last check that are not confirmed yet
+        self.confirmations = 0
+        self.events = deque(maxlen=MAX_DRIFT_EVENTS)  # Drift events not polled yet
+        self.checks = 0
+        self.skipped = 0  # Checks without a usable frame
+        self.closed = threading.Event()
+        self.thread = None
+
+    @property
+    def borders(self):
+        return self._borders
+
+    # Take borders set somewhere else (a manual reset) as the new reference
+    def reset(self, borders):
+        with self.lock:
+            self._borders = tuple(borders) if borders else None
+            self.pending = None
+            self.confirmations = 0
+
+    # Check on a background thread every interval seconds until close()
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="border-tracker", daemon=True)
+        self.thread.start()
+        return self
+
+    # Thread body
+    def run(self):
+        while not self.closed.wait(self.interval):
+            try:
+                self.check()
+            except Exception as error:  # A bad frame must not stop tracking
+                print("[ERROR] -> Border check failed: {}".format(error), file=sys.stderr)
+
+    # Check one frame (the newest one if not given), returns the drift event if the borders were changed
+    def check(self, frame=None):
+        frame = self.frame_source() if frame is None else frame
+        self.checks += 1
+        found = self.find_borders(frame) if frame is not None else None
+        with self.lock:
+            if found is None or self._borders is None:
+                self.skipped += 1
+                return None
+            if self.moved(found, self._borders) is None:  # Where it was, forget anything pending
+                self.pending = None
+                self.confirmations = 0
+                return None
+            if self.pending is not None and self.moved(found, self.pending) is None:
+                self.confirmations += 1
+            else:
+                self.pending, self.confirmations = found, 1
+            if self.confirmations < BORDER_CONFIRMATIONS:
+                return None
+            event = {"time": time.time(), "old": self._borders, "new": self.pending, "shift": self.moved(self.pending, self._borders)}
+            self._borders = self.pending
+            self.pending = None
+            self.confirmations = 0
+            self.events.append(event)
+        if self.on_drift:
+            self.on_drift(event)
+        return event
+
+    # Borders of the game image in frame, None if the frame is too dark to tell or the shape doesn't fit
+    def find_borders(self, frame):
+        edges = content_edges(frame, self.step)
+        if edges is None:
+            return None
+        width, height = edges[2] - edges[0], edges[3] - edges[1]
+        if width < frame.shape[1] / 2 or height < frame.shape[0] / 2:  # Mostly dark, determine_borders would give up too
+            return None
+        if self._borders:
+            old_width, old_height = self._borders[2] - self._borders[0], self._borders[3] - self._borders[1]
+            if abs(width * old_height / (height * old_width) - 1) > BORDER_ASPECT_TOLERANCE:
+                return None
+        return edges
+
+    # Per edge shift from old to new borders, None if no edge moved more than BORDER_TOLERANCE
+    @staticmethod
+    def moved(new, old):
+        shift = tuple(n - o for n, o in zip(new, old))
+        if max(abs(edge) for edge in shift) <= BORDER_TOLERANCE:
+            return None
+        return shift
+
+    # Drift events since the last poll, oldest first
+    def poll_events(self):
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    # Stop the background thread
+    def close(self):
+        self.closed.set()
+        if self.thread:
+            self.thread.join(self.interval + 1)
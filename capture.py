@@ -0,0 +1,160 @@
+"""
+Capture sources the video thread reads frames from:
+    DeviceCapture reads a capture card or webcam through OpenCV (DirectShow on Windows, V4L2 on Linux)
+    VideoFileCapture plays a recorded video file, ImageSequenceCapture a directory of PNG frames, both paced by PacedCapture
+    WindowCapture in window_capture.py grabs a window on Windows
+Every source returns (frame, timestamp) from read(), the frame is a BGR view and the timestamp is the time.time() it was grabbed
+Frames are read-only, they may be views of a bitmap or shared with other threads, so anything drawing on one copies it first
+Cropping trims (left, top, right, bottom) pixels off the edges by slicing, so it never copies the frame
+Files and frame directories are played back at their frame rate, so they can stand in for a live capture when testing
+"""
+
+import os
+import time
+
+import cv2  # pip install opencv-python
+import numpy as np
+
+SEQUENCE_FPS = 30  # Frame rate of directories of frames, they don't carry one
+SEQUENCE_EXTENSIONS = (".png",)
+NO_CROP = (0, 0, 0, 0)
+
+
+# Frames from somewhere, subclasses implement grab()
+class CaptureSource:
+    # constructor, crop is (left, top, right, bottom) pixels to trim off the edges
+    def __init__(self, crop=None):
+        self.crop = tuple(crop) if crop is not None else NO_CROP
+
+    # Newest (read-only BGR frame, timestamp), or (None, None) if there is no frame
+    # Writing to the frame raises ValueError, it is handed to the detection loop, the preview and the border tracker as is
+    def read(self):
+        frame = self.grab()
+        if frame is None or frame.size == 0:
+            return None, None
+        frame = self.crop_view(frame)
+        frame.flags.writeable = False
+        return frame, time.time()
+
+    # Uncropped frame or None
+    def grab(self):
+        raise NotImplementedError
+
+    # The cropped part of a frame, as a view of it
+    def crop_view(self, frame):
+        if self.crop == NO_CROP:
+            return frame
+        left, top, right, bottom = self.crop
+        height, width = frame.shape[:2]
+        return frame[top:height - bottom, left:width - right]
+
+    def is_opened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+# Capture card or webcam by index, through the platform's OpenCV backend
+class DeviceCapture(CaptureSource):
+    # constructor
+    def __init__(self, index, crop=None):
+        super().__init__(crop)
+        self.index = index
+        self.stream = cv2.VideoCapture(index)
+
+    def grab(self):
+        grabbed, frame = self.stream.read()
+        return frame if grabbed else None
+
+    # Switch to another device, returns whether it opened
+    def open(self, index):
+        self.stream.release()
+        self.index = index
+        return self.stream.open(index)
+
+    def is_opened(self):
+        return self.stream.isOpened()
+
+    def release(self):
+        self.stream.release()
+
+
+# Recorded frames played back at a frame rate, subclasses implement grab() and call pace() for every frame they return
+class PacedCapture(CaptureSource):
+    # constructor
+    def __init__(self, path, fps, crop=None, loop=False, realtime=True):
+        super().__init__(crop)
+        self.path = path
+        self.fps = fps
+        self.loop = loop
+        self.realtime = realtime  # Wait for a frame's time to come, like a live capture would
+        self.started = None
+        self.position = 0  # Frames read since the start
+
+    # Play from the start again
+    def rewind(self):
+        self.started, self.position = None, 0
+
+    # Sleep until the frame that was just read is due
+    def pace(self):
+        if self.started is None:
+            self.started = time.monotonic()
+        if self.realtime:
+            time.sleep(max(0.0, self.started + self.position / self.fps - time.monotonic()))
+        self.position += 1
+
+
+# Plays a video file at its own frame rate, optionally from the start again when it ends
+class VideoFileCapture(PacedCapture):
+    # constructor
+    def __init__(self, path, crop=None, loop=False, realtime=True):
+        self.stream = cv2.VideoCapture(path)
+        super().__init__(path, self.stream.get(cv2.CAP_PROP_FPS) or SEQUENCE_FPS, crop, loop, realtime)
+
+    def grab(self):
+        grabbed, frame = self.stream.read()
+        if not grabbed and self.loop and self.position:
+            self.stream.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self.rewind()
+            grabbed, frame = self.stream.read()
+        if not grabbed:
+            return None
+        self.pace()
+        return frame
+
+    def is_opened(self):
+        return self.stream.isOpened()
+
+    def release(self):
+        self.stream.release()
+
+
+# Plays a directory of frames in file name order
+class ImageSequenceCapture(PacedCapture):
+    # constructor
+    def __init__(self, directory, crop=None, loop=False, realtime=True, fps=SEQUENCE_FPS):
+        super().__init__(directory, fps, crop, loop, realtime)
+        self.files = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.lower().endswith(SEQUENCE_EXTENSIONS))
+
+    def grab(self):
+        if self.loop and self.files and self.position >= len(self.files):
+            self.rewind()
+        if self.position >= len(self.files):
+            return None
+        frame = cv2.imread(self.files[self.position], cv2.IMREAD_COLOR)
+        self.pace()
+        return frame
+
+    def is_opened(self):
+        return bool(self.files)
+
+
+# Source for a device index, a video file or a directory of frames
+def open_capture(source, crop=None, loop=False):
+    if isinstance(source, (int, np.integer)):
+        return DeviceCapture(int(source), crop)
+    if os.path.isdir(source):
+        return ImageSequenceCapture(source, crop, loop)
+    return VideoFileCapture(source, crop, loop)
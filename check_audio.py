@@ -0,0 +1,118 @@
+"""
+Checks the audio passthrough on the null backend, with inputs that number every frame they play:
+    Frames must come out in the order they went in, a device switch must never mix the two inputs' frames
+    Output must only start once PREFILL_BUFFERS are queued, after the start and after every underrun
+    Every underrun must be counted, an input that stalls for a moment must cause one
+No sound hardware or PyAudio is needed, it runs for a few seconds in real time
+Exits with 1 and lists what went wrong otherwise, so it can run before a release or in CI
+Usage: python check_audio.py [--seconds 1] [--stall 0.1]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import numpy as np
+
+from audio import BUFFER_FRAMES, PREFILL_BUFFERS, AudioPassthrough, NullAudioBackend
+
+CHECK_WIDTH = 4  # Bytes per sample, wide enough to number every frame of the run
+CHECK_CHANNELS = 2  # Device number + 1 on the first channel, frame number + 1 on the second, so only silence is 0
+FIRST_DEVICE, SECOND_DEVICE = 1, 2
+
+
+# Inputs of the null backend that number their frames, the first one stalls once
+class NumberedSource:
+    # constructor
+    def __init__(self, stall_at, stall):
+        self.positions = {}  # device_index -> frames played so far
+        self.stall_at = stall_at  # Frame of the first device after which it stalls
+        self.stall = stall  # Seconds it stalls for
+        self.lock = threading.Lock()  # The old and new input's callbacks run at the same time while switching
+
+    def __call__(self, device_index, frames):
+        with self.lock:
+            start = self.positions.get(device_index, 0)
+            self.positions[device_index] = start + frames
+        if device_index == FIRST_DEVICE and start <= self.stall_at < start + frames:
+            time.sleep(self.stall)
+        block = np.empty((frames, CHECK_CHANNELS), dtype="<i4")
+        block[:, 0] = device_index + 1
+        block[:, 1] = np.arange(start, start + frames) + 1
+        return block.tobytes()
+
+
+# Play both devices through the passthrough, returns the played frames as (device, frame number) rows and the passthrough
+def run_passthrough(seconds, stall):
+    backend = NullAudioBackend(source=NumberedSource(int(seconds / 2 * 44100), stall), record=True)
+    passthrough = AudioPassthrough(backend, channels=CHECK_CHANNELS, width=CHECK_WIDTH)
+    passthrough.start(FIRST_DEVICE)
+    time.sleep(seconds + stall)
+    passthrough.set_device(SECOND_DEVICE)
+    time.sleep(seconds)
+    passthrough.stop()
+    played = np.frombuffer(b"".join(backend.played), dtype="<i4").reshape(-1, CHECK_CHANNELS).astype(np.int64) - 1
+    return played, passthrough
+
+
+# Problems with the order of the played frames
+def verify_order(played):
+    failures = []
+    sound = played[played[:, 0] >= 0]
+    devices = sound[:, 0]
+    if not (devices == FIRST_DEVICE).any() or not (devices == SECOND_DEVICE).any():
+        failures.append("Not both devices were played, played devices {}".format(sorted(set(devices.tolist()))))
+    elif (devices[np.argmax(devices == SECOND_DEVICE):] != SECOND_DEVICE).any():
+        failures.append("Frames of the first device were played after the second device started, the inputs were mixed")
+    for device in (FIRST_DEVICE, SECOND_DEVICE):
+        numbers = sound[devices == device, 1]
+        if (np.diff(numbers) <= 0).any():
+            failures.append("Frames of device {} were played out of order or twice".format(device))
+    return failures
+
+
+# Runs of sound between silences, as (start, stop) frame indices
+def sound_runs(played):
+    sound = np.concatenate(([False], played[:, 0] >= 0, [False]))
+    edges = np.flatnonzero(np.diff(sound.astype(np.int8)))
+    return list(zip(edges[::2], edges[1::2]))
+
+
+# Problems with priming and underruns, every run of sound but the last must have ended in an underrun
+def verify_prefill(played, passthrough, buffer_frames):
+    failures = []
+    runs = sound_runs(played)
+    underruns = passthrough.ring.underruns
+    ended = sum(stop < len(played) for _, stop in runs)  # Runs that went silent before the recording ended
+    if ended != underruns:
+        failures.append("{} runs of sound went silent but {} underruns were counted".format(ended, underruns))
+    if underruns < 1:
+        failures.append("The stalled input caused no underrun")
+    short = [stop - start for start, stop in runs if stop < len(played) and stop - start < PREFILL_BUFFERS * buffer_frames]
+    if short:
+        failures.append("Output started before {} buffers were queued, runs of {} frames".format(PREFILL_BUFFERS, short))
+    if runs and runs[0][0] == 0:
+        failures.append("Output started right away instead of waiting for the prefill")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the audio passthrough on the null backend")
+    parser.add_argument("--seconds", type=float, default=1, help="seconds each device plays")
+    parser.add_argument("--stall", type=float, default=0.1, help="seconds the first device stalls for halfway through")
+    args = parser.parse_args()
+
+    played, passthrough = run_passthrough(args.seconds, args.stall)
+    stats = passthrough.stats()
+    print("[STATUS] -> Played {} frames in {} runs of sound, {} underruns, {} overruns, {} dropped frames".format(
+        len(played), len(sound_runs(played)), stats["underruns"], stats["overruns"], stats["dropped_frames"]))
+    failures = verify_order(played) + verify_prefill(played, passthrough, BUFFER_FRAMES)
+
+    for failure in failures:
+        print("[ERROR] -> {}".format(failure), file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
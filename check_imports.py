@@ -0,0 +1,61 @@
+"""
+Checks that the matching core stays light enough for tools to import:
+    matching.py is imported in a fresh interpreter, a few times, and the fastest import must fit the budget
+    None of the heavy dependencies may be loaded along the way
+Exits with 1 and lists what went wrong otherwise, so it can run before a release or in CI
+Usage: python check_imports.py [--budget 0.5] [--runs 3]
+"""
+
+import argparse
+from json import loads
+import os
+import subprocess
+import sys
+
+IMPORT_BUDGET = 0.5  # Seconds, NumPy alone takes about a fifth of that
+IMPORT_RUNS = 3  # The fastest run counts, the first one may be slowed down by a cold disk cache
+HEAVY_MODULES = ("torch", "easyocr", "cv2", "eel", "PIL", "pyaudio", "win32gui", "pygrabber")
+MODULES = ("matching", "moon_index", "ocr_cache", "event_log")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+# Time the import of a module in a fresh interpreter, returns the seconds and the heavy modules it loaded
+def probe_import(module):
+    result = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)], capture_output=True,
+                            text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise ImportError("Could not import {}:\n{}".format(module, result.stderr))
+    return loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the matching core imports fast and without heavy dependencies")
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET, help="seconds the fastest import may take")
+    parser.add_argument("--runs", type=int, default=IMPORT_RUNS, help="imports per module")
+    args = parser.parse_args()
+
+    failures = []
+    for module in MODULES:
+        probes = [probe_import(module) for _ in range(args.runs)]
+        seconds = min(probe["seconds"] for probe in probes)
+        heavy = sorted({name for probe in probes for name in probe["heavy"]})
+        print("[STATUS] -> {}: {:.0f}ms{}".format(module, seconds * 1000, ", loads " + ", ".join(heavy) if heavy else ""))
+        if heavy:
+            failures.append("{} loads {}".format(module, ", ".join(heavy)))
+        if seconds > args.budget:
+            failures.append("{} takes {:.0f}ms, the budget is {:.0f}ms".format(module, seconds * 1000, args.budget * 1000))
+
+    for failure in failures:
+        print("[ERROR] -> {}".format(failure), file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Checks that the fast paths of the hot loop give the same results as the reference functions they replaced:
+    The single channel masks must match image_to_bw and talkatoo_preprocess_better on every box of the corpus
+    RoiFrame crops must be the same pixels as frame_to_image, for the corpus scaled to common and odd capture sizes
+    Batch scoring must give the same score as score_func for every moon of every candidate table, in every language
+No model is loaded, so it runs without torch and easyocr installed
+Exits with 1 and lists what went wrong otherwise, so it can run before a release or in CI
+Usage: python check_reference.py [--frames dir_with_pngs] [--languages english french_france ...]
+"""
+
+import argparse
+import sys
+
+import cv2  # pip install opencv-python
+import numpy as np
+
+from benchmark import load_corpus, table_ocr_texts, with_batch_scoring
+from detection import KINGDOM_BORDERS, STORY_TEXT_BORDERS, RoiFrame, RoiMap, frame_to_image, story_text_source_map
+import matching
+from matching import KINGDOM_LIST, LANGUAGES, MoonMatcher, generate_moon_dict
+from util_functions import bw_mask, determine_borders, image_to_bw, talkatoo_mask, talkatoo_preprocess_better
+
+VERIFY_TEXTS = 10  # OCR texts per candidate table
+MODEL_MODULES = ("torch", "easyocr")  # Loading any of these means a check pulled in a model
+ROI_SIZES = ((1920, 1080), (2560, 1440), (1366, 768), (1600, 900))  # width, height the corpus is scaled to for the RoiFrame check
+ROI_TRIM = 3  # Pixels trimmed off every edge for a second set of borders, like a capture with black bars
+
+
+# Compare the single channel masks with the channels of image_to_bw and talkatoo_preprocess_better on every box
+# of the corpus, returns the number of masks that differ in any byte or in whether the Talkatoo box has text
+def verify_masks(frames):
+    borders = determine_borders(cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB))
+    mismatches = 0
+    for frame in frames:
+        image = frame_to_image(frame, borders)
+        for box, white in [(KINGDOM_BORDERS, 240), (STORY_TEXT_BORDERS, 240)] + [(settings["Moon_Bounds"], 230) for settings in LANGUAGES.values()]:
+            reference = image_to_bw(image.crop(box), white=white)
+            mask = bw_mask(image.crop(box), white=white)
+            mismatches += not np.array_equal(reference, cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB))
+        for kingdom in KINGDOM_LIST:
+            for box in {settings["Talkatoo_Bounds"] for settings in LANGUAGES.values()}:
+                reference, ref_text = talkatoo_preprocess_better(image.crop(box), kingdom)
+                mask, has_text = talkatoo_mask(image.crop(box), kingdom)
+                mismatches += not np.array_equal(reference[:, :, 0], mask) or ref_text != has_text
+    return mismatches
+
+
+# Compare RoiFrame crops of every box the checks use with frame_to_image, returns the number of crops that differ in any byte
+def verify_roi(frames):
+    boxes = {KINGDOM_BORDERS, story_text_source_map()[0]}
+    boxes |= {tuple(settings[name]) for settings in LANGUAGES.values() for name in ("Moon_Bounds", "Talkatoo_Bounds")}
+    mismatches = 0
+    for size in ROI_SIZES:
+        scaled = [cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR) for frame in frames]
+        for borders in ((0, 0) + size, (ROI_TRIM, ROI_TRIM, size[0] - ROI_TRIM, size[1] - ROI_TRIM)):
+            roi_map = RoiMap(borders)
+            for frame in scaled:
+                image = np.asarray(frame_to_image(frame, borders))
+                roi_frame = RoiFrame(frame, roi_map)
+                mismatches += sum(not np.array_equal(image[box[1]:box[3], box[0]:box[2]], np.asarray(roi_frame.crop(box))) for box in boxes)
+    return mismatches
+
+
+# Compare batch scoring with score_func on every candidate table at every low point, returns the number of mismatches
+def verify_scoring(matcher):
+    threshold = matcher.language_settings["Score"]
+    low_points = range(threshold, threshold + 5)
+    mismatches = 0
+    for table in matcher.candidate_tables.values():
+        for text in table_ocr_texts(matcher, table, VERIFY_TEXTS):
+            for can_fail_out in (True, False):
+                scalar = with_batch_scoring(False, lambda: matcher.scorer(text, table, low_points, can_fail_out))
+                batch = with_batch_scoring(True, lambda: matcher.scorer(text, table, low_points, can_fail_out))
+                mismatches += sum(scalar(i, low_point) != batch(i, low_point) for i in range(len(table.moons)) for low_point in low_points)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the fast paths against the reference functions without loading any model")
+    parser.add_argument("--frames", help="directory of png frames to check the masks and crops on, synthetic frames if not given")
+    parser.add_argument("--languages", nargs="+", choices=list(LANGUAGES), default=list(LANGUAGES),
+                        help="languages to check batch scoring for, all by default")
+    args = parser.parse_args()
+    matching.VERBOSE = False
+
+    failures = []
+    frames = load_corpus(args.frames)
+    mismatches = verify_masks(frames)
+    print("[STATUS] -> Single channel masks: {} mismatches".format(mismatches))
+    if mismatches:
+        failures.append("Single channel masks differ from the reference {} times".format(mismatches))
+    mismatches = verify_roi(frames)
+    print("[STATUS] -> Region of interest crops: {} mismatches".format(mismatches))
+    if mismatches:
+        failures.append("RoiFrame crops differ from frame_to_image {} times".format(mismatches))
+
+    moons_by_kingdom, hint_arts = generate_moon_dict()
+    for language in args.languages:
+        mismatches = verify_scoring(MoonMatcher(moons_by_kingdom, hint_arts, language))
+        print("[STATUS] -> Batch scoring for {}: {} mismatches".format(language, mismatches))
+        if mismatches:
+            failures.append("Batch scoring differs from score_func {} times for {}".format(mismatches, language))
+
+    models = [name for name in MODEL_MODULES if name in sys.modules]
+    if models:
+        failures.append("The checks loaded {}".format(", ".join(models)))
+    for failure in failures:
+        print("[ERROR] -> {}".format(failure), file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
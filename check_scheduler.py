@@ -0,0 +1,89 @@
+"""
+Checks the check scheduler against the situations that broke it before, in simulated capture time:
+    A Talkatoo line that settles on an otherwise static screen must fire, even after the scheduler went idle
+    The other checks must still drop to the idle rate on that screen
+No model is loaded and nothing is captured, so it runs anywhere in a fraction of a second
+Exits with 1 and lists what went wrong otherwise, so it can run before a release or in CI
+Usage: python check_scheduler.py [--fps 15] [--seconds 30]
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from detection import CHECK_RATES, THUMBNAIL_SIZE
+from scheduler import IDLE_AFTER, IDLE_INTERVAL, CheckScheduler
+from text_settle import TextSettleTracker
+
+TALKATOO_BOX = (50, 650)  # height, width of the simulated Talkatoo mask
+LINE_AT = 15  # Seconds into the run the Talkatoo line starts scrolling in, well after the scheduler went idle
+SCROLL_TIME = 1.0  # Seconds the line takes to scroll in
+
+
+# Scheduler with the detector's checks, nothing slows them down so only idling changes the rates
+def detector_scheduler():
+    scheduler = CheckScheduler(budget=float("inf"))
+    for name, interval, priority, cost, max_interval in CHECK_RATES:
+        scheduler.register(name, interval, priority, cost, max_interval)
+    return scheduler
+
+
+# Ink mask of the Talkatoo box at a time, a line scrolling in from LINE_AT and then staying put
+def talkatoo_mask_at(new_time):
+    mask = np.full(TALKATOO_BOX, 255, dtype=np.uint8)
+    if new_time < LINE_AT:
+        return mask, False
+    shown = min(1.0, (new_time - LINE_AT) / SCROLL_TIME)
+    mask[15:35, 10:10 + int(shown * 600)] = 0
+    return mask, True
+
+
+# Run a static screen with one Talkatoo line through the scheduler and the settle tracker
+# Returns the settled lines found, the idle intervals of the checks and whether the scheduler went idle
+def simulate_static_line(fps, seconds):
+    scheduler = detector_scheduler()
+    tracker = TextSettleTracker()
+    thumbnail = np.zeros((THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0], 3), dtype=np.uint8)  # A line only moves a few samples, so none
+    fires = 0
+    went_idle = False
+    intervals = {}
+    for frame in range(int(fps * seconds)):
+        new_time = frame / fps
+        scheduler.observe(thumbnail, new_time)
+        if scheduler.idle and not went_idle:
+            went_idle = True
+            intervals = {check.name: scheduler.effective_interval(check) for check in scheduler.checks.values()}
+        for name in scheduler.plan(new_time):
+            scheduler.start(name, new_time)
+            if name == "talkatoo":
+                fires += tracker.update(*talkatoo_mask_at(new_time), new_time)
+    return fires, intervals, went_idle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the check scheduler in simulated capture time")
+    parser.add_argument("--fps", type=float, default=15, help="frame rate of the simulated capture")
+    parser.add_argument("--seconds", type=float, default=30, help="length of the simulated capture")
+    args = parser.parse_args()
+
+    failures = []
+    fires, intervals, went_idle = simulate_static_line(args.fps, args.seconds)
+    print("[STATUS] -> Static screen: idle after {}s {}, intervals {}, Talkatoo lines found {}".format(
+        IDLE_AFTER, went_idle, {name: round(interval, 3) for name, interval in intervals.items()}, fires))
+    if not went_idle:
+        failures.append("The scheduler never went idle on a static screen")
+    if fires != 1:
+        failures.append("A settled Talkatoo line on an idle screen fired {} times instead of once".format(fires))
+    for name, interval, priority, cost, max_interval in CHECK_RATES:
+        expected = max(interval, IDLE_INTERVAL) if max_interval is None else min(max(interval, IDLE_INTERVAL), max_interval)
+        if went_idle and intervals[name] != expected:
+            failures.append("{} runs every {}s while idle instead of {}s".format(name, intervals[name], expected))
+
+    for failure in failures:
+        print("[ERROR] -> {}".format(failure), file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
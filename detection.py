@@ -0,0 +1,579 @@
+"""
+Detection pipeline shared by the GUI main loop and headless tools:
+    Check kingdom via the purple coin counter
+    Check moon get text, story and multi moons
+    Check Talkatoo text
+Nothing in here talks to eel, results are returned as events so any front end can use them
+torch and easyocr are only imported when a model is first needed, Detector.warm_up loads them ahead of time
+Matching OCR text to moons lives in matching.py, Detector adds the screen checks and models to its MoonMatcher
+"""
+
+import cv2  # pip install opencv-python
+from event_log import event_log
+import math
+from matching import *
+from ocr_cache import LRUCache, image_hash
+from ocr_worker import OcrWorker
+from PIL import Image  # pip install pillow
+from reader_pool import ReaderPool
+from scheduler import CheckScheduler
+import sys
+from text_settle import TextSettleTracker
+import threading
+import time
+from util_functions import *
+
+
+IM_WIDTH = 1280  # This number should not change
+IM_HEIGHT = 720  # This number should not change
+KINGDOM_MODEL_PATH = "KingdomModel.zip"
+
+# Borders for critical areas, given constant screen size
+KINGDOM_BORDERS = (161, 27, 211, 77)
+RED_BORDERS = (0, 0, 128, 50)
+STORY_BORDERS = (210, 240, 260, 368)
+MULTI_BORDERS = (870, 170, 950, 250)
+STORY_TEXT_BORDERS = (300, 550, 950, 610)
+STORY_TEXT_ANGLE = -3.5  # Story moon text is tilted
+ROI_FIRST = True  # Only convert and scale the boxes that get checked instead of the whole frame
+OCR_CACHE_SIZE = 64  # readtext results of recent crops, by perceptual hash
+OCR_QUEUE_SIZE = 4  # Reads waiting for the OCR worker, the oldest is dropped when full
+READER_PRELOAD = ()  # Game languages whose OCR readers are loaded in the background by warm_up, e.g. ("japanese",)
+FAST_OCR = True  # Recognize inside the text bounds from text_bounds, skipping easyocr's text detection
+FAST_OCR_CONFIDENCE = 0.5  # Lowest recognizer confidence the fast path accepts, else the crop is read with readtext
+FAST_OCR_MARGIN = 0.1  # Margin added around the text bounds, as a share of the text height like easyocr's add_margin
+QUANTIZE_KINGDOM = False  # int8 kingdom classifier, quantize_report.py checks it against the float model on a recording
+QUANTIZE_OCR = True  # easyocr's dynamic int8 recognizer on CPU, which is its default
+TORCH_THREADS = 2  # Intra-op threads for inference, leaves cores to the capture, audio and GUI threads
+TORCH_INTEROP_THREADS = 1
+THUMBNAIL_SIZE = (32, 18)  # width, height of the frame thumbnails the scheduler compares to detect an idle screen
+RESIZE_SUPPORT = 2.0  # Support of the bicubic filter PIL resizes with
+RESIZE_PRECISION = 22  # Fractional bits of PIL's fixed point resize coefficients for 8 bit images
+
+KINGDOM_TIMER = 3
+MOON_TIMER = 0.5
+STORY_MOON_TIMER = 0.5
+KINGDOM_CONFIRM_DELAY = 1  # A new kingdom is checked again this soon before switching
+MOON_BACKOFF = 6  # No moon get text right after a match, 5s tends to be too short so wait 6s
+STORY_BACKOFF = 10
+# name, interval, priority (0 is never slowed down), first cost guess in seconds, longest interval under load
+# Checks run within a frame in this order, Talkatoo must stay close to every frame for TextSettleTracker
+CHECK_RATES = (("kingdom", KINGDOM_TIMER, 3, 0.005, None), ("moon", MOON_TIMER, 1, 0.001, None),
+               ("story", STORY_MOON_TIMER, 2, 0.001, None), ("talkatoo", 0, 0, 0.001, 0.1))
+
+KINGDOM_CERTAINTY = 0.85  # Classifier certainty to prevent uncertain kingdom switches (must occur 2 times in a row)
+VERBOSE = True
+
+
+# Convert a captured BGR frame to the cropped 1280x720 RGB image every check works on
+def frame_to_image(frame, borders):
+    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    # Resizing image needed for distortion correction. NEAREST is ~8x faster than default but riskier so still testing
+    return Image.fromarray(image[borders[1]:borders[3], borders[0]:borders[2]]).resize((IM_WIDTH, IM_HEIGHT))
+
+
+# For every pixel of the straightened story text, the pixel of the 1280x720 image it comes from (-1 for none)
+# Made by rotating an image of pixel indices, so it matches PIL's rotate exactly
+def story_text_source_map():
+    index = np.arange(1, IM_WIDTH * IM_HEIGHT + 1, dtype=np.int32).reshape(IM_HEIGHT, IM_WIDTH)
+    rotated = np.array(Image.fromarray(index).rotate(STORY_TEXT_ANGLE).crop(STORY_TEXT_BORDERS)) - 1
+    valid = rotated >= 0
+    rows, cols = np.divmod(np.where(valid, rotated, 0), IM_WIDTH)
+    patch = (int(cols[valid].min()), int(rows[valid].min()), int(cols[valid].max()) + 1, int(rows[valid].max()) + 1)
+    return patch, rows - patch[1], cols - patch[0], valid
+
+
+# PIL's bicubic filter, written the same way so it rounds the same way
+def bicubic_filter(x):
+    x = np.abs(x)
+    near = ((-0.5 + 2.0) * x - (-0.5 + 3.0)) * x * x + 1
+    far = (((x - 5) * x + 8) * x - 4) * -0.5
+    return np.where(x < 1.0, near, np.where(x < 2.0, far, 0.0))
+
+
+# First source pixel and fixed point weights of every output pixel when PIL resizes the start to stop part of in_size
+# pixels to out_size with BICUBIC, the same arithmetic as precompute_coeffs and normalize_coeffs_8bpc in PIL's Resample.c
+def bicubic_coefficients(in_size, out_size, start=0.0, stop=None):
+    start, stop = float(np.float32(start)), float(np.float32(in_size if stop is None else stop))  # PIL passes the box as C floats
+    scale = (stop - start) / out_size
+    filterscale = max(scale, 1.0)
+    support = RESIZE_SUPPORT * filterscale
+    taps = math.ceil(support) * 2 + 1
+    center = start + (np.arange(out_size) + 0.5) * scale
+    first = np.maximum(np.trunc(center - support + 0.5), 0).astype(np.int64)
+    count = np.minimum(np.trunc(center + support + 0.5), in_size).astype(np.int64) - first
+    weights = np.zeros((out_size, taps))
+    total = np.zeros(out_size)
+    for tap in range(taps):  # Summed tap by tap like PIL, numpy's pairwise sum could round differently
+        weights[:, tap] = np.where(tap < count, bicubic_filter(((tap + first) - center + 0.5) * (1.0 / filterscale)), 0.0)
+        total += weights[:, tap]
+    weights /= np.where(total != 0.0, total, 1.0)[:, None]
+    weights *= 1 << RESIZE_PRECISION
+    return first, np.trunc(np.where(weights < 0, weights - 0.5, weights + 0.5)).astype(np.int32)
+
+
+# Resize along one axis of a uint8 image with (first source pixel, weights) of each output pixel, rounded like PIL
+def apply_coefficients(src, first, weights, axis):
+    index = np.minimum(first[:, None] + np.arange(weights.shape[1]), src.shape[axis] - 1)  # Past the edge the weight is 0
+    shape = [1] * src.ndim
+    shape[axis] = len(first)
+    total = np.full([len(first) if i == axis else size for i, size in enumerate(src.shape)], 1 << (RESIZE_PRECISION - 1), dtype=np.int32)
+    for tap in range(weights.shape[1]):
+        total += np.take(src, index[:, tap], axis=axis) * weights[:, tap].reshape(shape)
+    return np.clip(total >> RESIZE_PRECISION, 0, 255).astype(np.uint8)
+
+
+# Maps boxes of the 1280x720 image back to the captured frame, only valid for the borders it was made with
+# A box is resized by PIL from a patch around it where that gives the same weights as resizing the whole frame,
+# which it does for scales like 1.5 or 2, else the weights of the whole frame are applied by apply_coefficients
+class RoiMap:
+    # constructor
+    def __init__(self, borders):
+        self.borders = tuple(borders)
+        self.width = borders[2] - borders[0]
+        self.height = borders[3] - borders[1]
+        self.scale_x = self.width / IM_WIDTH
+        self.scale_y = self.height / IM_HEIGHT
+        self.margin_x = math.ceil(RESIZE_SUPPORT * max(self.scale_x, 1)) + 1
+        self.margin_y = math.ceil(RESIZE_SUPPORT * max(self.scale_y, 1)) + 1
+        self.columns = bicubic_coefficients(self.width, IM_WIDTH)  # What frame_to_image's resize does to every column
+        self.rows = bicubic_coefficients(self.height, IM_HEIGHT)
+        self.source_boxes = {}  # box -> (frame slices, PIL resize box or column and row coefficients), filled once per box
+
+    # (row slice, column slice, PIL resize box, column coefficients, row coefficients) of the frame pixels a box is made from
+    # The resize box is None if PIL would round differently, the coefficients are None for PIL or an axis that keeps its size
+    def source_box(self, box):
+        if box not in self.source_boxes:
+            self.source_boxes[box] = self.pil_source_box(box) or self.exact_source_box(box)
+        return self.source_boxes[box]
+
+    # Frame slices that cover the box plus filter margin and where the box lies within them, None if PIL's weights differ
+    def pil_source_box(self, box):
+        left, top = box[0] * self.scale_x, box[1] * self.scale_y
+        right, bottom = box[2] * self.scale_x, box[3] * self.scale_y
+        x0 = max(0, math.floor(left) - self.margin_x)
+        y0 = max(0, math.floor(top) - self.margin_y)
+        x1 = min(self.width, math.ceil(right) + self.margin_x)
+        y1 = min(self.height, math.ceil(bottom) + self.margin_y)
+        if not (same_coefficients(self.columns, box[0], box[2], x0, x1 - x0, left - x0, right - x0)
+                and same_coefficients(self.rows, box[1], box[3], y0, y1 - y0, top - y0, bottom - y0)):
+            return None
+        rows = slice(self.borders[1] + y0, self.borders[1] + y1)
+        cols = slice(self.borders[0] + x0, self.borders[0] + x1)
+        return rows, cols, (left - x0, top - y0, right - x0, bottom - y0), None, None
+
+    # Frame slices of every pixel with a weight in the box and the weights relative to them
+    def exact_source_box(self, box):
+        x0, x1, columns = axis_coefficients(self.columns, box[0], box[2], self.width == IM_WIDTH)
+        y0, y1, rows = axis_coefficients(self.rows, box[1], box[3], self.height == IM_HEIGHT)
+        return slice(self.borders[1] + y0, self.borders[1] + y1), slice(self.borders[0] + x0, self.borders[0] + x1), None, columns, rows
+
+
+# Whether PIL resizing start to stop of size source pixels at offset gives outputs out_start to out_stop the same weights
+# as coefficients of the whole axis
+def same_coefficients(coefficients, out_start, out_stop, offset, size, start, stop):
+    first, weights = bicubic_coefficients(size, out_stop - out_start, start, stop)
+    return np.array_equal(first + offset, coefficients[0][out_start:out_stop]) and np.array_equal(weights, coefficients[1][out_start:out_stop])
+
+
+# (first, last + 1, coefficients relative to first) of the source pixels of outputs out_start to out_stop
+# No coefficients if the axis keeps its size, PIL doesn't resize it then
+def axis_coefficients(coefficients, out_start, out_stop, same_size):
+    if same_size:
+        return out_start, out_stop, None
+    first, weights = coefficients[0][out_start:out_stop], coefficients[1][out_start:out_stop]
+    source_start = int(first.min())
+    source_stop = int(np.max(np.where(weights != 0, first[:, None] + np.arange(weights.shape[1]) + 1, 0)))
+    return source_start, source_stop, (first - source_start, weights)
+
+
+# Stands in for frame_to_image(frame, borders), but converts and scales only the boxes that get cropped
+class RoiFrame:
+    # constructor
+    def __init__(self, frame, roi_map):
+        self.frame = frame
+        self.roi_map = roi_map
+
+    # Same pixels as frame_to_image(frame, borders).crop(box)
+    def crop(self, box):
+        box = tuple(box)
+        rows, cols, resize_box, column_coefficients, row_coefficients = self.roi_map.source_box(box)
+        if resize_box is not None:
+            patch = cv2.cvtColor(self.frame[rows, cols], cv2.COLOR_BGR2RGB)
+            return Image.fromarray(patch).resize((box[2] - box[0], box[3] - box[1]), Image.BICUBIC, box=resize_box)
+        patch = self.frame[rows, cols]
+        if column_coefficients is not None:  # Columns first, like PIL
+            patch = apply_coefficients(patch, *column_coefficients, axis=1)
+        if row_coefficients is not None:
+            patch = apply_coefficients(patch, *row_coefficients, axis=0)
+        return Image.fromarray(cv2.cvtColor(patch, cv2.COLOR_BGR2RGB))
+
+
+# Tiny version of a frame (or image), enough to tell whether anything on screen changed
+def frame_thumbnail(image):
+    if isinstance(image, RoiFrame):
+        frame = image.frame
+        return np.ascontiguousarray(frame[::max(1, frame.shape[0] // THUMBNAIL_SIZE[1]), ::max(1, frame.shape[1] // THUMBNAIL_SIZE[0])])
+    return np.asarray(image.resize(THUMBNAIL_SIZE, Image.NEAREST))
+
+
+# Get the image the checks work on, either the whole converted frame or only the needed boxes
+def prepare_frame(frame, borders, roi_map=None):
+    if roi_map is not None:
+        return RoiFrame(frame, roi_map)
+    return frame_to_image(frame, borders)
+
+
+story_text_map = None  # Filled on first use by crop_story_text
+
+
+# Straightened story/multi moon text, same as image.rotate(STORY_TEXT_ANGLE).crop(STORY_TEXT_BORDERS)
+def crop_story_text(image):
+    global story_text_map
+    if isinstance(image, RoiFrame):  # Only scale the area the text comes from and pick its pixels
+        if story_text_map is None:
+            story_text_map = story_text_source_map()
+        patch_box, rows, cols, valid = story_text_map
+        text_arr = np.array(image.crop(patch_box))[rows, cols]
+        text_arr[~valid] = 0  # Black like the corners PIL fills in when rotating
+        return Image.fromarray(text_arr)
+    return image.rotate(STORY_TEXT_ANGLE).crop(STORY_TEXT_BORDERS)
+
+
+DETECTOR_CHECKS = ("kingdom", "moon", "story", "talkatoo")  # What process_frame looks for
+OCR_JOBS = {"collected": ("Collected", False, False), "story": ("Collected", True, False),  # job -> (prepend, story, multi)
+            "multi": ("Collected", False, True), "mentioned": ("Unlocked", False, False)}
+
+
+# torch with the thread counts of TORCH_THREADS and TORCH_INTEROP_THREADS
+def import_torch():
+    import torch  # pip install torch, imported here since it takes seconds
+    if torch.get_num_interop_threads() != TORCH_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError:  # Can only be set before torch first runs something in parallel
+            pass
+    if torch.get_num_threads() != TORCH_THREADS:
+        torch.set_num_threads(TORCH_THREADS)
+    return torch
+
+
+# Pretrained kingdom recognizer, output 0-13 inclusive
+def load_kingdom_classifier(path=KINGDOM_MODEL_PATH, quantize=QUANTIZE_KINGDOM):
+    torch = import_torch()
+    model = torch.jit.load(path).eval()
+    if not quantize:
+        return model
+    try:
+        return quantize_kingdom_classifier(model)
+    except Exception as error:  # Quantization support depends on how torch was built, the float model still works
+        print("[ERROR] -> Could not quantize the kingdom classifier, using float: {}".format(error), file=sys.stderr)
+        return model
+
+
+# int8 copy of the TorchScript kingdom classifier
+# Statically quantized if calibration (kingdom crops like update_kingdom gets them) is given, else only the linear layers
+def quantize_kingdom_classifier(model, calibration=None):
+    import_torch()
+    from torch.ao.quantization import default_dynamic_qconfig, get_default_qconfig, quantize_dynamic_jit, quantize_jit
+    if not calibration:
+        return quantize_dynamic_jit(model.eval(), {"": default_dynamic_qconfig})
+    run_fn = lambda calibrated, images: [calibrated(kingdom_tensor(img_arr)) for img_arr in images]
+    return quantize_jit(model.eval(), {"": get_default_qconfig("fbgemm")}, run_fn, [calibration])
+
+
+# Batch of one CHW float tensor for the kingdom classifier
+def kingdom_tensor(img_arr):
+    torch = import_torch()
+    return torch.from_numpy(np.ascontiguousarray(img_arr.transpose(2, 0, 1))).unsqueeze(dim=0).type(torch.float32)  # HWC to CHW
+
+
+# Kingdom shown in a 50x50 black and white crop of the coin counter, None if the model isn't sure
+def classify_kingdom(kingdom_classifier, img_arr):
+    torch = import_torch()
+    with torch.no_grad():
+        probs = torch.softmax(kingdom_classifier(kingdom_tensor(img_arr)), dim=1)
+    result = int(torch.argmax(probs))
+    if result != 13 and probs[0][result] > KINGDOM_CERTAINTY:  # 13 is "Other" in my model
+        return KINGDOM_LIST[result]
+    return None  # Was not able to determine kingdom
+
+
+# MoonMatcher that also finds the text on screen, reads it and keeps track of the run
+class Detector(MoonMatcher):
+    # constructor
+    # kingdom_classifier and the OCR reader are loaded on first use if not given, see warm_up
+    def __init__(self, moons_by_kingdom, hint_arts, kingdom_classifier=None, translate_from=DEFAULT_GAME_LANGUAGE,
+                 translate_to=DEFAULT_GUI_LANGUAGE, is_postgame=False, manually_switch_kingdoms=False, global_search=GLOBAL_SEARCH,
+                 async_ocr=False, checks=DETECTOR_CHECKS, preload_languages=READER_PRELOAD):
+        self.model_lock = threading.Lock()  # Models may be loaded by a warm-up thread while the loop needs them
+        self._kingdom_classifier = kingdom_classifier
+        self.reader_pool = ReaderPool(quantize=QUANTIZE_OCR, verbose=VERBOSE)
+        self.preload_languages = preload_languages
+        self.manually_switch_kingdoms = manually_switch_kingdoms
+        self.checks = set(checks)  # Subset of DETECTOR_CHECKS, so several processes can share the work
+        self.mentioned_moons = []  # list of moons mentioned by Talkatoo
+        self.collected_moons = []  # list of auto-recognized collected moons
+
+        self.ocr_cache = LRUCache(OCR_CACHE_SIZE)
+        self.ocr_worker = OcrWorker(OCR_QUEUE_SIZE) if async_ocr else None  # Read inline if None
+        self.ocr_paths = {"fast": 0, "fallback": 0, "full": 0}  # How crops were read, see read_line
+        self.inline_ocr_seconds = 0  # Time the current frame spent reading text inline, kept out of the check costs
+        self.scheduler = CheckScheduler()
+        for name, interval, priority, cost, max_interval in CHECK_RATES:
+            if name in self.checks:
+                self.scheduler.register(name, interval, priority, cost, max_interval)
+        self.talkatoo_tracker = TextSettleTracker()  # Reads Talkatoo text once per line, when it stopped scrolling in
+        self.mask_buffers = {}  # name -> uint8 array the black and white mask of a box is written into every frame
+        super().__init__(moons_by_kingdom, hint_arts, translate_from, translate_to, is_postgame, global_search)
+        self.reset_timers()
+
+    # Tools switch prints off through detection.VERBOSE
+    @property
+    def verbose(self):
+        return VERBOSE
+
+    # Start checking everything again right away
+    def reset_timers(self):
+        self.change_kingdom = ""  # Confirmation variable for kingdom changes
+        self.scheduler.reset()  # Check right after start
+        self.talkatoo_tracker.reset()  # So we don't read partial text
+
+    # Clear the mentioned and collected moons
+    def reset_run(self):
+        self.mentioned_moons = []
+        self.collected_moons = []
+
+    # reset input language, cached reads were made for the old one
+    # The new language's reader starts loading in the background, so the frame loop doesn't wait for it
+    def set_translate_from(self, t_from):
+        if self.translate_from != t_from:
+            self.ocr_cache.clear()
+            if self.translate_from is not None and t_from in LANGUAGES:  # Not on construction, warm_up loads the first reader
+                self.preload_readers([t_from])
+        super().set_translate_from(t_from)
+
+    # Load the readers of these game languages on a background thread, returns the thread
+    def preload_readers(self, languages):
+        codes = [LANGUAGES[language]["Language"] for language in languages]
+        thread = threading.Thread(target=self.load_readers, args=(codes,), name="reader-preload", daemon=True)
+        thread.start()
+        return thread
+
+    # Thread body of preload_readers
+    def load_readers(self, codes):
+        import_torch()  # Thread counts are set before easyocr loads its models
+        self.reader_pool.load_all(codes)
+
+    # Read one line of text, same output as readtext
+    # With bounds (left, top, right, bottom) of the text only the recognizer runs, unsure results are read again with readtext
+    def read_line(self, reader, img_arr, bounds=None):
+        start = time.perf_counter()
+        path, ocr_text = self.read_line_path(reader, img_arr, bounds)
+        self.ocr_paths[path] += 1
+        event_log.debug("ocr", path=path, ms=round((time.perf_counter() - start) * 1000, 2), lines=len(ocr_text))
+        return ocr_text
+
+    # ("full", "fast" or "fallback", result of readtext) for read_line
+    def read_line_path(self, reader, img_arr, bounds):
+        if not FAST_OCR or bounds is None:
+            return "full", reader.readtext(img_arr)
+        left, top, right, bottom = bounds
+        margin = int(FAST_OCR_MARGIN * (bottom - top)) + 1
+        box = [max(left - margin, 0), min(right + margin, img_arr.shape[1]), max(top - margin, 0), min(bottom + margin, img_arr.shape[0])]
+        ocr_text = reader.recognize(img_arr, horizontal_list=[box], free_list=[])
+        if ocr_text and min(confidence for _, _, confidence in ocr_text) >= FAST_OCR_CONFIDENCE:
+            return "fast", ocr_text
+        return "fallback", reader.readtext(img_arr)
+
+    # read_line with the reader of an OCR language code, run on the OCR worker so only it waits for a reader that is still loading
+    def read_line_for(self, code, img_arr, bounds=None):
+        import_torch()
+        return self.read_line(self.reader_pool.get(code), img_arr, bounds)
+
+    # read_line through the OCR cache, crops that look the same as a recent one are not read again
+    def read_text(self, img_arr, key=None, bounds=None):
+        return self.ocr_cache.get_or_compute(key or image_hash(img_arr), lambda: self.read_line(self.reader, img_arr, bounds))
+
+    # Buffer for the mask of a (left, top, right, bottom) box, reused every frame while the box keeps its size
+    def mask_buffer(self, name, box):
+        shape = (box[3] - box[1], box[2] - box[0])
+        buffer = self.mask_buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self.mask_buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    # Read img_arr for an OCR_JOBS job, inline without a worker or if the crop is cached, else on the worker
+    # Returns the events of an inline read, reads on the worker report theirs from a later process_frame
+    def request_ocr(self, img_arr, job, new_time, bounds=None):
+        key = image_hash(img_arr)
+        if self.ocr_worker is None or key in self.ocr_cache:
+            read_start = time.perf_counter()
+            ocr_text = self.read_text(img_arr, key, bounds)
+            self.inline_ocr_seconds += time.perf_counter() - read_start
+            return self.finish_ocr(job, ocr_text, new_time)
+        args = (self.language_settings["Language"], img_arr.copy(), bounds)  # Masks are reused next frame
+        self.ocr_worker.submit((key, job), self.read_line_for, args, self.translate_from)
+        return []
+
+    # Events of the reads the worker finished since the last frame
+    def collect_ocr_results(self, new_time):
+        events = []
+        if self.ocr_worker is None:
+            return events
+        for (key, job), translate_from, ocr_text in self.ocr_worker.poll():
+            if translate_from != self.translate_from:  # Read by the reader of the previous language
+                continue
+            self.ocr_cache.put(key, ocr_text)
+            events += self.finish_ocr(job, ocr_text, new_time)
+        return events
+
+    # Match a finished read and update the run state like process_frame would, returns the events
+    def finish_ocr(self, job, ocr_text, new_time):
+        prepend, story, multi = OCR_JOBS[job]
+        moon_matches = self.match_ocr_text(ocr_text, prepend, story, multi)
+        if job == "story" or job == "multi":  # Always reported, even without a match
+            self.collected_moons.append(moon_matches)
+            return [("collected", moon_matches)]
+        moons = self.collected_moons if job == "collected" else self.mentioned_moons
+        if moon_matches and (not moons or moon_matches != moons[-1]):  # Allow nonconsecutive duplicates
+            moons.append(moon_matches)
+            if job == "collected":
+                self.scheduler.schedule("moon", new_time + MOON_BACKOFF)
+            return [(job, moon_matches)]
+        return []
+
+    # Reads waiting for or running on the OCR worker
+    def ocr_queue_depth(self):
+        return self.ocr_worker.depth() if self.ocr_worker else 0
+
+    # Stop the OCR worker, pending reads are dropped
+    def close(self):
+        if self.ocr_worker:
+            self.ocr_worker.close()
+
+    # Hit and miss counters of both caches
+    def cache_stats(self):
+        return {"ocr": self.ocr_cache.stats(), "match": self.match_cache.stats()}
+
+    # Recognize, clean, and check moon text
+    def match_moon_text(self, moon_img, prepend="Unlocked", story=False, multi=False):
+        return self.match_ocr_text(self.read_text(moon_img), prepend, story, multi)
+
+    # OCR reader for the game language, instant if the pool already has it
+    @property
+    def reader(self):
+        import_torch()  # Thread counts are set before easyocr loads its models
+        return self.reader_pool.get(self.language_settings["Language"])
+
+    @property
+    def kingdom_classifier(self):
+        with self.model_lock:
+            if self._kingdom_classifier is None:
+                self._kingdom_classifier = load_kingdom_classifier()
+            return self._kingdom_classifier
+
+    # Load the models and run each of them once, so the first real frame isn't slowed down by lazy setup in torch
+    # progress(text, fraction) is called before every stage
+    def warm_up(self, progress=None):
+        report = progress or (lambda text, fraction: None)
+        report("Loading text recognition for {}".format(self.translate_from), 0.1)
+        self.reader  # Loaded and warmed up by the reader pool
+        if "kingdom" in self.checks:
+            report("Loading kingdom recognition", 0.5)
+            self.update_kingdom(np.zeros((KINGDOM_BORDERS[3] - KINGDOM_BORDERS[1], KINGDOM_BORDERS[2] - KINGDOM_BORDERS[0], 3), dtype=np.uint8))
+        if self.preload_languages:
+            self.preload_readers(self.preload_languages)
+        report("Ready", 1.0)
+
+    # Check kingdom via recognition and update it if needed
+    def update_kingdom(self, img_arr):
+        return classify_kingdom(self.kingdom_classifier, img_arr)
+
+    # Run the checks the scheduler picks on one 1280x720 image (or RoiFrame), new_time is the capture time in seconds
+    # Returns a list of (event, payload) tuples: ("kingdom", name), ("collected", moons) or ("mentioned", moons)
+    # With an OCR worker, matches of earlier frames are reported as soon as their read is done
+    def process_frame(self, image, new_time, frame_time):
+        events = self.collect_ocr_results(new_time)
+        self.scheduler.observe(frame_thumbnail(image), new_time)
+        enabled = self.checks - {"kingdom"} if self.manually_switch_kingdoms else self.checks
+        frame_start = time.perf_counter()
+        self.inline_ocr_seconds = 0
+        for check in self.scheduler.plan(new_time, enabled):
+            self.scheduler.start(check, new_time)
+            check_start = time.perf_counter()
+            ocr_start = self.inline_ocr_seconds
+            check_events, stop = getattr(self, "check_" + check)(image, new_time)
+            check_seconds = time.perf_counter() - check_start - (self.inline_ocr_seconds - ocr_start)
+            self.scheduler.ran(check, check_seconds)
+            event_log.debug("check", name=check, ms=round(check_seconds * 1000, 3), events=len(check_events))
+            events += check_events
+            if stop:
+                break
+        # Inline reads (no worker, or replay and benchmark) are one-off costs of a text box, counting them would slow
+        # the checks down after every read and make the schedule depend on how fast the host reads text
+        self.scheduler.end_frame(time.perf_counter() - frame_start - self.inline_ocr_seconds)
+        return events
+
+    # Check kingdom via the purple coin counter, stops the other checks if it is visible
+    def check_kingdom(self, image, new_time):
+        kingdom_check_im = cv2.cvtColor(bw_mask(image.crop(KINGDOM_BORDERS)), cv2.COLOR_GRAY2RGB)  # Must be 50x50x3 to work in model
+        new_kingdom = self.update_kingdom(kingdom_check_im)
+        if new_kingdom and new_kingdom != self.current_kingdom:  # strong match for new
+            if self.change_kingdom == new_kingdom:  # make sure we get two in a row of the same kingdom
+                self.current_kingdom = new_kingdom
+                self.change_kingdom = ""
+                if VERBOSE:
+                    event_log.info("kingdom", kingdom=new_kingdom)
+                return [("kingdom", new_kingdom)], True
+            self.change_kingdom = new_kingdom
+            self.scheduler.schedule("kingdom", new_time + KINGDOM_CONFIRM_DELAY)  # Perform the second check soon to be sure
+            return [], True  # if purple coin logo visible, not getting a moon or talking to Talkatoo
+        self.change_kingdom = ""
+        return [], False
+
+    # Moon get text, stops the other checks if it was read right away
+    def check_moon(self, image, new_time):
+        language_settings = self.language_settings
+        moon_bounds = language_settings["Moon_Bounds"]
+        moon_check_im = bw_mask(image.crop(moon_bounds), white=230, out=self.mask_buffer("moon", moon_bounds))
+        bounds = text_bounds(moon_check_im, language_settings["Text_Height"], language_settings["Text_Lower"]+0.1, language_settings["Text_Upper"]+0.1, VERBOSE)
+        if bounds:
+            moon_events = self.request_ocr(moon_check_im, "collected", new_time, bounds)
+            return moon_events, bool(moon_events)  # The moon check was pushed back by finish_ocr
+        return [], False
+
+    # Story and multi moons, stops the other checks if one is found
+    def check_story(self, image, new_time):
+        red_check_im = image.crop(RED_BORDERS)
+        if not check_story_multi(red_check_im, expected="RED"):
+            return [], False
+        story_check_im = image.crop(STORY_BORDERS)
+        if check_story_multi(story_check_im, expected="STORY"):
+            if VERBOSE:
+                event_log.info("story_moon", kind="story")
+            story_text = crop_story_text(image)
+            story_text = bw_mask(story_text, white=240, out=self.mask_buffer("story", STORY_TEXT_BORDERS))
+            self.scheduler.schedule("story", new_time + STORY_BACKOFF)
+            return self.request_ocr(story_text, "story", new_time), True
+
+        multi_check_im = image.crop(MULTI_BORDERS)
+        if check_story_multi(multi_check_im, expected="MULTI"):
+            if VERBOSE:
+                event_log.info("story_moon", kind="multi")  # Don't bother with OCR since moon border makes it unreliable
+            multi_text = crop_story_text(image)
+            multi_text = bw_mask(multi_text, white=240, out=self.mask_buffer("story", STORY_TEXT_BORDERS))
+            self.scheduler.schedule("story", new_time + STORY_BACKOFF)
+            return self.request_ocr(multi_text, "multi", new_time), True
+        return [], False
+
+    # Talkatoo text, read once per line when it stopped scrolling in
+    def check_talkatoo(self, image, new_time):
+        language_settings = self.language_settings
+        talkatoo_bounds = language_settings["Talkatoo_Bounds"]
+        talkatoo_text, poss_text = talkatoo_mask(image.crop(talkatoo_bounds), self.current_kingdom, out=self.mask_buffer("talkatoo", talkatoo_bounds))
+        if self.talkatoo_tracker.update(talkatoo_text, poss_text, new_time):  # Line finished scrolling in
+            bounds = text_bounds(talkatoo_text, language_settings["Text_Height"], language_settings["Text_Lower"], language_settings["Text_Upper"], VERBOSE)
+            if bounds:  # Use text classifier to hopefully avoid unnecessary OCR passes
+                return self.request_ocr(talkatoo_text, "mentioned", new_time, bounds), False
+        return [], False
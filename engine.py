@@ -0,0 +1,244 @@
+"""
+Multi-process detection engine:
+    Capture copies frames into a SharedFrameRing once, detector processes read them without copying
+    One process checks kingdom, moon get text and story moons, another one only reads Talkatoo text
+    Only small events come back: kingdom names and (kingdom, id) pairs of matched moons
+DetectionEngine has the parts of the Detector interface the GUI uses, commands are sent to every process
+"""
+
+import multiprocessing
+import os
+import queue
+import time
+
+from detection import *
+from event_log import LOG_LEVEL, event_log
+from shared_frames import MAX_FRAME_SHAPE, SharedFrameRing
+
+ENGINE_ROLES = {"main": ("kingdom", "moon", "story"), "talkatoo": ("talkatoo",)}  # role -> DETECTOR_CHECKS it runs
+ENGINE_RING_SIZE = 8  # Big enough that a slot is not overwritten while a detector is still on it
+COMMAND_WAIT = 0.05  # Longest a detector process waits for a frame before looking for commands again
+STOP_TIMEOUT = 5
+WARM_UP_POLL = 1  # Seconds between checks that the detector processes are still running while they load
+WARM_UP_TIMEOUT = 600  # Longest wait for the models, easyocr downloads them on the first run
+
+
+# Moons as (kingdom, id) pairs, full dicts carry all 13 languages
+def moon_refs(moons):
+    if moons is None:
+        return None
+    return [(moon["kingdom"], moon["id"]) for moon in moons]
+
+
+# Event log file of a detector process, next to the GUI process's one
+def role_log_path(log_path, role):
+    root, extension = os.path.splitext(log_path)
+    return "{}.{}{}".format(root, role, extension)
+
+
+# Entry point of a detector process, runs the checks of its role on every new frame until stopped
+def run_detector(role, ring, commands, events, settings, borders):
+    checks = ENGINE_ROLES[role]
+    event_log.set_level(settings["log_level"])
+    if settings["log_path"]:
+        event_log.start(role_log_path(settings["log_path"], role))
+    moons_by_kingdom, hint_arts = generate_moon_dict((settings["translate_from"], settings["translate_to"]))
+    detector = Detector(moons_by_kingdom, hint_arts, None, settings["translate_from"], settings["translate_to"],
+                        settings["is_postgame"], settings["manually_switch_kingdoms"], checks=checks)
+    detector.set_current_kingdom(settings["current_kingdom"])
+    detector.warm_up()
+    events.put((role, "ready", None))
+    roi_map = RoiMap(borders) if ROI_FIRST and borders else None
+    last_seq = 0
+    old_time = None
+
+    while not ring.closed:
+        try:
+            while True:  # Apply every command sent since the last frame
+                command, args = commands.get_nowait()
+                if command == "stop":
+                    ring.release()
+                    event_log.close()
+                    return
+                elif command == "set_borders":
+                    borders = args[0]
+                    roi_map = RoiMap(borders) if ROI_FIRST and borders else None
+                elif command == "setattr":
+                    setattr(detector, *args)
+                elif command == "set_log_level":
+                    event_log.set_level(*args)
+                else:
+                    getattr(detector, command)(*args)
+        except queue.Empty:
+            pass
+
+        next_frame = ring.get(last_seq, timeout=COMMAND_WAIT)
+        if next_frame is None or not borders:
+            continue
+        last_seq, new_time, frame, _ = next_frame
+        frame_time = new_time - old_time if old_time is not None else 0
+        old_time = new_time
+        for event, payload in detector.process_frame(prepare_frame(frame, borders, roi_map), new_time, frame_time):
+            events.put((role, event, payload if event == "kingdom" else moon_refs(payload)))
+    ring.release()
+    event_log.close()
+
+
+# Detection in separate processes, fed through shared memory
+class DetectionEngine:
+    # constructor, starts one detector process per role
+    def __init__(self, moons_by_kingdom, translate_from=DEFAULT_GAME_LANGUAGE, translate_to=DEFAULT_GUI_LANGUAGE,
+                 is_postgame=False, manually_switch_kingdoms=False, borders=None, ring_size=ENGINE_RING_SIZE,
+                 max_shape=MAX_FRAME_SHAPE, log_path=None, log_level=LOG_LEVEL):
+        context = multiprocessing.get_context("spawn")  # Forking a process that already runs threads is unsafe
+        self.moons = {(moon["kingdom"], moon["id"]): moon for moons in moons_by_kingdom.values() for moon in moons}
+        self.ring = SharedFrameRing(ring_size, max_shape, condition=context.Condition())
+        self.events = context.Queue()
+        self.current_kingdom = "Cap"
+        self.translate_from = translate_from
+        self.translate_to = translate_to
+        self._is_postgame = is_postgame
+        self._manually_switch_kingdoms = manually_switch_kingdoms
+        self.borders = tuple(borders) if borders else None
+        self.early_messages = []  # Events that arrived while warm_up was waiting for other processes
+
+        settings = {"translate_from": translate_from, "translate_to": translate_to, "is_postgame": is_postgame,
+                    "manually_switch_kingdoms": manually_switch_kingdoms, "current_kingdom": self.current_kingdom,
+                    "log_path": log_path, "log_level": log_level}
+        self.commands = {}
+        self.processes = {}
+        for role in ENGINE_ROLES:
+            self.commands[role] = context.Queue()
+            self.processes[role] = context.Process(target=run_detector, name="detector-" + role, daemon=True,
+                                                   args=(role, self.ring, self.commands[role], self.events, settings, self.borders))
+            self.processes[role].start()
+
+    # Send a command to the detector processes of all roles, or all but skip_role
+    def broadcast(self, command, *args, skip_role=None):
+        for role, commands in self.commands.items():
+            if role != skip_role:
+                commands.put((command, args))
+
+    @property
+    def language_settings(self):
+        return LANGUAGES[self.translate_from]
+
+    @property
+    def is_postgame(self):
+        return self._is_postgame
+
+    @is_postgame.setter
+    def is_postgame(self, value):
+        self._is_postgame = value
+        self.broadcast("setattr", "is_postgame", value)
+
+    @property
+    def manually_switch_kingdoms(self):
+        return self._manually_switch_kingdoms
+
+    @manually_switch_kingdoms.setter
+    def manually_switch_kingdoms(self, value):
+        self._manually_switch_kingdoms = value
+        self.broadcast("setattr", "manually_switch_kingdoms", value)
+
+    # Set the current kingdom, returns False for unknown kingdoms
+    def set_current_kingdom(self, kingdom_name):
+        if kingdom_name not in KINGDOM_LIST:
+            return False
+        self.current_kingdom = kingdom_name
+        self.broadcast("set_current_kingdom", kingdom_name)
+        return True
+
+    # reset input language
+    def set_translate_from(self, t_from):
+        if self.translate_from != t_from:
+            self.translate_from = t_from
+            self.broadcast("set_translate_from", t_from)
+
+    # reset output language
+    def set_translate_to(self, t_to):
+        if self.translate_to != t_to:
+            self.translate_to = t_to
+            self.broadcast("set_translate_to", t_to)
+
+    # Capture borders used by every process, only sent when they changed
+    def set_borders(self, borders):
+        borders = tuple(borders) if borders else None
+        if borders != self.borders:
+            self.borders = borders
+            self.broadcast("set_borders", borders)
+
+    # Change the event log level of every process
+    def set_log_level(self, level):
+        self.broadcast("set_log_level", level)
+
+    # Clear the mentioned and collected moons
+    def reset_run(self):
+        self.broadcast("reset_run")
+
+    # Start checking everything again right away
+    def reset_timers(self):
+        self.broadcast("reset_timers")
+
+    # Wait until every detector process has loaded its models, progress(text, fraction) is called as they finish
+    # Raises RuntimeError if a process dies before it is ready or they take longer than WARM_UP_TIMEOUT
+    def warm_up(self, progress=None):
+        report = progress or (lambda text, fraction: None)
+        ready = set()
+        report("Starting detector processes", 0.1)
+        deadline = time.monotonic() + WARM_UP_TIMEOUT
+        while len(ready) < len(self.processes):
+            try:
+                message = self.events.get(timeout=WARM_UP_POLL)
+            except queue.Empty:
+                alive = self.alive()
+                dead = [role for role in self.processes if role not in ready and role not in alive]
+                if dead:
+                    raise RuntimeError("Detector process {} stopped while loading (exit code {})".format(
+                        dead[0], self.processes[dead[0]].exitcode))
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Detector processes not ready after {}s".format(WARM_UP_TIMEOUT))
+                continue
+            if message[1] != "ready":  # A process that is already running found something
+                self.early_messages.append(message)
+                continue
+            ready.add(message[0])
+            report("Detector {} ready".format(message[0]), 0.1 + 0.9 * len(ready) / len(self.processes))
+        report("Ready", 1.0)
+
+    # Events of all processes since the last poll, waits up to timeout for the first one
+    # Same (event, payload) tuples as Detector.process_frame, kingdom changes are passed on to the other processes
+    def poll(self, timeout=0):
+        events = []
+        messages, self.early_messages = self.early_messages, []
+        try:
+            if not messages:
+                messages.append(self.events.get(timeout=timeout) if timeout else self.events.get_nowait())
+            while True:
+                messages.append(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        for role, event, payload in messages:
+            if event == "ready":
+                continue
+            elif event == "kingdom":
+                self.current_kingdom = payload
+                self.broadcast("set_current_kingdom", payload, skip_role=role)
+                events.append((event, payload))
+            else:
+                events.append((event, None if payload is None else [self.moons[ref] for ref in payload]))
+        return events
+
+    # Detector processes that are still running
+    def alive(self):
+        return [role for role, process in self.processes.items() if process.is_alive()]
+
+    # Stop every detector process and free the shared frames
+    def close(self):
+        self.ring.close()
+        self.broadcast("stop")
+        for process in self.processes.values():
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self.ring.release()
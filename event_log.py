@@ -0,0 +1,195 @@
+"""
+Structured event log, so the detection loop never waits on a terminal or a disk:
+    Every record is an event name with a few fields, like the OCR text of a read, the scores of a match or a timing
+    Logging a record appends a tuple to an in-memory queue, below the current level it returns right away
+    A background thread writes the queue to a rotating JSON-lines file every LOG_FLUSH_INTERVAL seconds
+    Records at or above the echo level are also printed by that thread, in the format the console used to show
+The level can be changed while running, the GUI sets it from the settings
+Only uses the standard library, so the matching core can log without pulling anything in
+"""
+
+from collections import deque
+import json
+import os
+import threading
+import time
+
+DEBUG = 10  # Near misses, text checks and timings of every check
+INFO = 20  # Reads, matches and state changes
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR, "off": OFF}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+LOG_PATH = "talkatoo-events.jsonl"
+LOG_LEVEL = INFO
+LOG_ECHO_LEVEL = INFO  # Records at or above this are printed too, OFF to keep the console quiet
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer, the oldest are dropped when it falls behind
+LOG_FLUSH_INTERVAL = 0.5  # Seconds between writes
+LOG_MAX_BYTES = 5 * 1024 * 1024  # The file is rotated when it grows past this
+LOG_BACKUPS = 3  # Rotated files kept as .1, .2, ...
+
+# How the console showed each event before there was a log, fields are filled in with format() or passed to a function
+# None keeps an event off the console, it is only meant for the file
+ECHO_FORMATS = {
+    "check": None,
+    "ocr": None,
+    "stats": None,
+    "language_set": "[STATUS] -> {setting} set to {language}",
+    "ocr_text": "{text}",
+    "near_miss": "\t--> {label} had score {score}",
+    "global_match": lambda fields: "\tFound through global search in " + ", ".join(fields["kingdoms"]),
+    "match": lambda fields: "[{}] {} (score={})  ->  {}".format(fields["prepend"], " OR ".join(name.upper() for name in fields["moons"]),
+                                                             fields["score"], fields["possible"]),
+    "no_match": "\tNo good matches  ->  {possible}",
+    "text_check": lambda fields: "{} ({}) -> ".format("Going to OCR" if fields["ocr"] else "No match", fields["black_pct"]),
+    "kingdom": "Kingdom changed to: {kingdom}",
+    "story_moon": "Got a {kind} moon!",
+    "frames_skipped": "[STATUS] -> Skipped {count} frame(s), {total} total",
+    "ocr_queue": "[STATUS] -> OCR queue depth {depth}",
+}
+
+
+# Level number of a name like "info", or of a number
+def parse_level(level):
+    if isinstance(level, str):
+        return LEVELS[level.lower()]
+    return int(level)
+
+
+# One line of console output for a record, None if it isn't shown
+def format_record(timestamp, level, event, fields):
+    template = ECHO_FORMATS.get(event, "")
+    if template is None:
+        return None
+    if template:
+        try:
+            return template(fields) if callable(template) else template.format(**fields)
+        except (KeyError, IndexError, TypeError):
+            pass
+    return "[{}] -> {} {}".format(LEVEL_NAMES.get(level, level).upper(), event,
+                                  " ".join("{}={}".format(key, value) for key, value in fields.items()))
+
+
+# Queue of records and the thread writing them out
+class EventLog:
+    # constructor
+    def __init__(self, level=LOG_LEVEL, echo_level=LOG_ECHO_LEVEL, queue_size=LOG_QUEUE_SIZE):
+        self.level = parse_level(level)
+        self.echo_level = parse_level(echo_level)
+        self.queue = deque(maxlen=queue_size)  # append and popleft are thread-safe, so logging takes no lock
+        self.dropped = 0  # Records pushed out of the full queue before the writer got to them
+        self.written = 0
+        self.path = None
+        self.file = None
+        self.thread = None
+        self.wake = threading.Event()
+        self.closed = False
+
+    # Whether records of this level are kept, for callers that build expensive fields
+    def enabled(self, level):
+        return level >= self.level
+
+    # Queue a record, fields must be JSON-serializable, anything else is written as its str()
+    # t, level and event are the keys of every record, fields shouldn't use them
+    def log(self, level, event, /, **fields):
+        if level < self.level:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append((time.time(), level, event, fields))
+
+    def debug(self, event, /, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, /, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, /, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, /, **fields):
+        self.log(ERROR, event, **fields)
+
+    # Change the level while running, by name or number, returns the level name
+    def set_level(self, level):
+        level = parse_level(level)
+        if level != self.level:
+            self.level = level
+            self.info("log_level", value=LEVEL_NAMES.get(level, level))
+        return LEVEL_NAMES.get(level, level)
+
+    # Start writing to path on a background thread, records logged before are written too
+    def start(self, path=LOG_PATH):
+        if self.thread is not None:
+            return self
+        self.path = path
+        self.thread = threading.Thread(target=self.run, name="event-log", daemon=True)
+        self.thread.start()
+        return self
+
+    # Thread body
+    def run(self):
+        while not self.closed:
+            self.wake.wait(LOG_FLUSH_INTERVAL)
+            self.wake.clear()
+            self.flush()
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # Write everything queued so far, only called by the writer thread
+    def flush(self):
+        lines = []
+        while self.queue:
+            timestamp, level, event, fields = self.queue.popleft()
+            record = {"t": round(timestamp, 4), "level": LEVEL_NAMES.get(level, level), "event": event}
+            record.update(fields)
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            if level >= self.echo_level:
+                line = format_record(timestamp, level, event, fields)
+                if line is not None:
+                    print(line)
+        if not lines or self.path is None:
+            return
+        try:
+            if self.file is None:
+                self.file = open(self.path, "a", encoding="utf8")
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+            self.written += len(lines)
+            if self.file.tell() > LOG_MAX_BYTES:
+                self.rotate()
+        except OSError as error:  # A full disk or a read-only folder shouldn't stop detection, the records are lost
+            print("[ERROR] -> Could not write the event log: {}".format(error))
+            self.path = None
+
+    # Move the file to .1, .1 to .2 and so on, the oldest is deleted
+    def rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(LOG_BACKUPS - 1, 0, -1):
+            if os.path.exists("{}.{}".format(self.path, i)):
+                os.replace("{}.{}".format(self.path, i), "{}.{}".format(self.path, i + 1))
+        if LOG_BACKUPS:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+    # Write what is left and stop the writer
+    def close(self):
+        self.closed = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(2)
+            self.thread = None
+
+    # Queue and writer counters, for logging
+    def stats(self):
+        return {"level": LEVEL_NAMES.get(self.level, self.level), "queued": len(self.queue), "written": self.written,
+                "dropped": self.dropped, "path": self.path}
+
+
+event_log = EventLog()  # Shared by every module, Talkatoo starts the writer
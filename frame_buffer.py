@@ -0,0 +1,52 @@
+import threading
+import time
+
+
+# Bounded ring of captured frames shared between the capture thread and the detection loop
+# Every frame gets a monotonically increasing sequence number and the time it was captured
+class FrameRing:
+    # constructor
+    def __init__(self, size=4):
+        self.size = size
+        self.frames = [None] * size  # (seq, timestamp, frame) tuples
+        self.seq = 0  # sequence number of the newest frame, 0 means nothing captured yet
+        self.closed = False
+        self.condition = threading.Condition()
+
+    # Store a new frame, overwriting the oldest one if the ring is full
+    def put(self, frame, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.condition:
+            self.seq += 1
+            self.frames[self.seq % self.size] = (self.seq, timestamp, frame)
+            self.condition.notify_all()
+            return self.seq
+
+    # Block until a frame newer than last_seq arrives (or timeout), never returns the same frame twice
+    # Returns (seq, timestamp, frame, dropped) or None, dropped counts the frames the consumer never saw
+    def get(self, last_seq, timeout=None, newest=True):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq or self.closed, timeout):
+                return None
+            if self.seq <= last_seq:  # Closed without anything new
+                return None
+            if newest:
+                seq = self.seq
+            else:  # Oldest frame after last_seq that is still in the ring
+                seq = max(last_seq + 1, self.seq - self.size + 1)
+            seq, timestamp, frame = self.frames[seq % self.size]
+        return seq, timestamp, frame, seq - last_seq - 1
+
+    # Newest frame without waiting, used for one-off reads like border resets
+    def latest(self):
+        with self.condition:
+            if self.seq == 0:
+                return None
+            return self.frames[self.seq % self.size]
+
+    # Wake up all waiting consumers, used on shutdown
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
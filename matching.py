@@ -0,0 +1,557 @@
+"""
+Moon matching without any of the capture, OCR or GUI dependencies:
+    Language settings, text correction and the score functions for alphabet and logogram languages
+    Candidate moons per kingdom, kind and postgame setting, prepared once as CandidateTables
+    MoonMatcher, which turns OCR text into matched moons and close calls in percent
+Only needs NumPy, so replays, benchmarks and other tools can match moons without loading torch, cv2 or eel
+check_imports.py makes sure it stays that way
+"""
+
+from collections import namedtuple
+import json
+import os
+import sys
+
+import numpy as np  # pip install numpy
+
+from event_log import event_log
+from moon_db import MOON_DB_PATH, MOON_JSON_PATH, load_languages, load_moons
+from moon_index import MoonIndex
+from ocr_cache import LRUCache
+
+
+# Each language performs best under different thresholds and values
+ASIAN_MOON_BOUNDS = (300, 525, 950, 575)
+DEFAULT_MOON_BOUNDS = (250, 535, 1100, 585)
+JAPANESE_MOON_BOUNDS = (375, 535, 900, 590)
+
+ASIAN_TALKATOO_BOUNDS = (350, 565, 1000, 615)  # Line 1 of 1
+DEFAULT_TALKATOO_BOUNDS_2 = (350, 590, 1000, 640)  # Line 2 of 2
+DEFAULT_TALKATOO_BOUNDS_3 = (350, 610, 1000, 660)  # Line 3 of 3
+TALKATOO_BOUNDS_FR = (300, 565, 900, 615)  # Line 1 of 1
+TALKATOO_BOUNDS_NL = (350, 560, 1000, 620)  # Line 2 of 3
+TALKATOO_BOUNDS_ES = (350, 565, 1000, 615)  # Line 1 of 1
+
+LANGUAGES = {
+             "english": {"Language": "en", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 12, "Score": 0,
+                         "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_2},
+             "chinese_traditional": {"Language": "ch_tra", "Text_Lower": 0.15, "Text_Upper": 0.75, "Text_Height": 20,
+                                     "Score": -2, "Moon_Bounds": ASIAN_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
+             "chinese_simplified": {"Language": "ch_sim", "Text_Lower": 0.15, "Text_Upper": 0.75, "Text_Height": 20,
+                                    "Score": -2, "Moon_Bounds": ASIAN_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
+             "japanese": {"Language": "ja", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 20, "Score": 2,
+                          "Moon_Bounds": JAPANESE_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
+             "korean": {"Language": "ko", "Text_Lower": 0.1, "Text_Upper": 0.55, "Text_Height": 20, "Score": 0,
+                        "Moon_Bounds": ASIAN_MOON_BOUNDS, "Talkatoo_Bounds": ASIAN_TALKATOO_BOUNDS},
+             "dutch": {"Language": "nl", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
+                       "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_NL},
+             "french_canada": {"Language": "fr", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
+                               "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_FR},
+             "french_france": {"Language": "fr", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
+                               "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_FR},
+             "german": {"Language": "de", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12,
+                        "Score": 2, "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_3},
+             "italian": {"Language": "it", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 12, "Score": 0,
+                         "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_2},
+             "spanish_spain": {"Language": "es", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
+                               "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": TALKATOO_BOUNDS_ES},
+             "spanish_latin_america": {"Language": "es", "Text_Lower": 0.15, "Text_Upper": 0.55, "Text_Height": 12, "Score": 2,
+                                       "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_3},
+             "russian": {"Language": "ru", "Text_Lower": 0.12, "Text_Upper": 0.55, "Text_Height": 12, "Score": 0,
+                         "Moon_Bounds": DEFAULT_MOON_BOUNDS, "Talkatoo_Bounds": DEFAULT_TALKATOO_BOUNDS_2}
+             }
+LOGOGRAM_LANGUAGES = ["chinese_traditional", "chinese_simplified", "japanese", "korean"]
+
+DEFAULT_GAME_LANGUAGE = "chinese_traditional"
+DEFAULT_GUI_LANGUAGE = "english"
+
+POSS_MOON_CERTAINTY = 0.1  # Show moon percentage if it's at least 10% possible
+BATCH_SCORING = True  # Score all candidates at once with NumPy instead of one score_func call per moon
+BATCH_MIN_CANDIDATES = 40  # Smaller tables are faster one moon at a time thanks to failing out early
+BATCH_LOGOGRAMS = False  # The ordered logogram search mostly fails out within a few characters, batching it is slower
+GLOBAL_SEARCH = "off"  # "off", "fallback" to every kingdom when the current one has no match, or "always"
+# Off until replays of real runs show how many false matches the other settings add, try them with replay.py --global-search
+GLOBAL_SHORTLIST = 12  # Moons from the n-gram index that get scored exactly in a global search
+MATCH_CACHE_SIZE = 256  # check_matches results, by corrected text and candidate table
+VERBOSE = True
+
+KINGDOM_LIST = ("Cap", "Cascade", "Sand", "Lake", "Wooded", "Lost", "Metro", "Seaside",
+                "Snow", "Luncheon", "Bowsers", "Moon", "Mushroom")  # to store class values, strict order
+MAX_STORY = {"Cap": 0, "Cascade": 2, "Sand": 4, "Lake": 1, "Wooded": 4, "Cloud": 0, "Lost": 0, "Metro": 7,
+             "Snow": 5, "Seaside": 5, "Luncheon": 5, "Ruined": 1, "Bowsers": 4, "Moon": 0, "Mushroom": 38,
+             "Dark": 1, "Darker": 1}
+MAX_MAINGAME = {"Cap": 0, "Cascade": 25, "Sand": 69, "Lake": 33, "Wooded": 54, "Cloud": 0, "Lost": 25, "Metro": 66,
+                "Snow": 37, "Seaside": 52, "Luncheon": 56, "Ruined": 5, "Bowsers": 45, "Moon": 27, "Mushroom": 0,
+                "Dark": 0, "Darker": 0}
+
+# Candidate moons with everything the matcher needs prepared, tuples so they can be shared safely
+# names are normalized for the score function, labels are the translate_to names, codes are the names for batch scoring
+CandidateTable = namedtuple("CandidateTable", ["moons", "names", "lengths", "labels", "codes"])
+CANDIDATE_KINDS = ("talkatoo", "collected", "story", "multi")
+
+
+# Replace certain known problematic characters to make better matches
+def correct_text(string, translate_from):
+    if translate_from.startswith("chinese"):  # Designed from
+        replacements = {" ": "", "!": "！", "(": "", ";": " ", "@": " ", "1": "１", "2": "２", "3": "３",
+                        "4": "４", "5": "５", "6": "６", "7": "７", "8": "８", "9": "９", "0": "０"}
+    elif translate_from == "korean":
+        replacements = {"3": "3"}
+    elif translate_from == "japanese":
+        replacements = {}
+    elif translate_from == "russian":
+        replacements = {" ": "", "<": "", ">": "", "{": "", "}": ""}
+    else:
+        replacements = {" ": ""}
+    for i in replacements:
+        string = string.replace(i, replacements[i])
+    return string
+
+
+# Moons grouped by kingdom and the hint arts grouped by the kingdom they are collected in
+# languages are the name columns loaded right away, the others are read from the compiled database when first used
+def generate_moon_dict(languages=()):
+    # Read moon translation data
+    moonlist = load_moons(internal_resource_path(MOON_JSON_PATH), internal_resource_path(MOON_DB_PATH), languages,
+                          build=not hasattr(sys, "_MEIPASS"))  # Nothing to keep in the temporary folder of a frozen build
+    # Dictionary to store all moons by kingdom
+    moons_by_kingdom = {}
+    hint_arts = {}
+    for moon in moonlist:
+        ha_kingdom = moon.get("collection_kingdom")
+        if ha_kingdom:
+            if ha_kingdom in hint_arts:
+                hint_arts[ha_kingdom].append(moon)
+            else:
+                hint_arts[ha_kingdom] = [moon]
+                
+        this_kingdom = moon["kingdom"]
+        if this_kingdom in moons_by_kingdom:
+            moons_by_kingdom[this_kingdom].append(moon)
+        else:
+            moons_by_kingdom[this_kingdom] = [moon]
+    return moons_by_kingdom, hint_arts
+
+
+def internal_resource_path(relative_path):
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+
+    return os.path.join(base_path, relative_path)
+
+
+def read_file_to_json(path, is_internal_resource=False):
+    full_path = internal_resource_path(path) if is_internal_resource else path
+    try:
+        with open(full_path, encoding="utf8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+# Replacement Levenshtein distance cost function, designed for alphabet-based languages
+# Basis is few missing characters
+def score_alphabet(proper_moon, test_moon, low_point, can_fail_out=True, proper_len=None):
+    proper_moon = proper_moon.replace(" ", "")  # No copy if the name was already normalized
+    proper_len = len(proper_moon) if proper_len is None else proper_len
+    test_len = len(test_moon)
+    len_diff = proper_len - test_len
+    best_score = -10
+    fail_out = low_point - 2 - (proper_len / 4)
+
+    if len_diff < 0:
+        longer_moon = test_moon
+        shorter_moon = proper_moon
+    else:
+        longer_moon = proper_moon
+        shorter_moon = test_moon
+
+    # Loop through, check comparison at each possible index
+    for i in range(abs(len_diff) + 1):
+        this_score = 0
+        for j, c in enumerate(shorter_moon):
+            if c == longer_moon[i+j]:
+                this_score += 1
+            else:
+                this_score -= 1
+            if this_score < fail_out and can_fail_out:
+                break
+        if this_score > best_score:
+            best_score = this_score
+    return best_score
+
+
+# Replacement Levenshtein distance cost function, good for Asian languages
+# Basis is shared characters, order is less important
+def score_logogram(proper_moon, test_moon, low_point, can_fail_out=True, proper_len=None):
+    proper_len = len(proper_moon) if proper_len is None else proper_len
+    test_len = len(test_moon)
+    len_diff = proper_len - test_len
+    if len_diff > 3 and can_fail_out:
+        return -10
+    fail_out = low_point - 2 - (proper_len / 4)
+    cost = max(len_diff/2, 0)  # Penalize missing characters 1.5x as much as the rest
+    cor = 0.5 if proper_len == test_len else 0  # Give an extra half point if the length is exact
+
+    # Ordered character search
+    trav_index = 0
+    for c in proper_moon:
+        ind = trav_index
+        found = False
+        while ind < test_len:
+            if test_moon[ind] == c:
+                found = True
+                trav_index = ind + 1
+                break
+            ind += 1
+        if found:
+            cor += 1
+        else:
+            cost += 1
+        if cor - cost <= fail_out and can_fail_out:  # if the score is bad enough then don't bother continuing
+            return -10
+    return cor - cost
+
+
+# Encode names as one array of code points padded with -1, so many names can be scored at once
+def encode_names(names):
+    lengths = np.array([len(name) for name in names], dtype=np.int32)
+    codes = np.full((len(names), max(lengths.max(initial=0), 1)), -1, dtype=np.int32)
+    for i, name in enumerate(names):
+        codes[i, :len(name)] = [ord(c) for c in name]
+    return codes, lengths
+
+
+# score_alphabet of test_moon against every encoded name at once
+# Returns one column of scores per low point, or a single column of scores without failing out if low_points is None
+def batch_score_alphabet(codes, lengths, test_moon, low_points=None):
+    test = np.array([ord(c) for c in test_moon], dtype=np.int32)
+    test_len = len(test)
+
+    # Line up the shorter string at every offset within the longer one, negative offsets shift the test text instead
+    # Arrays are indexed [step, offset, name] so the running score is a sum of contiguous rows
+    offsets = np.arange(min(0, lengths.min() - test_len), max(0, lengths.max() - test_len) + 1)
+    steps = np.arange(min(codes.shape[1], test_len))
+    name_idx = steps[:, None] + np.maximum(offsets, 0)[None, :]
+    test_idx = steps[:, None] + np.maximum(-offsets, 0)[None, :]
+    in_range = (name_idx < codes.shape[1]) & (test_idx < test_len)
+    matches = codes.T[np.minimum(name_idx, codes.shape[1] - 1)] == test[np.minimum(test_idx, test_len - 1)][:, :, None]
+    compared = steps[:, None] < np.minimum(lengths, test_len)[None, :]  # Only as long as the shorter string
+    running = (matches & in_range[:, :, None]).astype(np.int16) * 2 - 1
+    running *= compared[:, None, :]
+    lowest = running[0].copy()
+    for i in range(1, len(running)):  # Row by row is several times faster than np.cumsum on small arrays
+        np.add(running[i], running[i - 1], out=running[i])
+        np.minimum(lowest, running[i], out=lowest)
+    full = running[-1]
+    len_diff = (lengths - test_len)[None, :]
+    valid = (offsets[:, None] >= np.minimum(0, len_diff)) & (offsets[:, None] <= np.maximum(0, len_diff))
+    if low_points is None:
+        return np.maximum(np.where(valid, full, -10), -10).max(axis=0)[:, None].astype(np.int64)
+
+    # Failing out stops at the first running score below fail_out, which is then kept as the score
+    # Steps are +-1, so unless the very first step is already below it stops right below fail_out
+    # Compared times 4 to stay in integers, invalid offsets always fail out at or below -10
+    first = np.where(valid, running[0], -10)
+    lowest = np.where(valid, 4 * lowest, -1000)
+    scores = np.empty((len(lengths), len(low_points)), dtype=np.int64)
+    for col, low_point in enumerate(low_points):
+        fail_out = 4 * low_point - 8 - lengths
+        failed_at = np.where(4 * first < fail_out, first, -(-fail_out // 4) - 1)
+        scores[:, col] = np.where(lowest < fail_out, failed_at, full).max(axis=0)
+    return np.maximum(scores, -10)
+
+
+# score_logogram of test_moon against every encoded name at once
+# Returns the scores without failing out and the lowest running score of each name to decide failing out later
+def batch_score_logogram(codes, lengths, test_moon):
+    test = np.array([ord(c) for c in test_moon], dtype=np.int32)
+    test_len = len(test)
+
+    # next_pos[t, c] is the first position >= t of character c in the test text, test_len if there is none
+    chars = np.unique(test)
+    char_idx = np.minimum(np.searchsorted(chars, codes), len(chars) - 1)
+    char_idx = np.where(chars[char_idx] == codes, char_idx, len(chars))  # Characters not in the text get an empty column
+    at_pos = np.where(test[:, None] == chars[None, :], np.arange(test_len)[:, None], test_len)
+    next_pos = np.full((test_len + 1, len(chars) + 1), test_len)
+    next_pos[:test_len, :-1] = np.minimum.accumulate(at_pos[::-1], axis=0)[::-1]
+
+    next_index = (next_pos + 1).ravel()  # Flat lookup, past test_len means the character was not found
+    stride = len(chars) + 1
+
+    # After i characters the running score is the fixed length correction plus 2 * found - i
+    len_diff = lengths - test_len
+    base = np.where(len_diff == 0, 0.5, 0) - np.maximum(len_diff / 2, 0)  # Extra half point if the length is exact, penalize missing characters 1.5x
+    found = np.zeros(len(lengths), dtype=np.int64)
+    lowest = np.full(len(lengths), np.iinfo(np.int64).max)
+    trav_index = np.zeros(len(lengths), dtype=np.int64)
+
+    # Ordered character search, one character of every name at a time
+    char_idx = np.ascontiguousarray(char_idx.T)
+    for i in range(codes.shape[1]):
+        pos = next_index[trav_index * stride + char_idx[i]]
+        hit = pos <= test_len
+        trav_index = np.where(hit, pos, trav_index)
+        found += hit
+        np.minimum(lowest, np.where(i < lengths, 2 * found - (i + 1), lowest), out=lowest)
+    return base + 2 * found - lengths, base + lowest
+
+
+# Moon name the way score_func compares it, so it can be prepared ahead of time
+def normalize_moon_name(proper_moon, score_func):
+    return proper_moon.replace(" ", "") if score_func is score_alphabet else proper_moon
+
+
+# Get normal moons
+def normal_moons_to_check(moons_by_kingdom, hint_arts, kingdom, is_postgame, is_talkatoo):
+    # Note that MAX dicts are 1-indexed as SMO moons are 1-indexed
+    if is_postgame:
+        if kingdom == "Mushroom":
+            if is_talkatoo:
+                to_check = moons_by_kingdom["Mushroom"][:32] + moons_by_kingdom["Mushroom"][38:43]
+            else:
+                to_check = moons_by_kingdom["Mushroom"][:32] + moons_by_kingdom["Mushroom"][38:]
+        else:
+            to_check = moons_by_kingdom[kingdom][MAX_STORY[kingdom]:]
+        if not is_talkatoo:  # add cloud, ruined and dark moons for moon get text only
+            to_check.extend(moons_by_kingdom["Cloud"])
+            to_check.extend(moons_by_kingdom["Ruined"])
+            to_check.extend(moons_by_kingdom["Dark"][1:14])  # Exclude multi moon, hint arts already included
+    else:
+        to_check = moons_by_kingdom[kingdom][MAX_STORY[kingdom]: MAX_MAINGAME[kingdom]]
+    to_check.extend(hint_arts[kingdom])
+    return to_check
+
+
+# Get story moons
+def story_moons_to_check(moons_by_kingdom, kingdom, is_postgame, multi):
+    start_index = 33 if kingdom == "Mushroom" else 1  # Moon indices are 1-indexed
+    if multi:
+        moons_to_check = [moons_by_kingdom[kingdom][i] for i in range(start_index-1, MAX_STORY[kingdom]) if moons_by_kingdom[kingdom][i].get("is_multi")]
+        moons_to_check.append(moons_by_kingdom["Ruined"][0])
+        if is_postgame:
+            moons_to_check.append(moons_by_kingdom["Dark"][0])
+            moons_to_check.append(moons_by_kingdom["Darker"][0])
+    else:
+        moons_to_check = [moons_by_kingdom[kingdom][i] for i in range(start_index-1, MAX_STORY[kingdom]) if moons_by_kingdom[kingdom][i].get("is_story")]
+    return moons_to_check
+
+
+# Softmax of a few scores, float32 like the torch.softmax it replaces
+def softmax(scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    exp = np.exp(scores - scores.max(initial=-np.inf))
+    return exp / exp.sum()
+
+
+# Matches OCR text against the candidate moons of the current kingdom and settings
+class MoonMatcher:
+    # constructor
+    def __init__(self, moons_by_kingdom, hint_arts, translate_from=DEFAULT_GAME_LANGUAGE, translate_to=DEFAULT_GUI_LANGUAGE,
+                 is_postgame=False, global_search=GLOBAL_SEARCH):
+        self.moons_by_kingdom = moons_by_kingdom
+        self.hint_arts = hint_arts
+        self.is_postgame = is_postgame
+        self.global_search = global_search
+        self.current_kingdom = "Cap"  # Start in first kingdom (Does not matter what it's initialized to)
+        self.translate_from = None
+        self.translate_to = translate_to
+        self.candidate_tables = {}  # (kingdom, is_postgame, kind) -> CandidateTable
+        self.moon_index = None  # n-gram index over every moon for global searches
+        self.global_allowed = {}  # (is_postgame, kind) -> moons of the index that any kingdom would check
+        self.match_cache = LRUCache(MATCH_CACHE_SIZE)
+        self.set_translate_from(translate_from)
+
+    # Whether to print matches and close calls, subclasses follow their own module's VERBOSE
+    @property
+    def verbose(self):
+        return VERBOSE
+
+    # Set the current kingdom, returns False for unknown kingdoms
+    def set_current_kingdom(self, kingdom_name):
+        if kingdom_name not in KINGDOM_LIST:
+            return False
+        self.current_kingdom = kingdom_name
+        return True
+
+    # reset input language
+    def set_translate_from(self, t_from):
+        if self.translate_from != t_from:
+            self.translate_from = t_from
+            self.language_settings = LANGUAGES[t_from]
+            self.score_func = score_logogram if t_from in LOGOGRAM_LANGUAGES else score_alphabet
+            self.build_candidate_tables()
+            if self.verbose:
+                event_log.info("language_set", setting="translate_from", language=t_from)
+
+    # reset output language
+    def set_translate_to(self, t_to):
+        if self.translate_to != t_to:
+            self.translate_to = t_to
+            self.build_candidate_tables()
+            if self.verbose:
+                event_log.info("language_set", setting="translate_to", language=t_to)
+
+    # Prepare the candidates of every kingdom for both postgame settings, only needed when the languages change
+    def build_candidate_tables(self):
+        self.candidate_tables = {}
+        self.match_cache.clear()
+        for kingdom in KINGDOM_LIST:
+            for is_postgame in (False, True):
+                for kind in CANDIDATE_KINDS:
+                    self.candidate_tables[(kingdom, is_postgame, kind)] = self.make_table(self.select_moons(kingdom, is_postgame, kind))
+        self.build_moon_index()
+
+    # CandidateTable for a list of moons
+    def make_table(self, moons):
+        names = tuple(normalize_moon_name(m[self.translate_from], self.score_func) for m in moons)
+        codes, lengths = encode_names(names)
+        codes.flags.writeable = lengths.flags.writeable = False
+        return CandidateTable(tuple(moons), names, lengths, tuple(m[self.translate_to] for m in moons), codes)
+
+    # Index every moon of the game, a global search may only return moons some kingdom would check with the same settings
+    def build_moon_index(self):
+        moons = [moon for kingdom_moons in self.moons_by_kingdom.values() for moon in kingdom_moons]
+        names = [normalize_moon_name(correct_text(m[self.translate_from], self.translate_from), self.score_func) for m in moons]
+        self.moon_index = MoonIndex(moons, names, 2 if self.score_func is score_logogram else 3)
+        positions = {(moon["kingdom"], moon["id"]): i for i, moon in enumerate(moons)}
+        self.global_allowed = {}
+        for (kingdom, is_postgame, kind), table in self.candidate_tables.items():
+            allowed = self.global_allowed.setdefault((is_postgame, kind), np.zeros(len(moons), dtype=bool))
+            allowed[[positions[(moon["kingdom"], moon["id"])] for moon in table.moons]] = True
+
+    # Candidates from every kingdom whose names are closest to poss_moon
+    def global_candidates(self, poss_moon, kind):
+        allowed = self.global_allowed[(bool(self.is_postgame), kind)]
+        return self.make_table([self.moon_index.moons[i] for i in self.moon_index.shortlist(poss_moon, GLOBAL_SHORTLIST, allowed)])
+
+    # Candidates for the current kingdom and settings
+    def candidates(self, kind):
+        return self.candidate_tables[self.table_key(kind)]
+
+    # Key of the candidate table for the current kingdom and settings, kingdom is "global" for global searches
+    def table_key(self, kind, kingdom=None):
+        return kingdom or self.current_kingdom, bool(self.is_postgame), kind
+
+    # Candidate moons of one kind, kind is one of CANDIDATE_KINDS
+    def select_moons(self, kingdom, is_postgame, kind):
+        if kind in ("story", "multi"):
+            return story_moons_to_check(self.moons_by_kingdom, kingdom, is_postgame, kind == "multi")
+        return normal_moons_to_check(self.moons_by_kingdom, self.hint_arts, kingdom, is_postgame, kind == "talkatoo")
+
+    # Returns score_at(i, low_point), the score_func result for candidate i of the table
+    # With BATCH_SCORING every candidate is scored up front, low_points are the values low_point can take
+    def scorer(self, poss_moon, table, low_points, can_fail_out=True):
+        batch = BATCH_SCORING and (BATCH_LOGOGRAMS or self.score_func is score_alphabet)
+        if not batch or len(table.moons) < BATCH_MIN_CANDIDATES:
+            return lambda i, low_point: self.score_func(table.names[i], poss_moon, low_point, can_fail_out, table.lengths[i])
+        if self.score_func is score_alphabet:
+            scores = batch_score_alphabet(table.codes, table.lengths, poss_moon, low_points if can_fail_out else None)
+            if not can_fail_out:
+                return lambda i, low_point: int(scores[i, 0])
+            columns = {low_point: col for col, low_point in enumerate(low_points)}
+            return lambda i, low_point: int(scores[i, columns[low_point]])
+        scores, lowest = batch_score_logogram(table.codes, table.lengths, poss_moon)
+        if not can_fail_out:
+            return lambda i, low_point: float(scores[i])
+        test_len = len(poss_moon)
+
+        # Same early exits as score_logogram, they depend on the low_point at the time the moon is checked
+        def score_at(i, low_point):
+            proper_len = table.lengths[i]
+            if proper_len - test_len > 3 or lowest[i] <= low_point - 2 - (proper_len / 4):
+                return -10
+            return float(scores[i])
+        return score_at
+
+    # Checks recognized text against moons fromm the current kingdom
+    def check_matches(self, poss_moon, score_threshold, table):
+        max_corr = score_threshold  # so low it will never matter
+        max_low = score_threshold + 4  # Used for shortcutting when scores are blown up
+        ans = []  # best matches
+        poss_matches = {}  # Loose matches
+        score_at = self.scorer(poss_moon, table, range(score_threshold, max_low + 1))
+        for i, (m, label) in enumerate(zip(table.moons, table.labels)):  # Loop through moons in the current kingdom
+            corr = score_at(i, max_corr if max_corr < max_low else max_low)  # Determine score for moon being compared
+            if corr >= score_threshold:
+                poss_matches[label] = corr
+                if corr > max_corr:  # Best match so far
+                    max_corr = corr
+                    ans = [m]
+                elif corr == max_corr:  # Equally good as best match
+                    ans.append(m)
+            elif corr >= score_threshold - 1 and self.verbose:
+                event_log.debug("near_miss", label=label, score=corr, threshold=score_threshold)
+        poss_matches = self.score_to_pct(poss_matches)
+        return max_corr, ans, poss_matches
+
+    # Checks recognized text against story moons from current kingdom
+    def check_matches_story_multi(self, poss_moon, score_threshold, table):
+        max_corr = -100  # so low it will never matter
+        ans = []  # best matches
+        poss_matches = {}  # Loose matches
+        score_at = self.scorer(poss_moon, table, [score_threshold], can_fail_out=False)
+        for i, (m, label) in enumerate(zip(table.moons, table.labels)):  # Loop through moons in the current kingdom
+            corr = score_at(i, score_threshold)
+            if corr > max_corr:
+                max_corr = corr
+                ans = [m]
+            elif corr == max_corr:
+                ans.append(m)
+            if corr >= score_threshold - 6:
+                poss_matches[label] = corr
+        poss_matches = self.score_to_pct(poss_matches, force_match=True)
+        return max_corr if max_corr > score_threshold else score_threshold, ans, poss_matches
+
+    # check(poss_moon, score_threshold, table) through the match cache, get_table is only called on a miss
+    def cached_check(self, check, poss_moon, score_threshold, table_key, get_table):
+        return self.match_cache.get_or_compute((poss_moon, score_threshold, table_key),
+                                               lambda: check(poss_moon, score_threshold, get_table()))
+
+    # Clean and check the output of readtext
+    def match_ocr_text(self, ocr_text, prepend="Unlocked", story=False, multi=False):
+        ocr_text = correct_text("".join([ocr_text[i][1] for i in range(len(ocr_text))]), self.translate_from)
+        if len(ocr_text) < 2:
+            return None
+        if self.verbose:
+            event_log.info("ocr_text", text=ocr_text, prepend=prepend, story=story, multi=multi)
+
+        score_thresh = self.language_settings["Score"]
+        if story or multi:
+            kind = "story" if story else "multi"
+            max_corr, ans, possible = self.cached_check(self.check_matches_story_multi, ocr_text, score_thresh,
+                                                        self.table_key(kind), lambda: self.candidates(kind))
+        else:
+            kind = "talkatoo" if prepend == "Unlocked" else "collected"
+            global_check = lambda: self.cached_check(self.check_matches, ocr_text, score_thresh, self.table_key(kind, "global"),
+                                                     lambda: self.global_candidates(ocr_text, kind))
+            if self.global_search == "always":
+                max_corr, ans, possible = global_check()
+            else:
+                max_corr, ans, possible = self.cached_check(self.check_matches, ocr_text, score_thresh,
+                                                            self.table_key(kind), lambda: self.candidates(kind))
+                if not ans and self.global_search == "fallback":  # Kingdom might be wrong, look everywhere
+                    max_corr, ans, possible = global_check()
+                    if self.verbose and ans:
+                        event_log.info("global_match", kingdoms=sorted({moon["kingdom"] for moon in ans}))
+
+        if max_corr >= score_thresh:  # If any reasonable matches, guarantee match if story moon
+            if self.verbose:
+                event_log.info("match", prepend=prepend, text=ocr_text, score=max_corr, threshold=score_thresh,
+                               moons=[moon["english"] for moon in ans], refs=[[moon["kingdom"], moon["id"]] for moon in ans],
+                               possible=possible)
+            return ans
+        if self.verbose:
+            event_log.info("no_match", prepend=prepend, text=ocr_text, score=max_corr, threshold=score_thresh, possible=possible)
+        return None
+
+    # Translate scores to percent certainty
+    def score_to_pct(self, poss_moon_dict, force_match=False):
+        if not force_match:
+            poss_moon_dict["Uncertain"] = self.language_settings["Score"]
+        keys = list(poss_moon_dict.keys())
+        percents = softmax([float(poss_moon_dict[key]) for key in poss_moon_dict])
+        return {keys[i]: round(float(percents[i])*100, 2) for i in range(len(keys)) if percents[i] > POSS_MOON_CERTAINTY}
+
@@ -0,0 +1,182 @@
+"""
+Compiled moon database, built from moon-list.json:
+    A table with the id, kingdom, hint art kingdom and story/multi flags of every moon
+    One column of names per language, stored as offsets into a block of UTF-8 text
+The file is memory-mapped and a language column is only decoded the first time a name in it is used
+So a run normally holds the names of its game and GUI language instead of all 13
+The digest of the JSON it was built from is stored, a stale or broken file is ignored and the JSON is used
+Usage: python moon_db.py [moon-list.json] [moon-list.bin] to build it ahead of time
+"""
+
+import hashlib
+import json
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+MOON_JSON_PATH = "moon-list.json"
+MOON_DB_PATH = "moon-list.bin"
+MOON_DB_MAGIC = b"TKMOONDB"
+MOON_DB_VERSION = 1
+HEADER_FORMAT = "<8sI"  # magic, length of the JSON header that follows
+ALIGNMENT = 8  # Arrays start on multiples of this, so they can be viewed in place
+
+FLAG_STORY = 1
+FLAG_MULTI = 2
+NO_KINGDOM = 255  # collection kingdom of moons that aren't hint arts
+TABLE_DTYPE = np.dtype([("id", "<u2"), ("kingdom", "u1"), ("collection_kingdom", "u1"), ("flags", "u1")])
+FIXED_KEYS = ("id", "kingdom", "collection_kingdom", "is_story", "is_multi")  # Everything else is a language
+
+
+# Digest of the JSON the database is built from, to tell whether it is stale
+def source_digest(json_path):
+    with open(json_path, "rb") as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+# Compile the moon list at json_path into db_path, returns the number of moons
+def build_moon_db(json_path=MOON_JSON_PATH, db_path=MOON_DB_PATH):
+    with open(json_path, encoding="utf8") as file:
+        moonlist = json.load(file)
+    kingdoms = list(dict.fromkeys([moon["kingdom"] for moon in moonlist] +
+                                  [moon["collection_kingdom"] for moon in moonlist if moon.get("collection_kingdom")]))
+    languages = list(dict.fromkeys(key for moon in moonlist for key in moon if key not in FIXED_KEYS))
+
+    table = np.zeros(len(moonlist), dtype=TABLE_DTYPE)
+    for i, moon in enumerate(moonlist):
+        collection = moon.get("collection_kingdom")
+        table[i] = (moon["id"], kingdoms.index(moon["kingdom"]), kingdoms.index(collection) if collection else NO_KINGDOM,
+                    (FLAG_STORY if moon.get("is_story") else 0) | (FLAG_MULTI if moon.get("is_multi") else 0))
+
+    blocks = [table.tobytes()]
+    columns = {}
+    position = table.nbytes
+    for language in languages:
+        encoded = [moon[language].encode("utf8") for moon in moonlist]
+        offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+        np.cumsum([len(name) for name in encoded], out=offsets[1:])
+        blocks.append(b"\0" * (-position % ALIGNMENT))
+        position += len(blocks[-1])
+        columns[language] = (position, position + offsets.nbytes)
+        blocks.extend((offsets.tobytes(), b"".join(encoded)))
+        position += offsets.nbytes + int(offsets[-1])
+
+    header = json.dumps({"version": MOON_DB_VERSION, "source": source_digest(json_path), "count": len(moonlist),
+                         "kingdoms": kingdoms, "columns": columns}).encode("utf8")
+    header += b" " * (-(struct.calcsize(HEADER_FORMAT) + len(header)) % ALIGNMENT)  # Table starts aligned
+    with open(db_path, "wb") as file:
+        file.write(struct.pack(HEADER_FORMAT, MOON_DB_MAGIC, len(header)) + header + b"".join(blocks))
+    return len(moonlist)
+
+
+# Read-only view of a compiled moon database
+class MoonDatabase:
+    # constructor, raises ValueError if the file isn't a database of this version or was built from another json_path
+    def __init__(self, db_path=MOON_DB_PATH, json_path=None):
+        with open(db_path, "rb") as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = struct.unpack_from(HEADER_FORMAT, self.buffer)
+        if magic != MOON_DB_MAGIC:
+            raise ValueError("{} is not a moon database".format(db_path))
+        start = struct.calcsize(HEADER_FORMAT)
+        header = json.loads(self.buffer[start:start + header_len].decode("utf8"))
+        if header["version"] != MOON_DB_VERSION:
+            raise ValueError("{} has version {}, expected {}".format(db_path, header["version"], MOON_DB_VERSION))
+        if json_path is not None and header["source"] != source_digest(json_path):
+            raise ValueError("{} is older than {}".format(db_path, json_path))
+        self.count = header["count"]
+        self.kingdoms = header["kingdoms"]
+        self.data_start = start + header_len
+        self.column_positions = header["columns"]  # language -> (offsets position, text position) after the header
+        self.table = np.frombuffer(self.buffer, dtype=TABLE_DTYPE, count=self.count, offset=self.data_start)
+        self.columns = {}  # language -> decoded names, filled on first use
+
+    @property
+    def languages(self):
+        return list(self.column_positions)
+
+    # Names of every moon in a language, decoded once
+    def column(self, language):
+        names = self.columns.get(language)
+        if names is None:
+            offsets_at, text_at = (self.data_start + position for position in self.column_positions[language])
+            offsets = np.frombuffer(self.buffer, dtype="<u4", count=self.count + 1, offset=offsets_at).tolist()
+            text = self.buffer[text_at:text_at + offsets[-1]]
+            names = self.columns[language] = [text[offsets[i]:offsets[i + 1]].decode("utf8") for i in range(self.count)]
+        return names
+
+    # Moon dicts like the ones in moon-list.json, with only the names of the given languages filled in
+    # Names of other languages are read from the database when they are first looked up
+    def moons(self, languages=()):
+        moons = []
+        for i, (moon_id, kingdom, collection, flags) in enumerate(self.table.tolist()):
+            moon = MoonRecord(self, i)
+            moon["id"] = moon_id
+            moon["kingdom"] = self.kingdoms[kingdom]
+            if collection != NO_KINGDOM:
+                moon["collection_kingdom"] = self.kingdoms[collection]
+            if flags & FLAG_STORY:
+                moon["is_story"] = True
+            if flags & FLAG_MULTI:
+                moon["is_multi"] = True
+            moons.append(moon)
+        load_languages(moons, languages)
+        return moons
+
+
+# Moon dict that fills in the name of a language from the database on first lookup
+# get() and "in" only see the names loaded so far, like the GUI does when it is sent
+class MoonRecord(dict):
+    __slots__ = ("database", "index")
+
+    # constructor
+    def __init__(self, database, index):
+        super().__init__()
+        self.database = database
+        self.index = index
+
+    def __missing__(self, key):
+        if key not in self.database.column_positions:
+            raise KeyError(key)
+        value = self[key] = self.database.column(key)[self.index]
+        return value
+
+    # Plain dict with the same contents, for pickling
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+# Make sure the names of these languages are filled in, so they are sent along with the moons
+def load_languages(moons, languages):
+    for language in languages:
+        for moon in moons:
+            moon[language]
+
+
+# Moon list from db_path if it is up to date with json_path, else from json_path
+# The JSON is compiled into db_path for the next start when build is set, a read-only location is fine
+def load_moons(json_path=MOON_JSON_PATH, db_path=MOON_DB_PATH, languages=(), build=True):
+    try:
+        return MoonDatabase(db_path, json_path).moons(languages)
+    except FileNotFoundError as error:
+        if error.filename == json_path:  # Shipped without the JSON, the database is all there is
+            return MoonDatabase(db_path).moons(languages)
+    except (OSError, ValueError, KeyError, struct.error):  # Missing, stale or broken, the JSON is the source of truth
+        pass
+    with open(json_path, encoding="utf8") as file:
+        moonlist = json.load(file)
+    if build:
+        try:
+            build_moon_db(json_path, db_path)
+        except OSError:
+            pass
+    return moonlist
+
+
+if __name__ == "__main__":
+    json_path = sys.argv[1] if len(sys.argv) > 1 else MOON_JSON_PATH
+    db_path = sys.argv[2] if len(sys.argv) > 2 else MOON_DB_PATH
+    count = build_moon_db(json_path, db_path)
+    print("[STATUS] -> Compiled {} moons from {} into {}".format(count, json_path, db_path))
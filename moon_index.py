@@ -0,0 +1,49 @@
+"""
+Character n-gram index over every moon of the game:
+    Every moon name is split into overlapping n-grams once per language
+    OCR text is looked up through the posting lists, moons sharing the most n-grams come first
+    Only that shortlist then needs the exact (and slow) score function
+"""
+
+import numpy as np
+
+
+# Set of overlapping n-grams of a string, the whole string if it is shorter than n
+def ngrams(text, n):
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i+n] for i in range(len(text) - n + 1)}
+
+
+# Inverted index from n-gram to the moons whose name contains it
+class MoonIndex:
+    # constructor
+    def __init__(self, moons, names, n=3):
+        self.moons = tuple(moons)
+        self.n = n
+        postings = {}
+        gram_counts = []
+        for i, name in enumerate(names):
+            grams = ngrams(name, n)
+            gram_counts.append(len(grams))
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.gram_counts = np.array(gram_counts)
+
+    # Indices of the (up to) k moons most similar to text, best first
+    # allowed is an optional boolean array, moons where it is False are never returned
+    def shortlist(self, text, k, allowed=None):
+        grams = ngrams(text, self.n)
+        hits = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.moons))
+        similarity = 2 * shared / (self.gram_counts + len(grams))  # Dice coefficient, long names don't win by size alone
+        if allowed is not None:
+            similarity = np.where(allowed, similarity, 0)
+        k = min(k, int(np.count_nonzero(similarity)))
+        if k == 0:
+            return []
+        top = np.argpartition(-similarity, k - 1)[:k]
+        return top[np.argsort(-similarity[top], kind="stable")].tolist()
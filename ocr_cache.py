@@ -0,0 +1,78 @@
+"""
+Caches for the expensive parts of matching moon text:
+    OCR results, keyed by a perceptual hash of the black and white crop that was read
+    Match results, keyed by the corrected text and the candidate table it was checked against
+Both are bounded LRU caches that count their hits and misses
+"""
+
+from collections import OrderedDict
+import hashlib
+
+import numpy as np
+
+HASH_GRID = (10, 130)  # rows, columns of blocks, about 5x5 pixels for the text boxes
+HASH_LEVELS = 4  # Ink coverage of a block is rounded to quarters
+
+
+# Perceptual hash of a black and white image, crops that only differ by a few noisy pixels get the same hash
+# cv2 is imported here so the caches can be used without OpenCV, see matching.py
+def image_hash(img_arr):
+    import cv2  # pip install opencv-python
+    ink = (img_arr[:, :, 0] == 0).astype(np.float32) if img_arr.ndim == 3 else (img_arr == 0).astype(np.float32)
+    blocks = cv2.resize(ink, (HASH_GRID[1], HASH_GRID[0]), interpolation=cv2.INTER_AREA)
+    levels = np.rint(blocks * HASH_LEVELS).astype(np.uint8)
+    return img_arr.shape[:2], hashlib.blake2b(levels.tobytes(), digest_size=16).digest()
+
+
+# Bounded mapping that forgets the least recently used entry first
+class LRUCache:
+    # constructor
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Cached value for key or default, counts as a hit or miss
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    # Store value for key, evicting the oldest entries if the cache is full
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # Cached value for key, computed with compute() and stored on a miss
+    def get_or_compute(self, key, compute):
+        if key in self.entries:
+            return self.get(key)
+        self.misses += 1
+        value = compute()
+        self.put(key, value)
+        return value
+
+    # Forget every entry, counters are kept
+    def clear(self):
+        self.entries.clear()
+
+    # Counters for logging and benchmarks
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Whether key is cached, doesn't count as a lookup or make the entry recent
+    def __contains__(self, key):
+        return key in self.entries
@@ -0,0 +1,85 @@
+"""
+Background OCR so the frame loop never waits on easyocr:
+    Reads are submitted with a key, identical crops already waiting or being read are not queued again
+    The queue is bounded, when it is full the oldest waiting read is dropped since newer text matters more
+    Finished reads are collected by the frame loop with poll()
+"""
+
+from collections import deque
+import sys
+import threading
+
+
+# One thread working through OCR jobs, func(*args) does the actual read
+class OcrWorker:
+    # constructor
+    def __init__(self, max_pending=4):
+        self.max_pending = max_pending
+        self.pending = deque()  # (key, func, args, context) waiting to be read
+        self.in_flight = set()  # keys of pending and running jobs
+        self.results = deque()  # (key, context, result) of finished jobs
+        self.dropped = 0  # jobs pushed out of a full queue
+        self.duplicates = 0  # jobs skipped because the same key was already in flight
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="ocr-worker", daemon=True)
+        self.thread.start()
+
+    # Queue func(*args), returns False if a job with the same key is already waiting or being read
+    def submit(self, key, func, args=(), context=None):
+        with self.condition:
+            if key in self.in_flight:
+                self.duplicates += 1
+                return False
+            if len(self.pending) >= self.max_pending:
+                old_key = self.pending.popleft()[0]
+                self.in_flight.discard(old_key)
+                self.dropped += 1
+            self.pending.append((key, func, args, context))
+            self.in_flight.add(key)
+            self.condition.notify()
+            return True
+
+    # Worker thread, runs until close()
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if self.closed:
+                    return
+                key, func, args, context = self.pending.popleft()
+            try:
+                result = func(*args)
+            except Exception as error:  # Keep the worker alive, the read is just lost
+                print("[ERROR] -> OCR failed: {}".format(error), file=sys.stderr)
+                with self.condition:
+                    self.in_flight.discard(key)
+                continue
+            with self.condition:
+                self.results.append((key, context, result))
+                self.in_flight.discard(key)
+
+    # Finished jobs since the last poll as (key, context, result), never blocks
+    def poll(self):
+        with self.condition:
+            results = list(self.results)
+            self.results.clear()
+        return results
+
+    # Jobs waiting or being read
+    def depth(self):
+        with self.condition:
+            return len(self.in_flight)
+
+    # Counters for logging
+    def stats(self):
+        with self.condition:
+            return {"depth": len(self.in_flight), "pending": len(self.pending), "dropped": self.dropped, "duplicates": self.duplicates}
+
+    # Stop the worker thread, the job being read is finished first
+    def close(self, timeout=None):
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify_all()
+        self.thread.join(timeout)
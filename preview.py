@@ -0,0 +1,174 @@
+"""
+Live preview of the capture for the GUI, served from memory:
+    The newest frame is cropped to the borders, scaled to 1280x720 and the checked boxes are drawn on it
+    The boxes are turned into pixel indices and colours once per language, drawing them is one array assignment
+    Frames are JPEG-encoded on a background thread at a low frame rate, only while the GUI is looking at the preview
+The web server hands out the newest JPEG, as single images or as an MJPEG stream
+"""
+
+import threading
+import time
+
+import cv2  # pip install opencv-python
+import numpy as np
+from PIL import Image  # pip install pillow
+
+PREVIEW_FPS = 5  # Frames per second encoded while the preview is watched
+PREVIEW_QUALITY = 80  # JPEG quality
+PREVIEW_SIZE = (1280, 720)  # width, height the boxes are drawn at, same as the images the detector checks
+PREVIEW_IDLE = 2  # Seconds after the last request before encoding stops
+PREVIEW_BOUNDARY = "preview-frame"
+
+# BGR colours of the boxes drawn on the preview
+KINGDOM_BOX_COLOR = (0, 165, 255)  # Orange
+MOON_BOX_COLOR = (0, 0, 255)  # Red
+TALKATOO_BOX_COLOR = (0, 165, 255)  # Orange
+STORY_TEXT_COLOR = (0, 255, 0)  # Green
+STORY_TEXT_MARGIN = 50  # The tilted story text box is only drawn this far from the edges, like the rotated image it came from
+
+
+# Outline of a (left, top, right, bottom) box as a boolean mask of the whole image
+def box_outline(box, size=PREVIEW_SIZE):
+    mask = np.zeros((size[1], size[0]), dtype=bool)
+    left, top, right, bottom = box
+    mask[top, left:right] = mask[bottom - 1, left:right] = True
+    mask[top:bottom, left] = mask[top:bottom, right - 1] = True
+    return mask
+
+
+# Outline of a box that is tilted by angle degrees around the image center, like text read from a rotated image
+def tilted_outline(box, angle, size=PREVIEW_SIZE):
+    rotated = np.array(Image.fromarray(box_outline(box, size).astype(np.uint8) * 255).rotate(-angle)) > 0
+    inner = np.zeros_like(rotated)
+    inner[STORY_TEXT_MARGIN:-STORY_TEXT_MARGIN, STORY_TEXT_MARGIN:-STORY_TEXT_MARGIN] = True
+    return rotated & inner
+
+
+# Flat pixel indices and BGR colours of every box outline, later outlines are drawn over earlier ones
+class PreviewOverlay:
+    # constructor, outlines are (mask, colour) pairs
+    def __init__(self, outlines):
+        labels = np.zeros(outlines[0][0].shape, dtype=np.uint8)
+        for i, (mask, _) in enumerate(outlines, 1):
+            labels[mask] = i
+        self.pixels = np.flatnonzero(labels)
+        palette = np.array([(0, 0, 0)] + [color for _, color in outlines], dtype=np.uint8)
+        self.colors = palette[labels.ravel()[self.pixels]]
+
+    # Draw the outlines into a BGR image of the overlay's size, in place
+    def draw(self, image):
+        image.reshape(-1, 3)[self.pixels] = self.colors
+        return image
+
+
+# Overlay of the boxes the detector checks with these language settings
+def build_overlay(language_settings, kingdom_box, story_text_box, story_text_angle, size=PREVIEW_SIZE):
+    return PreviewOverlay([(tilted_outline(story_text_box, story_text_angle, size), STORY_TEXT_COLOR),
+                           (box_outline(kingdom_box, size), KINGDOM_BOX_COLOR),
+                           (box_outline(language_settings["Moon_Bounds"], size), MOON_BOX_COLOR),
+                           (box_outline(language_settings["Talkatoo_Bounds"], size), TALKATOO_BOX_COLOR)])
+
+
+# Encodes previews of the newest frame while someone is watching
+class PreviewStream:
+    # constructor, source() returns (BGR frame, borders, language settings) or None when there is nothing to show
+    # overlay_factory(language_settings) builds the overlay for a language, it is only called when the boxes change
+    def __init__(self, source, overlay_factory, fps=PREVIEW_FPS, quality=PREVIEW_QUALITY, size=PREVIEW_SIZE):
+        self.source = source
+        self.overlay_factory = overlay_factory
+        self.fps = fps
+        self.quality = quality
+        self.size = size
+        self.overlay = None
+        self.overlay_key = None  # Boxes the overlay was built for
+        self.jpeg = None  # Newest encoded preview
+        self.frame_id = 0  # Counts encoded previews, so streams only send new ones
+        self.watched_until = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.encoded = 0
+        self.encode_time = 0  # Seconds spent encoding, for logging
+        self.thread = None
+
+    # Encode on a background thread until close()
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="preview", daemon=True)
+        self.thread.start()
+        return self
+
+    # Thread body, sleeps while nobody is watching
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and time.monotonic() > self.watched_until:
+                    self.condition.wait()
+                if self.closed:
+                    return
+            start = time.perf_counter()
+            source = self.source()
+            if source is not None:
+                jpeg = self.render(*source)
+                with self.condition:
+                    self.jpeg = jpeg
+                    self.frame_id += 1
+                    self.encoded += 1
+                    self.encode_time += time.perf_counter() - start
+                    self.condition.notify_all()
+            time.sleep(max(0.0, 1 / self.fps - (time.perf_counter() - start)))
+
+    # JPEG of a frame cropped to borders with the boxes of the language drawn on it
+    def render(self, frame, borders, language_settings):
+        key = (tuple(language_settings["Moon_Bounds"]), tuple(language_settings["Talkatoo_Bounds"]))
+        if key != self.overlay_key:
+            self.overlay = self.overlay_factory(language_settings)
+            self.overlay_key = key
+        image = cv2.resize(frame[borders[1]:borders[3], borders[0]:borders[2]], self.size, interpolation=cv2.INTER_AREA)
+        self.overlay.draw(image)
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+    # Keep encoding for the next PREVIEW_IDLE seconds
+    def watch(self):
+        with self.condition:
+            self.watched_until = time.monotonic() + PREVIEW_IDLE
+            self.condition.notify_all()
+
+    # Newest preview and its id, without waiting
+    def latest(self):
+        self.watch()
+        with self.condition:
+            return self.jpeg, self.frame_id
+
+    # First preview encoded after this call, so it shows the current borders, or the newest one after timeout
+    # sleep(seconds) must let the web server run, the GUI is served from the same loop
+    def fresh(self, sleep, timeout=2.0):
+        jpeg, frame_id = self.latest()
+        deadline = time.monotonic() + timeout
+        while not self.closed and time.monotonic() < deadline:
+            sleep(1 / self.fps / 2)
+            new_jpeg, new_id = self.latest()
+            if new_id > frame_id:
+                return new_jpeg
+        return jpeg
+
+    # multipart/x-mixed-replace body, one part per new preview, sleep(seconds) must let the web server run
+    def mjpeg(self, sleep, fps=None):
+        interval = 1 / min(fps or self.fps, self.fps)
+        frame_id = 0
+        while not self.closed:
+            jpeg, new_id = self.latest()
+            if jpeg is not None and new_id != frame_id:
+                frame_id = new_id
+                yield ("--{}\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(PREVIEW_BOUNDARY, len(jpeg))).encode() + jpeg + b"\r\n"
+            sleep(interval)
+
+    # Encoded previews and the average encoding time, for logging
+    def stats(self):
+        return {"encoded": self.encoded, "encode_ms": round(1000 * self.encode_time / self.encoded, 2) if self.encoded else None}
+
+    # Stop the background thread
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join(1)
@@ -0,0 +1,123 @@
+"""
+Accuracy and speed of the int8 models against the float ones on a recorded run:
+    Kingdom crops of the video go through the float, dynamically and statically quantized kingdom classifier
+    Moon and Talkatoo crops with text go through a float and an int8 OCR reader, then through matching
+    Reports how often every quantized model gives the same kingdom or moons as the float one and its p50 latency
+Usage: python quantize_report.py run.mp4 [--language japanese] [--step 5] [--calibration 200] [--save report.json]
+"""
+
+import argparse
+from json import dumps
+import sys
+import time
+
+from benchmark import ocr_crops, summarize
+import detection
+from detection import *
+from reader_pool import ReaderPool
+
+CALIBRATION_CROPS = 200  # Kingdom crops used to calibrate static quantization, taken from the start of the video
+
+
+# Every step-th frame of a video as BGR arrays
+def read_frames(path, step):
+    stream = cv2.VideoCapture(path)
+    if not stream.isOpened():
+        raise IOError("Could not open video {}".format(path))
+    frames = []
+    frame_index = 0
+    while True:
+        grabbed, frame = stream.read()
+        if not grabbed:
+            break
+        if frame_index % step == 0:
+            frames.append(frame)
+        frame_index += 1
+    stream.release()
+    return frames
+
+
+# Outputs of func for every input and the time each call took
+def run_timed(func, inputs):
+    outputs, times = [], []
+    for item in inputs:
+        start = time.perf_counter()
+        outputs.append(func(item))
+        times.append(time.perf_counter() - start)
+    return outputs, summarize(times)
+
+
+# Share of outputs equal to the reference outputs
+def agreement(outputs, reference):
+    return round(sum(a == b for a, b in zip(outputs, reference)) / len(reference), 4) if reference else None
+
+
+# Compare the float kingdom classifier with its dynamically and statically quantized versions
+def compare_kingdom(kingdom_ims, calibration_size):
+    float_model = load_kingdom_classifier(quantize=False)
+    models = {"dynamic_int8": lambda: quantize_kingdom_classifier(float_model),
+              "static_int8": lambda: quantize_kingdom_classifier(float_model, kingdom_ims[:calibration_size])}
+    reference, report = run_timed(lambda img_arr: classify_kingdom(float_model, img_arr), kingdom_ims)
+    results = {"crops": len(kingdom_ims), "float": report}
+    for name, quantize in models.items():
+        try:
+            model = quantize()
+        except Exception as error:  # Quantization support depends on how torch was built
+            results[name] = {"error": str(error)}
+            continue
+        outputs, report = run_timed(lambda img_arr: classify_kingdom(model, img_arr), kingdom_ims)
+        results[name] = dict(report, agreement=agreement(outputs, reference),
+                             kingdom_agreement=agreement([o for o, r in zip(outputs, reference) if r], [r for r in reference if r]))
+    return results
+
+
+# Compare moon matches of a float and an int8 OCR reader on the same crops
+def compare_ocr(frames, detector):
+    crops = ocr_crops(frames, detector)
+    if not crops:
+        return {"crops": 0}
+    code = detector.language_settings["Language"]
+    results = {"crops": len(crops)}
+    matches = {}
+    for name, quantize in (("float", False), ("int8", True)):
+        reader = ReaderPool(quantize=quantize).get(code)
+        matches[name], results[name] = run_timed(lambda crop: detector.match_ocr_text(detector.read_line(reader, crop[0], crop[1])), crops)
+    results["int8"]["agreement"] = agreement(matches["int8"], matches["float"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the quantized models against the float ones on a recorded run")
+    parser.add_argument("video", help="path to the recorded run")
+    parser.add_argument("--language", default=DEFAULT_GAME_LANGUAGE, choices=list(LANGUAGES), help="game language of the run")
+    parser.add_argument("--kingdom", default="Cap", choices=KINGDOM_LIST, help="kingdom used to pick candidate moons")
+    parser.add_argument("--step", type=int, default=5, help="use every step-th frame of the video")
+    parser.add_argument("--calibration", type=int, default=CALIBRATION_CROPS, help="kingdom crops used for static quantization")
+    parser.add_argument("--borders", type=int, nargs=4, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+                        help="capture borders, determined from the first frame if not given")
+    parser.add_argument("--save", help="write the report to this JSON file")
+    args = parser.parse_args()
+    detection.VERBOSE = False
+
+    frames = read_frames(args.video, args.step)
+    if not frames:
+        raise IOError("No frames in {}".format(args.video))
+    borders = args.borders or determine_borders(cv2.cvtColor(frames[0], cv2.COLOR_BGR2RGB))
+    kingdom_ims = [image_to_bw(frame_to_image(frame, borders).crop(KINGDOM_BORDERS)) for frame in frames]
+
+    moons_by_kingdom, hint_arts = generate_moon_dict()
+    detector = Detector(moons_by_kingdom, hint_arts, None, args.language, DEFAULT_GUI_LANGUAGE)
+    detector.set_current_kingdom(args.kingdom)
+    report = {"video": args.video, "language": args.language, "frames": len(frames),
+              "threads": [TORCH_THREADS, TORCH_INTEROP_THREADS],
+              "kingdom": compare_kingdom(kingdom_ims, args.calibration), "ocr": compare_ocr(frames, detector)}
+
+    print(dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf8") as file:
+            file.write(dumps(report, indent=2))
+        print("[STATUS] -> Saved report to {}".format(args.save), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
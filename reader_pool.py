@@ -0,0 +1,131 @@
+"""
+Pool of easyocr readers, one per OCR language code (LANGUAGES[...]["Language"]):
+    Switching the game language reuses a reader that is already loaded instead of building a new one
+    Readers can be loaded on a background thread with load_all before they are needed
+    The text detection model is the same for every language, so it is loaded once and shared
+    When the models take more memory than the budget, the least recently used readers are dropped
+"""
+
+from collections import OrderedDict
+import sys
+import threading
+
+READER_MEMORY_BUDGET = 512  # MB of model weights kept loaded, the reader in use is never dropped
+MB = 1024 * 1024
+DETECTOR_ATTRIBUTES = ("detector", "get_textbox", "get_detector", "detect_network")  # Only set up by easyocr when it loads the detector
+WARM_UP_SIZE = (60, 400)  # height, width of the image every new reader reads once
+
+
+# Bytes taken by the weights and buffers of a torch module, 0 for anything else
+# Goes through the state dict since quantized layers keep their packed weights out of parameters()
+def module_size(module):
+    if module is None or not hasattr(module, "state_dict"):
+        return 0
+    size = 0
+    values = list(module.state_dict().values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (tuple, list)):  # (weight, bias) of quantized linear layers
+            values.extend(value)
+        elif hasattr(value, "element_size"):
+            size += value.numel() * value.element_size()
+    return size
+
+
+# Read a line of dummy text once, so the first real read doesn't pay for torch's lazy setup
+def warm_up_reader(reader):
+    import cv2  # pip install opencv-python, easyocr needs it anyway
+    import numpy as np
+    dummy = np.full(WARM_UP_SIZE, 255, dtype=np.uint8)  # Single channel like the real masks
+    cv2.putText(dummy, "Talkatoo", (20, WARM_UP_SIZE[0] - 15), cv2.FONT_HERSHEY_SIMPLEX, 1, 0, 2)
+    reader.readtext(dummy)  # Text so recognition runs too, not only detection
+
+
+# Readers by language code, least recently used first
+class ReaderPool:
+    # constructor
+    def __init__(self, memory_budget=READER_MEMORY_BUDGET, quantize=True, verbose=False):
+        self.memory_budget = memory_budget
+        self.quantize = quantize  # easyocr's dynamic int8 quantization, only used on CPU
+        self.verbose = verbose
+        self.readers = OrderedDict()  # language code -> easyocr.Reader
+        self.sizes = {}  # language code -> bytes of its recognition model
+        self.detector = None  # Text detection model and its easyocr functions, shared by all readers
+        self.detector_size = 0
+        self.lock = threading.Lock()  # Guards readers, sizes and load_locks
+        self.load_locks = {}  # language code -> lock held while that reader is loaded
+        self.loads = 0
+        self.evictions = 0
+
+    # Reader for a language code, loaded if it isn't in the pool yet
+    def get(self, code):
+        with self.lock:
+            if code in self.readers:
+                self.readers.move_to_end(code)
+                return self.readers[code]
+            load_lock = self.load_locks.setdefault(code, threading.Lock())
+        with load_lock:  # Other languages can still be used while this one loads
+            with self.lock:
+                if code in self.readers:  # Loaded by another thread while waiting
+                    self.readers.move_to_end(code)
+                    return self.readers[code]
+            reader = self.load(code)
+            with self.lock:
+                self.readers[code] = reader
+                self.sizes[code] = module_size(getattr(reader, "recognizer", None))
+                self.evict(keep=code)
+            return reader
+
+    # Build and warm up a reader, only the first one loads the detection model
+    # Later readers get the detector and the functions easyocr sets up along with it, readtext needs all of them
+    def load(self, code):
+        import easyocr  # pip install easyocr, imported here since it takes seconds
+        if self.detector is None:
+            reader = easyocr.Reader([code], verbose=False, quantize=self.quantize)
+            self.detector = {name: getattr(reader, name) for name in DETECTOR_ATTRIBUTES}
+            self.detector_size = module_size(reader.detector)
+        else:
+            reader = easyocr.Reader([code], detector=False, verbose=False, quantize=self.quantize)
+            for name, value in self.detector.items():
+                setattr(reader, name, value)
+        warm_up_reader(reader)
+        self.loads += 1
+        if self.verbose:
+            print("[STATUS] -> Loaded OCR reader {} ({:.1f} MB)".format(code, module_size(reader.recognizer) / MB))
+        return reader
+
+    # Drop least recently used readers until the pool fits the budget, must hold self.lock
+    def evict(self, keep=None):
+        while self.resident_bytes() > self.memory_budget * MB:
+            victim = next((code for code in self.readers if code != keep), None)
+            if victim is None:
+                return
+            del self.readers[victim]
+            del self.sizes[victim]
+            self.evictions += 1
+            if self.verbose:
+                print("[STATUS] -> Dropped OCR reader {} to stay under {} MB".format(victim, self.memory_budget))
+
+    # Load every language code in order, a failing one doesn't stop the rest, meant to run on a background thread
+    def load_all(self, codes):
+        for code in codes:
+            try:
+                self.get(code)
+            except Exception as error:
+                print("[ERROR] -> Could not preload OCR reader {}: {}".format(code, error), file=sys.stderr)
+
+    # Whether a reader for the language code is loaded
+    def __contains__(self, code):
+        with self.lock:
+            return code in self.readers
+
+    # Bytes of all loaded models, the shared detection model is counted once
+    def resident_bytes(self):
+        return self.detector_size + sum(self.sizes.values())
+
+    # Resident size of every loaded reader in MB, for logging
+    def stats(self):
+        with self.lock:
+            return {"readers": {code: round(size / MB, 1) for code, size in self.sizes.items()},
+                    "detector": round(self.detector_size / MB, 1), "total": round(self.resident_bytes() / MB, 1),
+                    "budget": self.memory_budget, "loads": self.loads, "evictions": self.evictions}
@@ -0,0 +1,114 @@
+"""
+Headless replay of a recorded run:
+    Read frames from a video file instead of a capture card
+    Run the same detection pipeline as the GUI main loop, as fast as possible
+    Write every detection event as a JSON line with frame index and timestamp
+Usage: python replay.py run.mp4 [--output events.jsonl] [--language japanese]
+"""
+
+import argparse
+from json import dumps
+import sys
+import time
+
+import detection
+from detection import *
+from event_log import LEVELS, OFF, event_log
+
+
+# Keep only what is needed to identify a moon, full dicts carry all 13 languages
+def compact_moons(moons, translate_to):
+    if moons is None:
+        return None
+    return [{"id": moon["id"], "kingdom": moon["kingdom"], "name": moon[translate_to]} for moon in moons]
+
+
+# Run the detector over every frame of a video, returns (frames processed, seconds spent)
+def replay(path, detector, out, borders=None):
+    stream = cv2.VideoCapture(path)
+    if not stream.isOpened():
+        raise IOError("Could not open video {}".format(path))
+    fps = stream.get(cv2.CAP_PROP_FPS) or 30  # Some containers don't report a frame rate
+    detector.reset_timers()
+
+    frame_index = 0
+    old_time = None
+    roi_map = None
+    start = time.perf_counter()
+    while True:
+        grabbed, frame = stream.read()
+        if not grabbed:
+            break
+        if borders is None:  # Same border detection as a reset in the GUI
+            borders = determine_borders(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if ROI_FIRST and roi_map is None:
+            roi_map = RoiMap(borders)
+        new_time = frame_index / fps  # Video time, so timers behave as if it were played live
+        frame_time = new_time - old_time if old_time is not None else 0
+        old_time = new_time
+
+        for event, payload in detector.process_frame(prepare_frame(frame, borders, roi_map), new_time, frame_time):
+            record = {"frame": frame_index, "time": round(new_time, 3), "event": event}
+            if event == "kingdom":
+                record["kingdom"] = payload
+            else:
+                record["moons"] = compact_moons(payload, detector.translate_to)
+            out.write(dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+        frame_index += 1
+    stream.release()
+    return frame_index, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Talkatoo detection on a recorded video without the GUI")
+    parser.add_argument("video", help="path to the recorded run")
+    parser.add_argument("--output", help="file to write JSON lines to, defaults to stdout")
+    parser.add_argument("--settings", default="settings.json", help="settings file to take languages from")
+    parser.add_argument("--language", help="game language, overrides the settings file")
+    parser.add_argument("--output-language", help="language of the written moon names, overrides the settings file")
+    parser.add_argument("--kingdom", default="Cap", choices=KINGDOM_LIST, help="kingdom at the start of the video")
+    parser.add_argument("--postgame", action="store_true", help="include postgame moons")
+    parser.add_argument("--global-search", default=GLOBAL_SEARCH, choices=["off", "fallback", "always"],
+                        help="search every kingdom when the current one has no match (fallback) or for every read (always)")
+    parser.add_argument("--borders", type=int, nargs=4, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+                        help="capture borders, determined from the first frame if not given")
+    parser.add_argument("--quiet", action="store_true", help="don't print the detection log")
+    parser.add_argument("--log", help="file to write the detection log to as JSON lines")
+    parser.add_argument("--log-level", default="info", choices=list(LEVELS), help="least important records that are logged")
+    args = parser.parse_args()
+
+    if args.quiet or not args.output:  # The detection log would end up between the JSON lines
+        event_log.echo_level = OFF
+        if not args.log:
+            detection.VERBOSE = False
+    event_log.set_level(args.log_level)
+    event_log.start(args.log)
+
+    settings = read_file_to_json(args.settings) or {}
+    translate_from = args.language or settings.get("inputLanguage", DEFAULT_GAME_LANGUAGE)
+    translate_to = args.output_language or settings.get("outputLanguage", DEFAULT_GUI_LANGUAGE)
+    is_postgame = args.postgame or settings.get("includePostGame", False)
+
+    moons_by_kingdom, hint_arts = generate_moon_dict()
+    detector = Detector(moons_by_kingdom, hint_arts, load_kingdom_classifier(), translate_from, translate_to, is_postgame,
+                        global_search=args.global_search)
+    detector.set_current_kingdom(args.kingdom)
+
+    out = open(args.output, "w", encoding="utf8") if args.output else sys.stdout
+    try:
+        frames, seconds = replay(args.video, detector, out, args.borders)
+    finally:
+        if args.output:
+            out.close()
+        event_log.close()
+    print("[STATUS] -> Replayed {} frames in {:.1f}s ({:.1f} fps)".format(frames, seconds, frames / seconds if seconds else 0),
+          file=sys.stderr)
+    for name, stats in detector.cache_stats().items():
+        print("[STATUS] -> {} cache: {hits} hits, {misses} misses, {evictions} evictions".format(name.upper(), **stats), file=sys.stderr)
+    for name, stats in detector.scheduler.stats()["checks"].items():
+        print("[STATUS] -> {} check: {runs} runs, {cost_ms}ms each".format(name, **stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+State of the run, owned by Python and mirrored by the GUI:
+    Moons mentioned by Talkatoo, each with one or more possible options, the collected moons and the current kingdom
+    Moons are referred to by [kingdom, id], the GUI looks them up in the moon list it got with the snapshot
+    Every change is recorded as a small operation, the operations of one frame are coalesced into one versioned delta
+    A GUI whose version doesn't match the base of a delta asks for a new snapshot instead of guessing
+The snapshot only carries the names of the languages in use, the rules are the ones the GUI used to apply itself
+"""
+
+MOON_KEYS = ("id", "kingdom", "collection_kingdom", "is_story", "is_multi")  # Sent along with the names of a moon
+
+
+# (kingdom, id) of a moon dict or a [kingdom, id] pair
+def moon_ref(moon):
+    if isinstance(moon, dict):
+        return moon["kingdom"], moon["id"]
+    return tuple(moon)
+
+
+# Moon dict with only the keys the GUI uses and the names of the given languages
+def project_moon(moon, languages):
+    projected = {key: moon[key] for key in MOON_KEYS if key in moon}
+    for language in languages:
+        projected[language] = moon[language]
+    return projected
+
+
+# Mentioned and collected moons of the current run
+class RunState:
+    # constructor
+    def __init__(self, moons_by_kingdom):
+        self.moons_by_kingdom = moons_by_kingdom
+        self.version = 0  # Version of the last delta or snapshot handed out
+        self.ops = []  # Operations since then
+        self.current_kingdom = None
+        self.reset(record=False)
+
+    # Clear the mentioned and collected moons, the GUI clears its copy with the next delta
+    def reset(self, record=True):
+        self.mentioned = []  # [index, [options]] per mention, options are (kingdom, id) pairs
+        self.mention_count = 0  # Index of the next mention, indices are never reused within a run
+        self.collected = []  # (kingdom, id) pairs
+        if record:
+            self.ops = [["reset"]]  # Nothing before a reset matters to the GUI
+
+    def is_mentioned(self, ref):
+        return any(len(options) == 1 and options[0] == ref for _, options in self.mentioned)
+
+    def is_collected(self, ref):
+        return ref in self.collected
+
+    # New moon text from Talkatoo, moons are its possible matches
+    # Ignored if it repeats the last mention or every option was already mentioned or collected, returns whether it was added
+    def mention(self, moons, detected=True):
+        refs = [moon_ref(moon) for moon in moons or []]
+        if not refs or (self.mentioned and self.mentioned[-1][1] == refs):
+            return False
+        refs = [ref for ref in refs if not self.is_mentioned(ref) and not self.is_collected(ref)]
+        if not refs:
+            return False
+        if len(refs) == 1:
+            self.remove_option(refs[0])
+        index = self.mention_count
+        self.mention_count += 1
+        self.mentioned.append([index, refs])
+        self.ops.append(["mention", index, [list(ref) for ref in refs], detected])
+        return True
+
+    # A moon got collected, detections only count when the match was unambiguous, returns whether it was added
+    def collect(self, moons, detected=True):
+        refs = [moon_ref(moon) for moon in moons or []]
+        if len(refs) != 1 or self.is_collected(refs[0]):
+            return False
+        ref = refs[0]
+        self.collected.append(ref)
+        self.ops.append(["collect", list(ref), detected])
+        for index, options in reversed(self.mentioned):  # The latest mention it was an option of was this moon
+            if len(options) > 1 and ref in options:
+                self.set_options(index, [ref])
+                break
+        self.remove_option(ref)
+        return True
+
+    # Move a moon back from collected to pending
+    def uncollect(self, moon):
+        ref = moon_ref(moon)
+        if ref in self.collected:
+            self.collected.remove(ref)
+            self.ops.append(["uncollect", list(ref)])
+
+    # Pick the right option of a mention with several
+    def choose_option(self, index, option):
+        for entry_index, options in self.mentioned:
+            if entry_index == index and option < len(options):
+                ref = options[option]
+                self.set_options(index, [ref])
+                self.remove_option(ref)
+                return
+
+    # Remove a mention, and the moon from the collected ones if asked to
+    def delete(self, index, moon=None, from_collected=False):
+        if from_collected and moon is not None:
+            self.uncollect(moon)
+        if any(entry_index == index for entry_index, _ in self.mentioned):
+            self.mentioned = [entry for entry in self.mentioned if entry[0] != index]
+            self.ops.append(["delete", index])
+
+    def set_kingdom(self, kingdom):
+        if kingdom and kingdom != self.current_kingdom:
+            self.current_kingdom = kingdom
+            self.ops.append(["kingdom", kingdom])
+
+    # Replace the options of a mention
+    def set_options(self, index, refs):
+        for entry in self.mentioned:
+            if entry[0] == index:
+                entry[1] = list(refs)
+                self.ops.append(["options", index, [list(ref) for ref in refs]])
+
+    # A moon that is known now is no longer an option of mentions with several options
+    def remove_option(self, ref):
+        for index, options in self.mentioned:
+            if len(options) > 1 and ref in options:
+                self.set_options(index, [option for option in options if option != ref])
+
+    # Delta with the operations since the last one or None, operations that cancel or replace each other are merged
+    def flush(self):
+        if not self.ops:
+            return None
+        delta = {"base": self.version, "version": self.version + 1, "ops": coalesce(self.ops)}
+        self.version += 1
+        self.ops = []
+        return delta
+
+    # Everything the GUI needs to start over, with the names of the given languages
+    # Pending operations are part of it, so they are dropped
+    def snapshot(self, languages):
+        self.flush()
+        return {"version": self.version, "languages": list(languages),
+                "moons": {kingdom: [project_moon(moon, languages) for moon in moons] for kingdom, moons in self.moons_by_kingdom.items()},
+                "mentioned": [[index, [list(ref) for ref in options]] for index, options in self.mentioned],
+                "mentionCount": self.mention_count, "collected": [list(ref) for ref in self.collected]}
+
+
+# Merge operations of one frame: the latest options of a mention win, a collect undone in the same frame is dropped
+def coalesce(ops):
+    merged = []
+    for op in ops:
+        kind = op[0]
+        if kind == "reset":
+            merged = [op]
+        elif kind == "kingdom":
+            merged = [old for old in merged if old[0] != "kingdom"] + [op]
+        elif kind == "options":
+            mention = next((old for old in merged if old[0] == "mention" and old[1] == op[1]), None)
+            if mention is not None:  # Mentioned in this frame, send it with its final options
+                mention[2] = op[2]
+            else:
+                merged = [old for old in merged if not (old[0] == "options" and old[1] == op[1])] + [op]
+        elif kind == "delete":
+            mentioned_now = any(old[0] == "mention" and old[1] == op[1] for old in merged)
+            merged = [old for old in merged if not (old[0] in ("mention", "options") and old[1] == op[1])]
+            if not mentioned_now:
+                merged.append(op)
+        elif kind == "uncollect":
+            collected_now = any(old[0] == "collect" and old[1] == op[1] for old in merged)
+            merged = [old for old in merged if not (old[0] == "collect" and old[1] == op[1])]
+            if not collected_now:
+                merged.append(op)
+        else:
+            merged.append(op)
+    return merged
@@ -0,0 +1,135 @@
+"""
+Scheduler deciding which detector checks run on a frame:
+    Every check registers how often it wants to run, its priority and a first guess of its cost
+    Due checks are picked by priority until the frame budget is used up, the rest wait for the next frame
+    Only one timed check runs per frame, so checks that fall due together get spread over consecutive frames
+    When frames take longer than the budget, lower priority checks get spread further apart first
+    When nothing on screen changed for a while, every check drops to a slow idle rate until something moves
+    A check's max_interval caps both, load and idling
+Costs are measured while running, so the budget follows the machine the detector runs on
+"""
+
+import numpy as np
+
+SCHEDULER_BUDGET = 1 / 30  # Seconds of checks per frame, half a frame at 15fps
+COST_SMOOTHING = 0.2  # Weight of the newest measurement in the running cost averages
+MAX_SLOWDOWN = 4  # Most a check's interval is stretched under load
+MAX_DEFERRALS = 5  # Frames a due check may be pushed back by the budget before it runs regardless
+IDLE_AFTER = 10  # Seconds without a change on screen before going idle
+IDLE_INTERVAL = 0.5  # Seconds between runs of any check while idle
+IDLE_THRESHOLD = 4  # Mean absolute difference of the frame thumbnails below which nothing changed
+
+
+# Timing and state of one registered check
+class ScheduledCheck:
+    # constructor
+    def __init__(self, name, interval, priority, cost, max_interval=None):
+        self.name = name
+        self.interval = interval  # Seconds between runs, 0 for every frame
+        self.priority = priority  # 0 is the most important, it is never slowed down
+        self.cost = cost  # Running average of seconds per run
+        self.max_interval = max_interval  # Never stretched further than this, checks that need close frames set it
+        self.next_at = -1
+        self.deferred = 0  # Frames in a row this check was due but did not fit
+        self.runs = 0
+
+
+# Picks the checks of every frame from their rates, priorities and measured costs
+class CheckScheduler:
+    # constructor
+    def __init__(self, budget=SCHEDULER_BUDGET):
+        self.budget = budget
+        self.checks = {}  # name -> ScheduledCheck, in the order they run within a frame
+        self.frame_cost = 0  # Running average of seconds spent on checks per frame
+        self.thumbnail = None
+        self.changed_at = None  # Time of the last frame that looked different from the one before
+        self.idle = False
+
+    # Add a check, checks run within a frame in the order they were registered
+    def register(self, name, interval, priority, cost=0.001, max_interval=None):
+        self.checks[name] = ScheduledCheck(name, interval, priority, cost, max_interval)
+
+    # Make every check due right away
+    def reset(self):
+        for check in self.checks.values():
+            check.next_at = -1
+            check.deferred = 0
+        self.changed_at = None
+        self.idle = False
+
+    # Load relative to the budget, above 1 when checks take longer than the budget
+    @property
+    def pressure(self):
+        return self.frame_cost / self.budget
+
+    # Interval of a check after stretching it for load or idling
+    # max_interval caps it either way, checks that compare close frames like the Talkatoo trigger keep working while idle
+    def effective_interval(self, check):
+        interval = check.interval
+        if self.idle:
+            interval = max(interval, IDLE_INTERVAL)
+        elif check.priority and self.pressure > 1:
+            interval *= min(MAX_SLOWDOWN, 1 + (self.pressure - 1) * check.priority)
+        if check.max_interval is not None:
+            interval = min(interval, check.max_interval)
+        return interval
+
+    # Compare a small thumbnail of the frame with the last one to tell whether anything on screen changed
+    def observe(self, thumbnail, new_time):
+        if self.thumbnail is None or thumbnail.shape != self.thumbnail.shape or \
+                np.mean(np.abs(thumbnail.astype(np.int16) - self.thumbnail)) > IDLE_THRESHOLD:
+            self.changed_at = new_time
+            if self.idle:  # Wake up, everything that waited on the idle rate is due now
+                self.idle = False
+                for check in self.checks.values():
+                    check.next_at = min(check.next_at, new_time)
+        elif self.changed_at is None:
+            self.changed_at = new_time
+        self.thumbnail = thumbnail
+        self.idle = new_time - self.changed_at > IDLE_AFTER
+
+    # Names of the checks to run on this frame, in registration order
+    # Due checks are taken by priority while their costs fit the budget and no other timed check was taken
+    # At least one check always runs, and one that was pushed back MAX_DEFERRALS times runs regardless
+    def plan(self, new_time, enabled=None):
+        due = [check for check in self.checks.values() if new_time > check.next_at and (enabled is None or check.name in enabled)]
+        due.sort(key=lambda check: (check.deferred < MAX_DEFERRALS, check.priority))
+        chosen = set()
+        spent = 0
+        timed = False
+        for check in due:
+            over_budget = chosen and spent + check.cost > self.budget
+            if (over_budget or (timed and check.interval)) and check.deferred < MAX_DEFERRALS:
+                check.deferred += 1
+                continue
+            chosen.add(check.name)
+            spent += check.cost
+            timed = timed or bool(check.interval)
+        return [name for name in self.checks if name in chosen]
+
+    # A check is about to run, it is due again after its interval unless schedule() says otherwise
+    def start(self, name, new_time):
+        check = self.checks[name]
+        check.next_at = new_time + self.effective_interval(check)
+        check.deferred = 0
+
+    # Run a check next at a given time instead, for backoffs and confirmations
+    def schedule(self, name, at):
+        if name in self.checks:
+            self.checks[name].next_at = at
+
+    # Record how long a check took
+    def ran(self, name, seconds):
+        check = self.checks[name]
+        check.cost += COST_SMOOTHING * (seconds - check.cost)
+        check.runs += 1
+
+    # Record how long all checks of a frame took together
+    def end_frame(self, seconds):
+        self.frame_cost += COST_SMOOTHING * (seconds - self.frame_cost)
+
+    # Costs, rates and load for logging
+    def stats(self):
+        return {"pressure": round(self.pressure, 2), "idle": self.idle,
+                "checks": {check.name: {"cost_ms": round(check.cost * 1000, 3), "interval": round(self.effective_interval(check), 3),
+                                        "runs": check.runs} for check in self.checks.values()}}
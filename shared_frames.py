@@ -0,0 +1,113 @@
+"""
+Frame ring in shared memory, so detector processes can read captured frames without pickling them:
+    The capture side copies every frame into the next slot once
+    Readers get NumPy views straight into the shared block, same interface as frame_buffer.FrameRing
+Slots are sized for the biggest frame expected, smaller frames use the top left part of a slot and bigger ones are dropped
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import time
+
+import numpy as np
+
+MAX_FRAME_SHAPE = (1440, 2560, 3)  # Biggest capture resolution a slot can hold
+
+
+# Bounded ring of frames in a multiprocessing.shared_memory block
+# Every frame gets a monotonically increasing sequence number and the time it was captured
+class SharedFrameRing:
+    # constructor, creates the shared block unless name is given, then it attaches to an existing one
+    def __init__(self, size=8, max_shape=MAX_FRAME_SHAPE, name=None, condition=None):
+        self.size = size
+        self.max_shape = tuple(max_shape)
+        self.condition = condition or multiprocessing.get_context("spawn").Condition()
+        self.owner = name is None
+        self.rejected = 0  # Frames put() dropped because they don't fit a slot
+        self.rejected_shape = None
+        header_bytes = 8 * (3 * size + 2)
+        frame_bytes = size * int(np.prod(self.max_shape))
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=header_bytes + frame_bytes)
+        buffer = self.memory.buf
+        self.times = np.ndarray((size,), dtype=np.float64, buffer=buffer, offset=0)
+        self.shapes = np.ndarray((size, 2), dtype=np.int64, buffer=buffer, offset=8 * size)  # height, width of every slot
+        self.state = np.ndarray((2,), dtype=np.int64, buffer=buffer, offset=24 * size)  # newest seq, closed
+        self.frames = np.ndarray((size,) + self.max_shape, dtype=np.uint8, buffer=buffer, offset=header_bytes)
+        if self.owner:
+            self.state[:] = 0
+
+    # Sent to other processes by name, they attach to the same block
+    def __reduce__(self):
+        return SharedFrameRing, (self.size, self.max_shape, self.memory.name, self.condition)
+
+    @property
+    def seq(self):
+        return int(self.state[0])
+
+    @property
+    def closed(self):
+        return bool(self.state[1])
+
+    # Copy a new frame into the ring, overwriting the oldest one if the ring is full
+    # Frames that don't fit a slot are dropped with a status message, returns None for them
+    def put(self, frame, timestamp=None):
+        height, width = frame.shape[:2]
+        if height > self.max_shape[0] or width > self.max_shape[1] or frame.shape[2:] != self.max_shape[2:]:
+            self.rejected += 1
+            if frame.shape != self.rejected_shape:  # Once per capture resolution, not every frame
+                self.rejected_shape = frame.shape
+                print("[STATUS] -> Dropping captured frames of shape {}, shared frame slots hold up to {}".format(frame.shape, self.max_shape))
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        with self.condition:
+            seq = self.seq + 1
+            slot = seq % self.size
+            self.frames[slot, :height, :width] = frame
+            self.times[slot] = timestamp
+            self.shapes[slot] = height, width
+            self.state[0] = seq
+            self.condition.notify_all()
+        return seq
+
+    # View of the frame in a slot, valid until the ring wraps around to this slot again
+    def view(self, slot):
+        height, width = self.shapes[slot]
+        return self.frames[slot, :height, :width]
+
+    # Block until a frame newer than last_seq arrives (or timeout), never returns the same frame twice
+    # Returns (seq, timestamp, frame view, dropped) or None, dropped counts the frames the reader never saw
+    def get(self, last_seq, timeout=None, newest=True):
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq or self.closed, timeout):
+                return None
+            if self.seq <= last_seq:  # Closed without anything new
+                return None
+            seq = self.seq if newest else max(last_seq + 1, self.seq - self.size + 1)
+            slot = seq % self.size
+            timestamp = float(self.times[slot])
+        return seq, timestamp, self.view(slot), seq - last_seq - 1
+
+    # Newest frame without waiting, used for one-off reads like border resets
+    def latest(self):
+        with self.condition:
+            if self.seq == 0:
+                return None
+            slot = self.seq % self.size
+            return self.seq, float(self.times[slot]), self.view(slot)
+
+    # Wake up all waiting readers, used on shutdown
+    def close(self):
+        with self.condition:
+            self.state[1] = 1
+            self.condition.notify_all()
+
+    # Detach from the block, the creating process also frees it
+    def release(self):
+        self.times = self.shapes = self.state = self.frames = None  # Views must go before the block closes
+        try:
+            self.memory.close()
+        except BufferError:  # A reader still holds a frame view, the mapping goes away with the process
+            pass
+        if self.owner:
+            self.memory.unlink()
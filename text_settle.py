@@ -0,0 +1,57 @@
+"""
+Trigger for reading Talkatoo text once it has finished scrolling in:
+    The ink mask of the text box is compared with the one of the previous frame
+    While characters are still being added the mask keeps changing, once it stays the same for a while the line has settled
+    A settled line fires once, the trigger re-arms only when the text box clears or its text changes
+Works on capture timestamps, so it behaves the same at any frame rate
+"""
+
+import numpy as np
+
+SETTLE_TIME = 0.2  # Seconds the ink mask must stay the same before the line counts as settled
+SETTLE_TOLERANCE = 0.02  # Share of ink pixels that may flicker between frames of settled text
+SETTLE_MIN_PIXELS = 10  # Flicker always allowed, for short lines
+MAX_FRAME_GAP = 0.3  # Frames further apart than this can't show that nothing changed in between
+
+
+# Tracks the ink mask of one text box over frames
+class TextSettleTracker:
+    # constructor
+    def __init__(self, settle_time=SETTLE_TIME, tolerance=SETTLE_TOLERANCE):
+        self.settle_time = settle_time
+        self.tolerance = tolerance
+        self.fires = 0  # Settled lines found
+        self.rearms = 0  # Times the text changed after firing
+        self.reset()
+
+    # Forget the current text, the next line that settles fires again
+    def reset(self):
+        self.mask = None
+        self.last_time = None
+        self.stable_since = None
+        self.fired = False
+
+    # Feed the black and white text box (mask or RGB) of a frame, has_text is whether it has enough ink to be text at all
+    # Returns True exactly once per settled line, on the frame it settled
+    def update(self, img_arr, has_text, new_time):
+        if not has_text:  # Text box closed or cleared
+            self.reset()
+            return False
+        mask = (img_arr if img_arr.ndim == 2 else img_arr[:, :, 0]) == 0
+        if self.mask is None or mask.shape != self.mask.shape or self.changed(mask) or new_time - self.last_time > MAX_FRAME_GAP:
+            if self.fired:  # New line in the same text box
+                self.fired = False
+                self.rearms += 1
+            self.stable_since = new_time
+        self.mask = mask
+        self.last_time = new_time
+        if not self.fired and new_time - self.stable_since >= self.settle_time:
+            self.fired = True
+            self.fires += 1
+            return True
+        return False
+
+    # Whether mask differs from the previous one by more than flicker
+    def changed(self, mask):
+        different = np.count_nonzero(mask != self.mask)
+        return different > max(SETTLE_MIN_PIXELS, self.tolerance * np.count_nonzero(mask))
@@ -1,9 +1,9 @@
-import json
-import os
-import sys
-
+import cv2  # pip install opencv-python
 import numpy as np  # pip install numpy
 
+from event_log import event_log
+from matching import *  # Text correction, moon data and scoring, kept importable from here
+
 
 # Naive checker for story/multi moon
 def check_story_multi(img, expected="RED"):
@@ -32,46 +32,15 @@ def check_story_multi(img, expected="RED"):
     return red_count_right and white_count_right and blue_count_right
 
 
-# Replace certain known problematic characters to make better matches
-def correct_text(string, translate_from):
-    if translate_from.startswith("chinese"):  # Designed from
-        replacements = {" ": "", "!": "！", "(": "", ";": " ", "@": " ", "1": "１", "2": "２", "3": "３",
-                        "4": "４", "5": "５", "6": "６", "7": "７", "8": "８", "9": "９", "0": "０"}
-    elif translate_from == "korean":
-        replacements = {"3": "3"}
-    elif translate_from == "japanese":
-        replacements = {}
-    elif translate_from == "russian":
-        replacements = {" ": "", "<": "", ">": "", "{": "", "}": ""}
-    else:
-        replacements = {" ": ""}
-    for i in replacements:
-        string = string.replace(i, replacements[i])
-    return string
-
-
 # Used to set capture card borders, for cropping to work the game must be the whole screen
-def determine_borders(img_arr):
+# step > 1 only looks at every step-th row and column, cheap enough to run in the background
+def determine_borders(img_arr, step=1):
     min_x, min_y, max_x, max_y = 0, 0, img_arr.shape[1]-1, img_arr.shape[0]-1
-    black_arr = np.sum(img_arr[:, :, :], axis=2) >= 20  # im.width by im.height array of True/False
-    black_horiz = np.sum(black_arr, axis=1)  # row sums
-    black_vert = np.sum(black_arr, axis=0)  # column sums
-    for i, over_thresh in enumerate(black_vert):
-        if over_thresh:  # If any pixel in col is over threshold
-            min_x = i
-            break
-    for i in range(max_x, 0, -1):
-        if black_vert[i]:  # If any pixel in col is over threshold
-            max_x = i
-            break
-    for i, over_thresh in enumerate(black_horiz):
-        if over_thresh:  # If any pixel in row is over threshold
-            min_y = i
-            break
-    for i in range(max_y, 0, -1):
-        if black_horiz[i]:  # If any pixel in row is over threshold
-            max_y = i
-            break
+    edges = content_edges(img_arr, step)
+    if edges:
+        min_x, min_y = edges[0], edges[1]
+        max_x = edges[2] if edges[2] > 0 else max_x  # Column and row 0 are never taken as the far edge
+        max_y = edges[3] if edges[3] > 0 else max_y
     # Defaults
     if max_x - min_x < img_arr.shape[1] / 2:
         min_x, max_x = 0, img_arr.shape[1] - 1
@@ -80,26 +49,25 @@ def determine_borders(img_arr):
     return min_x, min_y, max_x, max_y
 
 
-def generate_moon_dict():
-    # Read moon translation data
-    moonlist = read_file_to_json("moon-list.json", True)  # moonlist now a list of dictionaries, one for each moon
-    # Dictionary to store all moons by kingdom
-    moons_by_kingdom = {}
-    hint_arts = {}
-    for moon in moonlist:
-        ha_kingdom = moon.get("collection_kingdom")
-        if ha_kingdom:
-            if ha_kingdom in hint_arts:
-                hint_arts[ha_kingdom].append(moon)
-            else:
-                hint_arts[ha_kingdom] = [moon]
-                
-        this_kingdom = moon["kingdom"]
-        if this_kingdom in moons_by_kingdom:
-            moons_by_kingdom[this_kingdom].append(moon)
-        else:
-            moons_by_kingdom[this_kingdom] = [moon]
-    return moons_by_kingdom, hint_arts
+# First and last column and row with any pixel that isn't black, None for a black image
+def content_edges(img_arr, step=1):
+    if step == 1:
+        col_pixels = row_pixels = not_black(img_arr)  # im.width by im.height array of True/False
+    else:
+        col_pixels, row_pixels = not_black(img_arr[::step]), not_black(img_arr[:, ::step])
+    cols = np.flatnonzero(col_pixels.any(axis=0))
+    rows = np.flatnonzero(row_pixels.any(axis=1))
+    if not cols.size or not rows.size:
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])
+
+
+# Pixels whose channels add up to at least 20
+def not_black(img_arr):
+    total = img_arr[:, :, 0].astype(np.uint16)
+    total += img_arr[:, :, 1]
+    total += img_arr[:, :, 2]
+    return total >= 20
 
 
 # Make black and white image of purple coin counter and moon text
@@ -113,135 +81,69 @@ def image_to_bw(img, white=240):
     return image_arr.astype(np.uint8)
 
 
+# Single channel image_to_bw, 0 where every channel is above white and 255 elsewhere
+# Written into out if it is a uint8 array of the right shape, so the checks run every frame don't allocate
+def bw_mask(img, white=240, out=None):
+    image_arr = np.asarray(img)
+    mask = cv2.inRange(image_arr, (white + 1,) * 3, (255,) * 3, dst=out)
+    return cv2.bitwise_not(mask, dst=mask)
+
+
 # Assumes a well preprocessed, black and white image
 # Create bounding box for text -> check black pixel density
 def is_text_naive(img_arr, text_height, text_lower, text_upper, verbose):
-    black_arr = img_arr[:, :, 0] == 0  # R, G, and B are the same
+    return text_bounds(img_arr, text_height, text_lower, text_upper, verbose) is not None
+
+
+# Bounding box (left, top, right, bottom) of the line of text found by is_text_naive, None if there is none
+def text_bounds(img_arr, text_height, text_lower, text_upper, verbose):
+    black_arr = (img_arr if img_arr.ndim == 2 else img_arr[:, :, 0]) == 0  # R, G, and B are the same
     thresh_x, thresh_y = 20, 10
 
     black_horiz = np.sum(black_arr, axis=1)
     black_horiz_bool = black_horiz > thresh_x
     top_bound = np.argmax(black_horiz_bool)
     if top_bound < 3 or top_bound > 30:  # Not enough whitespace on top
-        return False
+        return None
     bottom_bound = img_arr.shape[0] - np.argmax(black_horiz_bool[::-1]) - 1
     if bottom_bound >= len(black_horiz_bool) - 3 or bottom_bound - top_bound < text_height:  # not enough whitespace on bottom or too small of a range for text
-        return False
+        return None
     # If not enough black pixels or too many irrational white lines (allowed some, i.e. the character i has white lines)
     if np.max(black_horiz[top_bound:bottom_bound]) < 20 or np.sum(black_horiz[top_bound:bottom_bound] == False) > 3:
-        return False
+        return None
 
     black_vert = np.sum(black_arr[top_bound:bottom_bound, :], axis=0)
     black_vert_bool = black_vert > thresh_y
     left_bound = np.argmax(black_vert_bool)
     if left_bound < 5:  # Not enough whitespace on left
-        return False
+        return None
     right_bound = img_arr.shape[1] - np.argmax(black_vert_bool[::-1]) - 1
     if right_bound >= len(black_vert_bool) - 5 or right_bound - left_bound < 30:  # not enough whitespace on right or too small of a range for text
-        return False
+        return None
 
     black_pct = np.sum(black_vert[left_bound:right_bound]) / ((bottom_bound-top_bound)*(right_bound-left_bound))
     if text_lower < black_pct < text_upper:
         if verbose:
-            print("Going to OCR ({}) -> ".format(black_pct), end="")
-        return True
+            event_log.debug("text_check", ocr=True, black_pct=round(float(black_pct), 4), lower=text_lower, upper=text_upper)
+        return int(left_bound), int(top_bound), int(right_bound), int(bottom_bound)
     if verbose:
-        print("No match ({}) -> ".format(black_pct))
-    return False
-
-
-def internal_resource_path(relative_path):
-    try:
-        base_path = sys._MEIPASS
-    except Exception:
-        base_path = os.path.abspath(".")
-
-    return os.path.join(base_path, relative_path)
-
-
-def read_file_to_json(path, is_internal_resource=False):
-    full_path = internal_resource_path(path) if is_internal_resource else path
-    try:
-        with open(full_path, encoding="utf8") as file:
-            json_str = "".join([line.strip() for line in file.readlines()])
-        return json.loads(json_str)
-    except FileNotFoundError:
-        return None
+        event_log.debug("text_check", ocr=False, black_pct=round(float(black_pct), 4), lower=text_lower, upper=text_upper)
+    return None
 
 
-# Replacement Levenshtein distance cost function, designed for alphabet-based languages
-# Basis is few missing characters
-def score_alphabet(proper_moon, test_moon, low_point, can_fail_out=True):
-    proper_moon = proper_moon.replace(" ", "")
-    proper_len = len(proper_moon)
-    test_len = len(test_moon)
-    len_diff = proper_len - test_len
-    best_score = -10
-    fail_out = low_point - 2 - (proper_len / 4)
-
-    if len_diff < 0:
-        longer_moon = test_moon
-        shorter_moon = proper_moon
-    else:
-        longer_moon = proper_moon
-        shorter_moon = test_moon
-
-    # Loop through, check comparison at each possible index
-    for i in range(abs(len_diff) + 1):
-        this_score = 0
-        for j, c in enumerate(shorter_moon):
-            if c == longer_moon[i+j]:
-                this_score += 1
-            else:
-                this_score -= 1
-            if this_score < fail_out and can_fail_out:
-                break
-        if this_score > best_score:
-            best_score = this_score
-    return best_score
-
-
-# Replacement Levenshtein distance cost function, good for Asian languages
-# Basis is shared characters, order is less important
-def score_logogram(proper_moon, test_moon, low_point, can_fail_out=True):
-    proper_len = len(proper_moon)
-    test_len = len(test_moon)
-    len_diff = proper_len - test_len
-    if len_diff > 3 and can_fail_out:
-        return -10
-    fail_out = low_point - 2 - (proper_len / 4)
-    cost = max(len_diff/2, 0)  # Penalize missing characters 1.5x as much as the rest
-    cor = 0.5 if proper_len == test_len else 0  # Give an extra half point if the length is exact
-
-    # Ordered character search
-    trav_index = 0
-    for c in proper_moon:
-        ind = trav_index
-        found = False
-        while ind < test_len:
-            if test_moon[ind] == c:
-                found = True
-                trav_index = ind + 1
-                break
-            ind += 1
-        if found:
-            cor += 1
-        else:
-            cost += 1
-        if cor - cost <= fail_out and can_fail_out:  # if the score is bad enough then don't bother continuing
-            return -10
-    return cor - cost
+# Colour thresholds of the yellow Talkatoo text in a kingdom
+def talkatoo_thresholds(kingd):
+    if kingd in ["Metro", "Seaside"]:
+        return 220, 220, 120  # Problem kingdoms
+    elif kingd in ["Sand"]:
+        return 210, 210, 140  # Middle kingdoms
+    return 200, 200, 150  # Looser numbers usually work
 
 
 # Preprocess talkatoo text box, yellow text becomes black while all else becomes white
 def talkatoo_preprocess_better(talk_img, kingd, min_text=500):
     image_arr = np.array(talk_img)
-    if kingd in ["Metro", "Seaside"]:
-        r_min, g_min, b_max = 220, 220, 120  # Problem kingdoms
-    elif kingd in ["Sand"]:
-        r_min, g_min, b_max = 210, 210, 140  # Middle kingdoms
-    else:
-        r_min, g_min, b_max = 200, 200, 150  # Looser numbers usually work
+    r_min, g_min, b_max = talkatoo_thresholds(kingd)
     red = image_arr[:, :, 0] <= r_min
     green = image_arr[:, :, 1] <= g_min
     blue = image_arr[:, :, 2] >= b_max
@@ -249,3 +151,11 @@ def talkatoo_preprocess_better(talk_img, kingd, min_text=500):
     image_arr[:, :, 1] = image_arr[:, :, 2] = image_arr[:, :, 0]
     text_count = np.sum(image_arr[:, :, 0] == 0)
     return image_arr.astype(np.uint8), text_count > min_text
+
+
+# Single channel talkatoo_preprocess_better, written into out like bw_mask
+def talkatoo_mask(talk_img, kingd, min_text=500, out=None):
+    r_min, g_min, b_max = talkatoo_thresholds(kingd)
+    mask = cv2.inRange(np.asarray(talk_img), (r_min + 1, g_min + 1, 0), (255, 255, b_max - 1), dst=out)  # 255 on text
+    text_count = cv2.countNonZero(mask)
+    return cv2.bitwise_not(mask, dst=mask), text_count > min_text
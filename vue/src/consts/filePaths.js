@@ -1 +1 @@
-export const DEBUG_IMAGE_PATH = 'http://localhost:8083/assets/border_reset_img.png';
+export const PREVIEW_STREAM_PATH = 'http://localhost:8083/preview.mjpg';
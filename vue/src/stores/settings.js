@@ -19,6 +19,7 @@ export const useSettings = defineStore('settings', {
       videoDevice: undefined,
       audioDevice: undefined,
       autoPlayOutputStreams: false,
+      logLevel: 'info',
     };
   },
   actions: {
@@ -70,6 +71,9 @@ export const useSettings = defineStore('settings', {
     setAutoPlayOutputStreams(autoPlayOutputStreams) {
       this.autoPlayOutputStreams = autoPlayOutputStreams;
     },
+    setLogLevel(logLevel) {
+      this.logLevel = logLevel;
+    },
     setSettings(settings) {
       this.setInputLanguage(settings.inputLanguage);
       this.setOutputLanguage(settings.outputLanguage);
@@ -87,6 +91,7 @@ export const useSettings = defineStore('settings', {
       this.setVideoDevice(settings.videoDevice);
       this.setAudioDevice(settings.audioDevice);
       this.setAutoPlayOutputStreams(settings.autoPlayOutputStreams);
+      this.setLogLevel(settings.logLevel || 'info');
     },
   },
 });
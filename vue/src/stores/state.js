@@ -1,12 +1,18 @@
 import { defineStore } from 'pinia';
-import { areMoonsEqual, getDisplayKingdoms } from '@/composables';
+import { getDisplayKingdoms } from '@/composables';
 import availableKingdoms from '../consts/availableKingdoms';
 
+// [kingdom, id] of a moon, how Python refers to moons in the run state
+function moonRef(moon) {
+  return [moon.kingdom, moon.id];
+}
+
 export const useState = defineStore('state', {
   state: () => {
     return {
       showSettings: false,
       moonsByKingdom: [],
+      runStateVersion: 0,
       mentionedMoons: [],
       mentionedMoonCount: 0,
       collectedMoons: [],
@@ -18,6 +24,11 @@ export const useState = defineStore('state', {
         text: '',
         color: 'black',
       },
+      startup: {
+        text: 'Starting',
+        progress: 0,
+        done: false,
+      },
     };
   },
   actions: {
@@ -27,61 +38,85 @@ export const useState = defineStore('state', {
     setMoonsByKingdom(moonsByKingdom) {
       this.moonsByKingdom = moonsByKingdom;
     },
-    removeMoonOptions(moon) {
-      this.mentionedMoons = this.mentionedMoons
-        .map((possibleMoons) =>
-          possibleMoons.length === 1
-            ? possibleMoons
-            : possibleMoons.filter((m) => !areMoonsEqual(moon, m))
-        )
-        .filter((possibleMoons) => possibleMoons.length > 0);
+    moonByRef([kingdom, id]) {
+      return this.moonsByKingdom[kingdom]?.find((moon) => moon.id === id);
     },
-    addMentionedMoon(possibleMoons) {
-      const possibleMoonsWithIndex = possibleMoons.map((moon) => ({
-        ...moon,
-        index: this.mentionedMoonCount,
-      }));
-
-      if (possibleMoons.length === 1) {
-        this.removeMoonOptions(possibleMoons[0]);
-      }
+    mentionOptions(index, refs) {
+      return refs.map((ref) => ({ ...this.moonByRef(ref), index }));
+    },
+    // The run state is kept by Python, fetch all of it with the names of the given languages (all of them if not given)
+    fetchRunState(languages) {
+      window['eel']
+        .get_run_state(languages ?? null)()
+        .then((snapshot) => this.applySnapshot(snapshot))
+        .catch(() => this.showError('Error fetching moon list.'));
+    },
+    applySnapshot(snapshot) {
+      this.moonsByKingdom = snapshot.moons;
+      this.mentionedMoons = snapshot.mentioned.map(([index, refs]) => this.mentionOptions(index, refs));
+      this.mentionedMoonCount = snapshot.mentionCount;
+      this.collectedMoons = snapshot.collected.map((ref) => this.moonByRef(ref));
+      this.runStateVersion = snapshot.version;
+    },
+    // Apply the changes Python made to the run state, returns false if a delta was missed and a snapshot is needed
+    applyDelta(delta) {
+      if (delta.base !== this.runStateVersion) return false;
 
-      this.mentionedMoons.push(possibleMoonsWithIndex);
-      this.mentionedMoonCount++;
+      delta.ops.forEach(([kind, ...args]) => {
+        if (kind === 'reset') {
+          this.mentionedMoons = [];
+          this.collectedMoons = [];
+          this.mentionedMoonCount = 0;
+        } else if (kind === 'mention') {
+          this.mentionedMoons.push(this.mentionOptions(args[0], args[1]));
+          this.mentionedMoonCount = args[0] + 1;
+        } else if (kind === 'options') {
+          const actualIndex = this.mentionedMoons.findIndex(
+            (possibleMoons) => possibleMoons[0].index === args[0]
+          );
+          if (actualIndex >= 0) {
+            this.mentionedMoons[actualIndex] = this.mentionOptions(args[0], args[1]);
+          }
+        } else if (kind === 'delete') {
+          this.mentionedMoons = this.mentionedMoons.filter(
+            (possibleMoons) => possibleMoons[0].index !== args[0]
+          );
+        } else if (kind === 'collect') {
+          this.collectedMoons.push(this.moonByRef(args[0]));
+        } else if (kind === 'uncollect') {
+          this.collectedMoons = this.collectedMoons.filter(
+            (moon) => moon.kingdom !== args[0][0] || moon.id !== args[0][1]
+          );
+        }
+      });
+      this.runStateVersion = delta.version;
+      return true;
+    },
+    // Ask Python to change the run state, the delta it answers with is applied like the ones it pushes
+    runAction(action, ...args) {
+      window['eel']
+        .run_action(action, args)()
+        .then((delta) => {
+          if (delta && !this.applyDelta(delta)) {
+            this.fetchRunState();
+          }
+        })
+        .catch(() => this.showError('Error updating the run.'));
+    },
+    addMentionedMoon(possibleMoons) {
+      this.runAction('mention', possibleMoons.map(moonRef));
     },
     markCorrectOption(index, optionIndex) {
-      const actualIndex = this.mentionedMoons.findIndex(
-        (possibleMoons) => possibleMoons[0].index === index
-      );
-      if (actualIndex >= 0) {
-        this.mentionedMoons[actualIndex] = this.mentionedMoons[actualIndex].splice(optionIndex, 1);
-        this.removeMoonOptions(this.mentionedMoons[actualIndex][0]);
-      }
+      this.runAction('choose_option', index, optionIndex);
     },
     addCollectedMoon(moon) {
-      this.collectedMoons.push(moon);
-
-      const firstOptionsIndex = this.mentionedMoons.findLastIndex(
-        (possibleMoons) =>
-          possibleMoons.length > 1 && possibleMoons.some((m) => areMoonsEqual(moon, m))
-      );
-
-      if (firstOptionsIndex >= 0) {
-        this.mentionedMoons[firstOptionsIndex] = [moon];
-      }
-
-      this.removeMoonOptions(moon);
+      this.runAction('collect', [moonRef(moon)]);
     },
     setMoonUncollected(moon) {
-      this.collectedMoons = this.collectedMoons.filter((m) => !areMoonsEqual(moon, m));
+      this.runAction('uncollect', moonRef(moon));
     },
     deleteMoon(moon, deleteFromCollected) {
-      if (deleteFromCollected) {
-        this.setMoonUncollected(moon);
-      }
-      this.mentionedMoons = this.mentionedMoons.filter(
-        (possibleMoons) => possibleMoons[0].index !== moon.index
-      );
+      this.runAction('delete', moon.index ?? null, moonRef(moon), deleteFromCollected);
     },
     setCurrentKingdomName(currentKingdomName) {
       this.currentKingdomName = currentKingdomName;
@@ -112,5 +147,13 @@ export const useState = defineStore('state', {
     closeSnackbar() {
       this.snackbar.visible = false;
     },
+    setStartupProgress(text, progress) {
+      this.startup.text = text;
+      this.startup.progress = progress;
+      if (progress >= 1 && !this.startup.done) {
+        this.startup.done = true;
+        this.showSuccess(text);
+      }
+    },
   },
 });
@@ -1,3 +1,4 @@
+from capture import CaptureSource
 import ctypes
 import numpy as np
 from PIL import ImageGrab
@@ -18,18 +19,16 @@ def list_open_windows():
     return open_windows
 
 
-class WindowCapture:
+# Capture source grabbing a window, the whole desktop if hwnd is None
+class WindowCapture(CaptureSource):
     # properties
     width = 0
     height = 0
     hwnd = None
-    crop_left = 0
-    crop_top = 0
-    crop_right = 0
-    crop_bottom = 0
 
-    # constructor
+    # constructor, crop_values are (left, top, right, bottom) pixels to trim off the edges
     def __init__(self, hwnd, crop_values=None):
+        super().__init__(crop_values)
         if hwnd is None:
             self.hwnd = win32gui.GetDesktopWindow()
         else:
@@ -40,11 +39,12 @@ class WindowCapture:
         self.width = right - left
         self.height = bottom - top
 
-        # get the crop values
-        if crop_values is not None:
-            self.crop_left, self.crop_top, self.crop_right, self.crop_bottom = crop_values
-
+    # Cropped screenshot or None, for callers that don't need the timestamp
     def get_screenshot(self):
+        return self.read()[0]
+
+    # Uncropped BGR screenshot as a read-only view of the bitmap bits, or None
+    def grab(self):
         try:
             # get the window image data
             window_dc = win32gui.GetWindowDC(self.hwnd)
@@ -59,9 +59,8 @@ class WindowCapture:
             print_window_flag = 0x00000002
             user32.PrintWindow(self.hwnd, dc_object.GetSafeHdc(), print_window_flag)
 
-            # convert the raw data into a format opencv can read
-            img = np.fromstring(data_bitmap.GetBitmapBits(True), dtype='uint8')
-            img.shape = (self.height, self.width, 4)
+            # view the raw data in a format opencv can read, the bytes are the only copy made
+            img = np.frombuffer(data_bitmap.GetBitmapBits(True), dtype=np.uint8).reshape(self.height, self.width, 4)
 
             # free resources
             dc_object.DeleteDC()
@@ -72,19 +71,10 @@ class WindowCapture:
             # drop the alpha channel, or cv.matchTemplate() will throw an error like:
             #   error: (-215:Assertion failed) (depth == CV_8U || depth == CV_32F) && type == _templ.type()
             #   && _img.dims() <= 2 in function 'cv::matchTemplate'
-            img = img[...,:3]
-
-            # make image C_CONTIGUOUS to avoid errors that look like:
-            #   File ... in draw_rectangles
-            #   TypeError: an integer is required (got type tuple)
+            # the view is not C_CONTIGUOUS, OpenCV copies it where it needs to, CaptureSource.read() makes it read-only
             # see the discussion here:
             # https://github.com/opencv/opencv/issues/14866#issuecomment-580207109
-            img = np.ascontiguousarray(img)
-
-            # crop image
-            img = img[self.crop_top:self.height-self.crop_bottom, self.crop_left:self.width-self.crop_right]
-
-            return img
+            return img[..., :3]
         except (win32ui.error, error):
             print("[STATUS] -> Could not read window capture image")
             return None